@@ -4,12 +4,9 @@ import os
 srcpath = os.path.realpath('D:/400_AWT/400_setup_python/Tabor Library/')
 print(srcpath)
 sys.path.append(srcpath)
-from tevisainst import TEVisaInst
-import matplotlib.pyplot as plt
 import numpy as np
 import time
 from TaborProteus import TaborProteus
-import scipy as sp
 from teproteus import TEProteusAdmin as TepAdmin
 from teproteus_functions_v3 import get_cpatured_header
 from teproteus_functions_v3 import connect, disconnect
@@ -22,11 +19,12 @@ def ampScale(bits, rawSignal):
     return dacSignal
 
 def makeChirp(sampleRateDAC, rampTime, fStart, fStop, bits):
+    from scipy.signal import chirp
     dt = 1/sampleRateDAC
     t = np.arange(0, rampTime + dt/2, dt)
     # round t to valid number
     t = t[:len(t)//64 * 64]
-    dacWave = sp.signal.chirp(t, fStart, np.max(t), fStop)
+    dacWave = chirp(t, fStart, np.max(t), fStop)
     dacWave = ampScale(bits, dacWave)
     return dacWave
 
@@ -1,13 +1,11 @@
 import numpy as np
 import time
-import matplotlib.pyplot as plt
 import os
 import sys
 srcpath = os.path.realpath('D:/400_AWT/400_setup_python/Tabor Library')
 sys.path.append(srcpath)
 from teproteus_functions_v3 import get_cpatured_header
 from teproteus_functions_v3 import connect, disconnect
-from tevisainst import TEVisaInst
 from teproteus import TEProteusAdmin as TepAdmin
 from teproteus import TEProteusInst as TepInst
 from TaborProteus import TaborProteus
@@ -295,6 +293,7 @@ def readout_data(inst, MODE, cfr, numframes, ADC_ch):
         # After the code that creates 'frames'
         first_frame = frames[0]
         breakpoint()
+        import matplotlib.pyplot as plt
         plt.figure(figsize=(6, 6))
         plt.scatter(first_frame.real, first_frame.imag, s= 1, alpha= 1)
         plt.xlabel('I (Real)')
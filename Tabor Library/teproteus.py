@@ -638,6 +638,50 @@ class TEProteusAdmin(object):
             return self._tep_get_slot_installed_memory(slotInfPtr)
         return 0
 
+    def get_slots_info(self):
+        '''Gets the information of all PXI slots with Proteus boards in one pass.
+
+        Each slot-info pointer is fetched once and all attributes are read
+        from it (the `get_slot_xxx` methods look it up again per attribute).
+
+        :returns: list of dicts with the keys `slot_id`, `slot_number`,
+                  `chassis_index`, `is_dummy`, `is_in_use`, `parent_instr_id`,
+                  `fpga_version`, `fpga_svn_rev`, `fpga_build_date`, `idn`,
+                  `fw_options`, `hw_options` and `installed_memory` (GB per DDR).
+        '''
+        max_resp_len = 256
+        resp_buf = ct.create_string_buffer(max_resp_len)
+        buf_len = np.uint32(max_resp_len)
+
+        def read_str(func, slot_inf_ptr):
+            ret_code = func(slot_inf_ptr, resp_buf, buf_len)
+            if 0 < ret_code < max_resp_len:
+                return str(resp_buf.value, 'utf-8').strip()
+            return str('')
+
+        slots = []
+        for slot_id in self.get_slot_ids():
+            slot_id = int(slot_id)
+            slotInfPtr = self._tep_get_slot_info(np.uint32(slot_id))
+            if not slotInfPtr:
+                continue
+            slots.append({
+                'slot_id': slot_id,
+                'slot_number': int(self._tep_get_slot_number(slotInfPtr)),
+                'chassis_index': int(self._tep_get_slot_chassis_index(slotInfPtr)),
+                'is_dummy': bool(self._tep_get_slot_is_dummy(slotInfPtr)),
+                'is_in_use': bool(self._tep_get_slot_is_in_use(slotInfPtr)),
+                'parent_instr_id': int(self._tep_get_slot_parent_instr_id(slotInfPtr)),
+                'fpga_version': int(self._tep_get_slot_fpga_version(slotInfPtr)),
+                'fpga_svn_rev': int(self._tep_get_slot_fpga_svn(slotInfPtr)),
+                'fpga_build_date': read_str(self._tep_get_slot_fpga_date, slotInfPtr),
+                'idn': read_str(self._tep_get_slot_idn_str, slotInfPtr),
+                'fw_options': int(self._tep_get_slot_fw_options(slotInfPtr)),
+                'hw_options': int(self._tep_get_slot_hw_options(slotInfPtr)),
+                'installed_memory': int(self._tep_get_slot_installed_memory(slotInfPtr)),
+            })
+        return slots
+
     def open_instrument(self, slot_id, reset_hot_flag=True):
         '''Opens instrument that operates a single slot.
         :param slot_id: the slot identifier.
@@ -850,12 +894,20 @@ class TEProteusInst(object):
     def write_binary_data(self, scpi_pref, bin_dat):
         '''Sends block of binary-data to instrument.
         :param scpi_pref: a SCPI string that defines the data (can be None).
-        :param bin_dat: a `numpy` array with the binary data.
+        :param bin_dat: a `numpy` array, memoryview or any other C-contiguous
+                        buffer-protocol object (e.g. a slice of a larger buffer)
+                        with the binary data. It is passed to the DLL in place;
+                        only a non-contiguous `numpy` array is copied once.
         :returns: zero if succeeded; otherwise, error code.
         '''
         scpi_pref = str(scpi_pref).encode()
         str_ptr = ct.c_char_p(scpi_pref)
 
+        if not isinstance(bin_dat, np.ndarray):
+            bin_dat = np.frombuffer(bin_dat, dtype=np.uint8)
+        elif not bin_dat.flags.c_contiguous:
+            bin_dat = np.ascontiguousarray(bin_dat)
+
         size_in_bytes = bin_dat.nbytes
         p_dat = bin_dat.ctypes.data_as(ct.POINTER(ct.c_uint8))
 
@@ -1,6 +1,5 @@
 from teproteus import TEProteusAdmin as TepAdmin
 from teproteus import TEProteusInst as TepInst
-from tevisainst import TEVisaInst
 
 
 import numpy as np
@@ -10,9 +9,26 @@ import sys
 import os
 import gc
 from numpy import genfromtxt
-import matplotlib.pyplot as plt
-from commpy.modulation import QAMModem
-from commpy.filters import rrcosfilter
+import importlib
+
+# pyvisa, matplotlib and commpy take seconds to import and only a few
+# functions need them, so they are loaded on first use (PEP 562)
+_LAZY_IMPORTS = {
+    'TEVisaInst': ('tevisainst', 'TEVisaInst'),
+    'plt': ('matplotlib.pyplot', None),
+    'QAMModem': ('commpy.modulation', 'QAMModem'),
+    'rrcosfilter': ('commpy.filters', 'rrcosfilter'),
+}
+
+def __getattr__(name):
+    if name not in _LAZY_IMPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module, attr = _LAZY_IMPORTS[name]
+    value = importlib.import_module(module)
+    if attr is not None:
+        value = getattr(value, attr)
+    globals()[name] = value
+    return value
 
 inst = None
 admin = None
@@ -625,6 +641,10 @@ def Digital_Modulation_wave(bitsPerSymbole=2,numOfSymbols=1000,symbolRate=10e6,r
     # 8                  QAM256
     #10                  QAM1024
     
+    # module-level __getattr__ is not consulted for names used inside the module
+    from commpy.modulation import QAMModem
+    from commpy.filters import rrcosfilter
+    import matplotlib.pyplot as plt
     mod = QAMModem(2**bitsPerSymbole)
     sampleRate = fs / interp
     decimation, oversampling = reduceFraction(symbolRate, sampleRate)
@@ -677,6 +697,7 @@ def connect_to_pxi_slot(slot_id=1,Auto=True):
 
 def connect_to_lan_server(ip_address):
     global inst
+    from tevisainst import TEVisaInst
     try:
         disconnect()
         print("Trying to connect to IP:" + ip_address)
@@ -53,37 +53,172 @@ with SCPI commands using VISA based communication.
 '''
 
 import gc
+import time
+import queue
 import socket
 import ctypes
+import threading
 import warnings
 import numpy as np
-import pyvisa as visa
-import pyvisa.constants as vc
+try:
+    import pyvisa as visa
+    import pyvisa.constants as vc
+except ImportError:
+    # only the raw-socket session (raw_socket=True) works without pyvisa
+    visa = None
+    vc = None
 
 __version__ = '1.0.1'
 __docformat__ = 'reStructuredText'
 
 __all__ = ['TEVisaInst', ]
 
+# size of one viRead / recv_into call of a binary block read, and of the
+# socket buffers of a raw-socket session
+LAN_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class SocketResource(object):
+    '''
+    Minimal stand-in for a `pyvisa` ``TCPIP::<host>::<port>::SOCKET``
+    resource on a plain TCP socket, i.e. bypassing the VISA layer.
+
+    It provides the subset of the `pyvisa` resource interface used by
+    :class:`TEVisaInst` (`write`, `read`, `query`, `read_bytes`, `timeout`,
+    `read_termination`, `clear`, `close`) plus `recv_into` and `send_buffer`,
+    which move binary blocks between the socket and a numpy buffer without
+    intermediate copies.
+    '''
+
+    def __init__(self, host, port=5025, timeout_msec=10000,
+                 buff_size=LAN_CHUNK_SIZE):
+        '''
+        Constructor.
+
+        :param host: IP address or host name.
+        :param port: port number.
+        :param timeout_msec: timeout (in milliseconds).
+        :param buff_size: socket send/receive buffer size (in bytes).
+        '''
+        self._sock = socket.create_connection((host, int(port)),
+                                              timeout_msec / 1000.0)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        for opt in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+            try:
+                self._sock.setsockopt(socket.SOL_SOCKET, opt, int(buff_size))
+            except OSError:
+                pass
+        self._pending = bytearray()
+        self._timeout = None
+        self.timeout = timeout_msec
+        self.chunk_size = int(buff_size)
+        self.read_termination = '\n'
+        self.write_termination = '\n'
+        self.resource_name = 'TCPIP::{0}::{1}::SOCKET'.format(host, port)
+
+    @property
+    def timeout(self):
+        '''Timeout in milliseconds (`None` blocks forever).'''
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self._timeout = value
+        self._sock.settimeout(None if value is None else value / 1000.0)
+
+    def write(self, message):
+        '''Sends a message (the write-termination is appended).'''
+        message = str(message)
+        if self.write_termination and \
+                not message.endswith(self.write_termination):
+            message += self.write_termination
+        self._sock.sendall(message.encode())
+
+    def send_buffer(self, data):
+        '''Sends a buffer-protocol object as is (no copy).'''
+        self._sock.sendall(memoryview(data).cast('B'))
+
+    def read(self):
+        '''Reads a message up to the read-termination (`\\n`).'''
+        term = (self.read_termination or '\n').encode()
+        while True:
+            idx = self._pending.find(term)
+            if idx >= 0:
+                line = bytes(self._pending[:idx])
+                del self._pending[:idx + len(term)]
+                return line.decode()
+            data = self._sock.recv(65536)
+            if not data:
+                raise ConnectionError('connection closed by instrument')
+            self._pending += data
+
+    def query(self, message):
+        '''Sends a query and returns the response.'''
+        self.write(message)
+        return self.read()
+
+    def read_bytes(self, count, chunk_size=None):
+        '''Reads exactly `count` bytes.'''
+        del chunk_size
+        buf = bytearray(int(count))
+        self.recv_into(buf)
+        return bytes(buf)
+
+    def recv_into(self, buf):
+        '''Fills the writable buffer `buf` completely.
+
+        :returns: the number of `recv_into` calls.
+        '''
+        view = memoryview(buf).cast('B')
+        nbytes = min(len(self._pending), len(view))
+        if nbytes:
+            view[:nbytes] = self._pending[:nbytes]
+            del self._pending[:nbytes]
+            view = view[nbytes:]
+        calls = 0
+        while len(view):
+            n = self._sock.recv_into(view, min(len(view), self.chunk_size))
+            if n == 0:
+                raise ConnectionError('connection closed by instrument')
+            view = view[n:]
+            calls += 1
+        return calls
+
+    def clear(self):
+        '''Drops any unread input.'''
+        self._pending = bytearray()
+
+    def close(self):
+        '''Closes the socket.'''
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
 
 class TEVisaInst(object):
     '''
     Manage remote instrument with SCPI commands using VISA based communication.
     '''
 
-    def __init__(self, address=None, port=None, use_ni_visa=True):
+    def __init__(self, address=None, port=None, use_ni_visa=True,
+                 raw_socket=False):
         '''
         Constructor.
 
         :param address: IP address or VISA resource-name (optional).
         :param port: port-number for IP address (optional).
         :param use_ni_visa: indicates whether NI-VISA is installed (optional).
+        :param raw_socket: talk to a LAN instrument over a plain TCP socket
+                           instead of VISA (optional, see `SocketResource`).
         '''
         self._use_ni_visa = bool(use_ni_visa)
+        self._raw_socket = bool(raw_socket)
         self._vi = None
         self._visa_resource_name = None
         self._default_paranoia_level = 1
         self._resource_manager = None
+        # bytes, chunks, seconds and MBps of the last binary write
+        self.last_write_stats = None
         if address is not None:
             self.open_instrument(address, port)
 
@@ -170,8 +305,6 @@ class TEVisaInst(object):
             else:
                 port = int(port)
 
-            rsc_mgr = self._get_resource_manager()
-
             rsc_name = address
             try:
                 packed_ip = socket.inet_aton(address)
@@ -181,6 +314,19 @@ class TEVisaInst(object):
             except OSError:
                 pass
 
+            if self._raw_socket:
+                fields = rsc_name.split('::')
+                if len(fields) != 4 or fields[3].upper() != 'SOCKET':
+                    raise ValueError(
+                        'raw_socket needs an IP address or a '
+                        'TCPIP::<host>::<port>::SOCKET resource, '
+                        'got {0}'.format(address))
+                self._vi = SocketResource(fields[1], int(fields[2]))
+                self._visa_resource_name = rsc_name
+                return
+
+            rsc_mgr = self._get_resource_manager()
+
             self._vi = rsc_mgr.open_resource(rsc_name)
 
             if extra_init:
@@ -193,7 +339,7 @@ class TEVisaInst(object):
             try:
                 vi.close()
                 vi = None
-            except visa.Error:
+            except (OSError, visa.Error if visa is not None else OSError):
                 pass
             del vi
         self._visa_resource_name = None
@@ -268,15 +414,120 @@ class TEVisaInst(object):
             bin_dat,
             dtype=None,
             paranoia_level=None,
-            mstmo=30000):
+            mstmo=30000,
+            chunk_size=LAN_CHUNK_SIZE,
+            progress=None):
         '''Sends block of binary-data to instrument.
+
+        The IEEE block header is sent first and then the data itself in
+        `chunk_size` slices of the caller's buffer (no copy is made).
+
+        :param scpi_pref: a SCPI string that defines the data (can be None).
+        :param bin_dat: a `numpy` array (or any buffer-protocol object)
+                        with the binary data.
+        :param dtype: the data-type of the elements if `bin_dat` is a list.
+        :param paranoia_level: either 0, 1, 2 or None.
+        :param mstmo: timeout in milliseconds (can be None).
+        :param chunk_size: bytes per send (optional).
+        :param progress: callback `progress(sent_bytes, total_bytes)`
+                         called after each chunk (optional).
+        :returns: zero if succeeded; otherwise, error code.
+        '''
+        if isinstance(bin_dat, (list, tuple)):
+            bin_dat = np.asarray(bin_dat, dtype=dtype)
+        elif isinstance(bin_dat, np.ndarray):
+            bin_dat = np.ascontiguousarray(bin_dat)
+        view = memoryview(bin_dat).cast('B')
+        chunk_size = int(chunk_size)
+        chunks = (view[offs:offs + chunk_size]
+                  for offs in range(0, len(view), chunk_size))
+        return self._write_block(
+            scpi_pref, chunks, len(view), paranoia_level, mstmo, progress)
+
+    def write_binary_stream(
+            self,
+            scpi_pref,
+            chunks,
+            num_bytes,
+            paranoia_level=None,
+            mstmo=30000,
+            progress=None,
+            prefetch=2):
+        '''Sends a block of binary-data that is produced while it is sent.
+
+        `chunks` is consumed by a background thread, up to `prefetch`
+        chunks ahead of the one on the wire, so generating the waveform
+        overlaps with the transfer and only a few chunks are in memory.
+
         :param scpi_pref: a SCPI string that defines the data (can be None).
-        :param bin_dat: a `numpy` array with the binary data.
-        :param dtype: the data-type of the elements (optional).
+        :param chunks: iterable of buffer-protocol objects (e.g. numpy arrays).
+        :param num_bytes: total size of the chunks in bytes.
         :param paranoia_level: either 0, 1, 2 or None.
         :param mstmo: timeout in milliseconds (can be None).
+        :param progress: callback `progress(sent_bytes, total_bytes)`.
+        :param prefetch: number of chunks produced ahead.
         :returns: zero if succeeded; otherwise, error code.
+
+        If producing a chunk raises, the exception is re-raised here after
+        a partial block was sent; clear or reopen the session before use.
         '''
+        ready = queue.Queue(maxsize=max(1, int(prefetch)))
+        done = object()
+        stop = threading.Event()
+
+        def put(item):
+            # gives up when the sender has stopped (e.g. after an error)
+            while not stop.is_set():
+                try:
+                    ready.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for chunk in chunks:
+                    if isinstance(chunk, np.ndarray):
+                        chunk = np.ascontiguousarray(chunk)
+                    if not put(chunk):
+                        return
+                put(done)
+            except Exception as ex:  # pylint: disable=broad-except
+                put(ex)
+
+        def consume():
+            while True:
+                item = ready.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield memoryview(item).cast('B')
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            return self._write_block(scpi_pref, consume(), int(num_bytes),
+                                     paranoia_level, mstmo, progress)
+        finally:
+            stop.set()
+            producer.join()
+
+    def _write_block(
+            self,
+            scpi_pref,
+            chunks,
+            num_bytes,
+            paranoia_level,
+            mstmo,
+            progress):
+        '''Sends `<scpi_pref>#<n><num_bytes>`, the chunks and a new-line,
+        then handles the paranoia-level.
+
+        The pieces are separate writes of one message: on a VISA session
+        END is only sent with the final new-line (a VXI-11 or HiSLIP
+        instrument would otherwise end the message after the header).'''
 
         ret_val = -1
 
@@ -304,26 +555,41 @@ class TEVisaInst(object):
                 self._vi.timeout = int(mstmo)
 
             try:
-
-                if dtype is None and isinstance(bin_dat, np.ndarray):
-                    dtype = bin_dat.dtype.char
-
-                if dtype is not None:
-                    self._vi.write_binary_values(
-                        scpi_pref, bin_dat, datatype=dtype)
-                else:
-                    self._vi.write_binary_values(scpi_pref, bin_dat)
+                t_start = time.perf_counter()
+                size = str(int(num_bytes))
+                self._set_send_end(False)
+                self._send_raw('{0}#{1}{2}'.format(
+                    scpi_pref, len(size), size).encode())
+                sent = 0
+                num_chunks = 0
+                for chunk in chunks:
+                    self._send_raw(chunk)
+                    sent += len(chunk)
+                    num_chunks += 1
+                    if progress is not None:
+                        progress(sent, num_bytes)
+                if sent != num_bytes:
+                    raise ValueError('sent {0} bytes, the block header '
+                                     'announced {1}'.format(sent, num_bytes))
+                self._set_send_end(True)
+                self._send_raw(b'\n')
 
                 if paranoia_level >= 1:
                     # read the response to the *OPC?
                     self._vi.read()
 
-            except Exception as ex:
+                elapsed = time.perf_counter() - t_start
+                self.last_write_stats = {
+                    'bytes': sent,
+                    'chunks': num_chunks,
+                    'seconds': elapsed,
+                    'MBps': sent / elapsed / 1e6 if elapsed > 0 else 0.0}
+
+            finally:
+                self._set_send_end(True)
                 if orig_tmo is not None:
                     self._vi.timeout = orig_tmo
 
-                raise ex
-
             ret_val = 0
 
             if paranoia_level >= 2:
@@ -343,6 +609,33 @@ class TEVisaInst(object):
 
         return ret_val
 
+    def _set_send_end(self, enable):
+        '''Sets whether a VISA write ends the message (no-op on a raw socket).'''
+        if not isinstance(self._vi, SocketResource):
+            self._vi.set_visa_attribute(
+                vc.VI_ATTR_SEND_END_EN, vc.VI_TRUE if enable else vc.VI_FALSE)
+
+    def _send_raw(self, data):
+        '''Sends the bytes of a buffer-protocol object without a copy.'''
+        if isinstance(self._vi, SocketResource):
+            self._vi.send_buffer(data)
+            return
+        buf = np.frombuffer(data, dtype=np.uint8)
+        p_dat = buf.ctypes.data_as(ctypes.POINTER(ctypes.c_byte))
+        ret_count = ctypes.c_uint32(0)
+        offset = 0
+        while offset < buf.size:
+            ptr = ctypes.cast(ctypes.addressof(p_dat.contents) + offset,
+                              ctypes.POINTER(ctypes.c_byte))
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                err_code = self._vi.visalib.viWrite(
+                    self._vi.session, ptr, int(buf.size - offset),
+                    ctypes.byref(ret_count))
+            if err_code < 0:
+                raise IOError('viWrite failed with error {0}'.format(err_code))
+            offset += ret_count.value
+
     def read_binary_data(
             self,
             scpi_pref,
@@ -396,16 +689,30 @@ class TEVisaInst(object):
                             numbytes = int(szstr)
 
                         if numbytes > out_array.nbytes:
+                            if isinstance(out_array, np.memmap) or \
+                                    out_array.base is not None:
+                                # file-backed buffers and views cannot grow
+                                raise ValueError(
+                                    'out_array holds {0} bytes, {1} bytes are '
+                                    'pending'.format(out_array.nbytes, numbytes))
                             numitems = numbytes // out_array.itemsize
                             out_array.resize(numitems, refcheck=False)
 
+                        offset = 0  # np.uint32(0)
+                        if isinstance(self._vi, SocketResource):
+                            # straight from the socket into out_array
+                            view = memoryview(out_array).cast('B')
+                            self._vi.recv_into(view[:numbytes])
+                            offset = numbytes
+
                         p_dat = out_array.ctypes.data_as(
                             ctypes.POINTER(ctypes.c_byte))
 
+                        # viRead returns up to `chunk` bytes regardless of
+                        # the VISA read buffer, so read MB-scale chunks
                         chunk = self._vi.__dict__.get('read_buff_size', 4096)
-                        chunk = int(chunk)
+                        chunk = max(int(chunk), LAN_CHUNK_SIZE)
 
-                        offset = 0  # np.uint32(0)
                         while offset < numbytes:
                             chunk = min(chunk, numbytes - offset)
 
@@ -451,10 +758,15 @@ class TEVisaInst(object):
     def _init_vi_inst(
             self,
             timeout_msec=10000,
-            read_buff_size_bytes=8192,
-            write_buff_size_bytes=8192):
+            read_buff_size_bytes=LAN_CHUNK_SIZE,
+            write_buff_size_bytes=LAN_CHUNK_SIZE):
         '''Initialize the internal VISA instrument session.
 
+        The formatted-I/O buffers are as large as one binary chunk, so a
+        chunk of a :TRAC:DATA write or of a frame read passes through VISA
+        in one buffer fill instead of 8 KB pieces (both are flushed on
+        every access, so a large buffer does not delay short commands).
+
         :param timeout_msec: VISA-Timeout (in milliseconds)
         :param read_buff_size_bytes: VISA Read-Buffer Size (in bytes)
         :param write_buff_size_bytes: VISA Write-Buffer Size (in bytes)
@@ -1,37 +1,213 @@
 import numpy as np
 import time
-import matplotlib.pyplot as plt
 import os
 import sys
+import threading
+import functools
+from contextlib import contextmanager
 srcpath = os.path.realpath('D:/400_AWT/400_setup_python/Tabor Library')
 sys.path.append(srcpath)
-from tevisainst import TEVisaInst
 from teproteus import TEProteusAdmin as TepAdmin
 from teproteus import TEProteusInst as TepInst
-from proteus_utils import makeDC, makeSqPulse
+from proteus_utils import makeDC, makeSqPulse, as_u16_buffer, interleave_iq, pack_markers, pack_marker_runs
+from scpi_cache import SCPIStateCache
+from proteus_acquisition import HEADER_SIZE, FRAME_SAMPLE_DTYPE, FRAME_GRANULARITY, DSP_MAX_READLEN, parse_headers, header_decisions, plan_acquisition, frame_times
+from proteus_kernels import KernelManager
+from proteus_transport import open_transport, byte_view, SessionTransport
+
+def _exclusive(method):
+    # runs a TaborProteus method as one unit (see TaborProteus.exclusive)
+    @functools.wraps(method)
+    def wrapper(self, *args, **kw):
+        with self.exclusive():
+            return method(self, *args, **kw)
+    return wrapper
+
+class CommandBatch:
+    """
+    Accumulates SCPI commands and sends them as ';'-joined compound messages.
+
+    Each compound message is kept under `max_len` characters. All messages but
+    the last are sent bare (paranoia level 0); the last one goes out at the
+    instrument's default paranoia level, so the whole batch costs a single
+    *OPC? round-trip. Redundant settings are dropped through the state cache.
+    """
+    MAX_MSG_LEN = 256
+
+    def __init__(self, proteus, max_len=None):
+        self.proteus = proteus
+        self.max_len = self.MAX_MSG_LEN if max_len is None else max_len
+        self._cmds = []
+        self._hold = None
+
+    def __enter__(self):
+        # other threads' commands would invalidate what add() checked
+        # against the state cache, so the batch holds the instrument
+        self._hold = self.proteus.exclusive()
+        self._hold.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+            elif self._cmds:
+                # add() recorded the discarded settings as sent
+                self._cmds = []
+                self.proteus.state_cache.invalidate()
+        finally:
+            hold, self._hold = self._hold, None
+            hold.__exit__(exc_type, exc_value, traceback)
+
+    def __len__(self):
+        return len(self._cmds)
+
+    def add(self, cmd):
+        cmd = str(cmd).strip()
+        assert '?' not in cmd, "queries cannot be batched"
+        with self.proteus._lock:
+            if self.proteus.recorder is not None:
+                self.proteus.recorder.command(cmd)
+            if self.proteus.state_cache.is_redundant(cmd):
+                return
+            # inside a compound message a header without leading ':' would be
+            # resolved relative to the previous command, so make it absolute
+            if not cmd.startswith((':', '*')):
+                cmd = ':' + cmd
+            self._cmds.append(cmd)
+            # update now so later commands of the batch see the new selections
+            self.proteus.state_cache.update(cmd)
+
+    def messages(self):
+        """
+        Splits the pending commands into compound messages.
+        """
+        limit = self.max_len - len('; *OPC?')
+        messages, cur = [], ''
+        for cmd in self._cmds:
+            if cur and len(cur) + 2 + len(cmd) > limit:
+                messages.append(cur)
+                cur = ''
+            cur = cmd if not cur else cur + '; ' + cmd
+        if cur:
+            messages.append(cur)
+        return messages
+
+    def flush(self):
+        """
+        Sends the pending commands.
+
+        Returns:
+            error code of the first failed message (zero if all succeeded)
+        """
+        with self.proteus.exclusive():
+            messages = self.messages()
+            self._cmds = []
+            ret = 0
+            for idx, msg in enumerate(messages):
+                last = idx == len(messages) - 1
+                code = self.proteus._write_scpi(msg, None if last else 0)
+                if code != 0 and ret == 0:
+                    ret = code
+            if ret != 0:
+                self.proteus.state_cache.invalidate()
+                self.proteus.resident_segments.clear()
+        return ret
 
 class TaborProteus:
+    # duration of one header TimeStamp count [s]; None calibrates it from the nominal period
+    timestamp_tick = None
+    # channels sharing one segment memory: writing segment n of one channel
+    # overwrites segment n of the others (see _evict_segment)
+    memory_banks = ((1, 2), (3, 4))
+
     @staticmethod
-    def proteus_instance():
+    def proteus_instance(session=False, slot=None, address=None):
+        """
+        Opens the instrument.
+
+        Args:
+            session (bool): attach to a running session daemon (see
+                proteus_session.py), which already has the instrument open;
+                the slot is opened directly if no daemon is running
+            slot (dict): slot requirements for proteus_inventory.Inventory.select,
+                e.g. {'digitizer': True, 'min_memory': 8}; default: first free slot
+            address (str): connect over LAN instead of PXI: an IP address
+                (raw SCPI socket, no VISA needed) or a VISA resource name
+
+        Returns:
+            proteus_transport.Transport around a TEProteusInst (with the
+            selected slot info as `slot_info`), SessionClient or TEVisaInst
+        """
+        if address is not None:
+            from tevisainst import TEVisaInst
+            inst = TEVisaInst(address, raw_socket='::' not in address)
+            print(f"Connected to {address} over LAN")
+            return open_transport(inst)
+        if session:
+            from proteus_session import attach
+            client = attach()
+            if client is not None:
+                print(f"Attached to Proteus session {client.address} ({client.description})")
+                return open_transport(client)
         # Connect to instrument via PXI
+        from proteus_inventory import Inventory
         admin = TepAdmin()
-        # Get list of available PXI slots
-        slot_ids = admin.get_slot_ids()
-        # Assume that at least one slot was found
-        sid = slot_ids[0]
-        # Open a single-slot instrument:
-        inst = admin.open_instrument(slot_id=sid)
-        return inst
-
-    def __init__(self, sampleRateDAC = 675e6, sampleRateADC = 2.7e9, bits = 16, interp = 8, adcChan = 1, dacChan = 1):
+        inventory = Inventory()
+        # slot attributes come from the cached inventory, not one DLL call each
+        info = inventory.select(admin, **(slot or {}))
+        inst = admin.open_instrument(slot_id=info['slot_id'])
+        if inst is None:
+            # the cache was out of date (slot taken or removed)
+            info = inventory.select(admin, refresh=True, **(slot or {}))
+            inst = admin.open_instrument(slot_id=info['slot_id'])
+        assert inst is not None, f"unable to open slot {info['slot_id']}"
+        inst.slot_info = info
+        print(f"Opened slot {info['slot_id']} ({info['model']}, {info['installed_memory']} GB per DDR)")
+        return open_transport(inst)
+
+    def __init__(self, sampleRateDAC = 675e6, sampleRateADC = 2.7e9, bits = 16, interp = 8, adcChan = 1, dacChan = 1, state_cache = True, inst = None, session = False, slot = None, address = None, executor = False):
         # initialize Proteus Parameters
-        self.inst = self.proteus_instance()
+        # inst: an already open instrument (TEProteusInst, proteus_session.SessionClient or
+        # TEVisaInst), used through a proteus_transport.Transport
+        self.inst = open_transport(inst if inst is not None else self.proteus_instance(session, slot, address))
+        # other clients of a session daemon change channels, segments and
+        # modes behind our back, so nothing cached about the instrument holds
+        self.shared_session = isinstance(self.inst, SessionTransport)
+        if executor:
+            # all I/O on one thread, so other threads can poll_query/interrupt
+            # while this one programs (see proteus_executor.py); downloads are
+            # only split for polls with InstrumentExecutor(bulk_chunk = ...)
+            from proteus_executor import InstrumentExecutor
+            self.inst = InstrumentExecutor(self.inst)
+        # inventory entry of the opened slot (None if unknown, e.g. attached to a session)
+        self.slot_info = getattr(self.inst, 'slot_info', None)
         self._sampleRateDAC = sampleRateDAC
         self._sampleRateADC = sampleRateADC
         self._bits = bits
         self._interp = interp
         self._adcChan = adcChan
         self._dacChan = dacChan
+        # guards the caches and transaction state below (see exclusive())
+        self._lock = threading.RLock()
+        self._exclusive_depth = 0
+        # deferred error checking (see transaction())
+        self._txn = None
+        self._txn_depth = 0
+        # last value sent for each settable SCPI path (see scpi_cache.py)
+        self.state_cache = SCPIStateCache(enabled = state_cache and not self.shared_session)
+        # RecipeRecorder capturing every command while a recipe is recorded
+        self.recorder = None
+        # (ch, segMem) -> {'iq': key, 'marker': key} of the content known to be
+        # in segment memory; lets makeBlocks skip unchanged downloads (not
+        # trusted in a shared session)
+        self.resident_segments = {}
+        # DDR holding the DSP decision headers (see configure_dsp_decisions)
+        self.decision_ddr = 2
+        # matched-filter kernels of the DSP decision path (see proteus_kernels.py)
+        self.kernels = KernelManager(self)
+        # binary bytes sent (e.g. for transfer bandwidth, see proteus_cluster.py)
+        self.bytes_written = 0
     
     # Getter and Setter for sampleRateDAC
     @property
@@ -69,6 +245,13 @@ class TaborProteus:
         assert value == 1 or value == 2, "Digitizer's channel should be 1 or 2."
         self._adcChan = value
 
+    @property
+    def saved_round_trips(self):
+        """
+        Number of SCPI commands elided because they would not change state.
+        """
+        return self.state_cache.saved
+
     @property
     def dacChan(self):
         return self._dacChan
@@ -82,18 +265,18 @@ class TaborProteus:
         Resets the Proteus
         """
         # Get the instrument's *IDN
-        inst = self.inst
-        resp = inst.send_scpi_query('*IDN?')
+        resp = self.send_scpi_query('*IDN?')
         print('Connected to: ' + resp)
 
         # Get the model name
-        resp = inst.send_scpi_query(":SYST:iNF:MODel?")
+        resp = self.send_scpi_query(":SYST:iNF:MODel?")
         print("Model: " + resp)
 
-        resp = inst.send_scpi_cmd('*CLS; *RST')
+        resp = self.send_scpi_cmd('*CLS; *RST')
         print("Reset complete")
     
-    def downloadIQ(self, ch, segMem, dacWaveI, dacWaveQ):
+    @_exclusive
+    def downloadIQ(self, ch, segMem, dacWaveI, dacWaveQ=None, out=None):
         """
         Downloads IQ waveform data to the specified channel and segment.
         
@@ -103,52 +286,62 @@ class TaborProteus:
         Args:
             ch (int): Channel number to download waveform to
             segMem (int): Segment memory number
-            dacWaveI (numpy.ndarray): In-phase (I) component of the waveform
+            dacWaveI (numpy.ndarray): In-phase (I) component of the waveform, or
+                the already interleaved U16 data (any C-contiguous buffer) if
+                dacWaveQ is None
             dacWaveQ (numpy.ndarray): Quadrature (Q) component of the waveform
+            out (numpy.ndarray): optional uint16 buffer of 2*len(dacWaveI)
+                samples (e.g. a slice of a larger pooled buffer) to interleave into
             
         Note:
-            - Data is converted to 16-bit unsigned integers for AWG compatibility
-            - Timeout is temporarily increased to 30s for large data transfers
+            - I and Q are converted and interleaved in a single pass; pre-interleaved
+              uint16 data is sent without any copy
+            - Through an InstrumentExecutor with bulk_chunk set, a long segment
+              is written in pieces, with status polls served in between
         """
-        inst = self.inst
         print(f"Downloading waveform to channel {ch}, segment {segMem}")
         
         self.dacChan = ch
-        res = inst.send_scpi_cmd(f':INST:CHAN {ch}')
+        # :TRAC:DEF redefines the segment, markers included
+        self._evict_segment(ch, segMem)
+        if dacWaveQ is None:
+            dacWave_IQ = as_u16_buffer(dacWaveI)
+        else:
+            dacWave_IQ = interleave_iq(dacWaveI, dacWaveQ, out)
+        with self.batch() as batch:
+            batch.add(f':INST:CHAN {ch}')
+            batch.add(f':TRAC:FORM U16')
+            batch.add(f':TRAC:DEF {segMem}, {dacWave_IQ.size}')
+            batch.add(f':TRAC:SEL {segMem}')
 
-        # Interleave I and Q data using Fortran-style ordering (column-major)
-        dacWave_IQ = np.vstack((dacWaveI, dacWaveQ)).reshape((-1,), order = 'F')
-        inst.send_scpi_cmd(f':TRAC:FORM U16')
-        inst.send_scpi_cmd(f':TRAC:DEF {segMem}, {len(dacWave_IQ)}')
-        inst.send_scpi_cmd(f':TRAC:SEL {segMem}')
-
-        # Download the binary data to segment with increased timeout for large transfers
+        # Download the binary data to segment
         prefix = '*OPC?; :TRAC:DATA'
-        myWfm = dacWave_IQ.astype(np.uint16)
-        inst.timeout = 30000
-        inst.write_binary_data(prefix, myWfm)
-        inst.timeout = 10000
-        resp = inst.send_scpi_query(':SYST:ERR?')
-        assert int(resp.split(',')[0]) == 0, f"IQ segment not downloaded correctly. Error code: {resp}"
+        self.write_binary_data(prefix, dacWave_IQ)
+        self.check_errors("IQ segment not downloaded correctly")
 
+    @_exclusive
     def download_waveform(self, ch, segMem, dacWave):
+        """
+        Downloads a single (non-IQ) waveform. uint16 data, including
+        memoryviews and slices of a pooled buffer, is sent without a copy;
+        other dtypes are converted once.
+        """
         print(f"Downloading segment: {segMem}, channel: {ch}")
-        inst = self.inst
-        res = inst.send_scpi_cmd(f':INST:CHAN {ch}')
-        # inst.send_scpi_cmd(f':TRAC:FORM U16')
-        inst.send_scpi_cmd(f':TRAC:DEF {segMem}, {len(dacWave)}')
-        inst.send_scpi_cmd(f':TRAC:SEL {segMem}')
+        dacWave = as_u16_buffer(dacWave)
+        self._evict_segment(ch, segMem)
+        with self.batch() as batch:
+            batch.add(f':INST:CHAN {ch}')
+            # batch.add(f':TRAC:FORM U16')
+            batch.add(f':TRAC:DEF {segMem}, {dacWave.size}')
+            batch.add(f':TRAC:SEL {segMem}')
         
         # Download the binary data to segment
         prefix = '*OPC?; :TRAC:DATA'
-        dacWave = dacWave.astype(np.uint16)
-        inst.timeout = 30000
-        inst.write_binary_data(prefix, dacWave)
-        inst.timeout = 10000
-        resp = inst.send_scpi_query(':SYST:ERR?')
-        assert int(resp.split(',')[0]) == 0, f"IQ segment not downloaded correctly. Error code: {resp}"
+        self.write_binary_data(prefix, dacWave)
+        self.check_errors("IQ segment not downloaded correctly")
 
-    def download_marker(self, ch, segMem, mark1, mark2):
+    @_exclusive
+    def download_marker(self, ch, segMem, mark1, mark2=None, out=None):
         """
         Downloads marker data to the specified channel and segment.
         
@@ -159,151 +352,306 @@ class TaborProteus:
         Args:
             ch (int): Channel number to download marker to
             segMem (int): Segment memory number
-            mark1 (numpy.ndarray): First marker data array
+            mark1 (numpy.ndarray): First marker data array, or the already packed
+                marker bytes (any C-contiguous buffer) if mark2 is None
             mark2 (numpy.ndarray): Second marker data array
+            out (numpy.ndarray): optional uint8 buffer of len(mark1)//2 bytes to
+                pack into
             
         Note:
             - Markers are used for triggering external devices or synchronization
-            - The marker data is combined as: mark1 + 2*mark2
+            - The marker data is combined as: mark1 + 2*mark2, two samples per byte
             - Both markers are enabled after download
         """
-        inst = self.inst
         print(f"Downloading marker to channel: {ch}, segment: {segMem} \n")
-        myMkr = np.uint8(mark1 + 2*mark2)
+        if mark2 is None:
+            myMkr = np.frombuffer(mark1, dtype=np.uint8)
+        else:
+            myMkr = pack_markers(mark1, mark2, out)
+        self._evict_segment(ch, segMem, marker_only = True)
         # set DAC channel
         self.dacChan = ch
-        res = inst.send_scpi_cmd(f':INST:CHAN {ch}')
+        batch = self.batch()
+        batch.add(f':INST:CHAN {ch}')
+        batch.add(f":TRAC:SEL {segMem}")
+        res = batch.flush()
         assert res == 0, "channel not correctly set"
-        inst.send_scpi_cmd(f":TRAC:SEL {segMem}")
-        myMkr = myMkr[0::2] + 16 * myMkr[1::2]
-        myMkr = myMkr.astype(np.uint8)
         prefix = ':MARK:DATA 0,'
-        inst.write_binary_data(prefix, myMkr)
-        resp = inst.send_scpi_query(':SYST:ERR?')
-        assert int(resp.split(',')[0]) == 0
-        inst.send_scpi_cmd(':MARK:SEL 1')
-        inst.send_scpi_cmd(':MARK:STAT ON')
-        inst.send_scpi_cmd(':MARK:SEL 2')
+        self.write_binary_data(prefix, myMkr)
+        self.check_errors("marker not downloaded correctly")
+        with self.batch() as batch:
+            batch.add(':MARK:SEL 1')
+            batch.add(':MARK:STAT ON')
+            batch.add(':MARK:SEL 2')
+            batch.add(':MARK:STAT ON')
+        self.check_errors("markers not enabled")
 
-        inst.send_scpi_cmd(':MARK:STAT ON')
-        resp = inst.send_scpi_query(':SYST:ERR?')
-        assert int(resp.split(',')[0]) == 0
+    def download_marker_runs(self, ch, segMem, segLen, runs1, runs2, out=None):
+        """
+        Downloads markers given as run-length descriptions.
+
+        Args:
+            ch (int): Channel number to download marker to
+            segMem (int): Segment memory number
+            segLen (int): Segment length in samples
+            runs1 (list): (start, stop) sample intervals where marker 1 is high
+            runs2 (list): (start, stop) sample intervals where marker 2 is high
+            out (numpy.ndarray): optional uint8 buffer of segLen//2 bytes to pack into
+        """
+        myMkr = pack_marker_runs(segLen, runs1, runs2, out)
+        self.download_marker(ch, segMem, myMkr)
+
+    def _evict_segment(self, ch, segMem, marker_only = False):
+        # forgets segment segMem (or only its markers) on every channel of
+        # ch's memory bank, which the coming download overwrites
+        bank = next((bank for bank in self.memory_banks if ch in bank), (ch,))
+        for other in bank:
+            if marker_only:
+                self.resident_segments.get((other, segMem), {}).pop('marker', None)
+            else:
+                self.resident_segments.pop((other, segMem), None)
+
+    @_exclusive
+    def load_segment(self, ch, segMem, iq_key, make_iq, segLen, runs1, runs2):
+        """
+        Makes sure a segment holds the given IQ and marker content, downloading
+        only the parts that differ from what is resident. When only the marker
+        runs changed, just :MARK:DATA is rewritten and make_iq is never called.
+
+        Args:
+            ch (int): Channel number
+            segMem (int): Segment memory number
+            iq_key (tuple): hashable description of the IQ content
+            make_iq (callable): returns (dacWaveI, dacWaveQ) for iq_key
+            segLen (int): Segment length in samples
+            runs1, runs2 (list): marker runs (see download_marker_runs)
+
+        Note:
+            - Nothing is skipped while a recipe is recorded, so the recipe
+              always holds the full segment data, nor in a shared session
+        """
+        resident = self.resident_segments.get((ch, segMem), {})
+        force = self.recorder is not None or self.shared_session
+        if force or resident.get('iq') != iq_key:
+            self.downloadIQ(ch, segMem, *make_iq())
+            resident = {'iq': iq_key}
+        else:
+            print(f"Segment {segMem} on channel {ch} already resident")
+        mark_key = (segLen, tuple(map(tuple, runs1)), tuple(map(tuple, runs2)))
+        if force or resident.get('marker') != mark_key:
+            self.download_marker_runs(ch, segMem, segLen, runs1, runs2)
+            resident['marker'] = mark_key
+        self.resident_segments[(ch, segMem)] = resident
 
     def makeBlocks(self, block_l, ch, repeatSeq):
-        inst = self.inst
-        assert len(block_l) == len(repeatSeq), "length of the array"
-        numBlocks = len(block_l)
-        numPulses = 0
-        lengthPts = []
-        spacingsPts = []
-        seg_dict = {}
-
-        # holding segment
+        """
+        Downloads the segments of the pulse blocks to channel `ch` and writes
+        its task table (segment 1 and the last one hold DC, one segment per
+        pulse in between).
+        """
+        self.program_channels({ch: (block_l, repeatSeq)}, dedupe = False)
+
+    def _round_pulse(self, pulse):
+        # length and spacing in samples, rounded down to the 64-sample segment
+        # granularity; the pulse is not modified (1e-9 absorbs float noise, so
+        # a pulse written back by round_pulses rounds to the same points)
+        spacingPt = int(np.floor(self.sampleRateDAC * pulse['spacing'] / 64 + 1e-9)) * 64
+        lengthPt = int(np.floor(self.sampleRateDAC * pulse['length'] / 64 + 1e-9)) * 64
+        return lengthPt, spacingPt
+
+    def round_pulses(self, compiled):
+        """
+        Writes the rounded length and spacing of the compiled pulses back into
+        their pulse dicts (e.g. for KernelManager.upload_for_pulse).
+        """
+        for prog in compiled.values():
+            for pulse, lengthPt, spacingPt in prog['rounded']:
+                pulse['length'], pulse['spacing'] = lengthPt / self.sampleRateDAC, spacingPt / self.sampleRateDAC
+                print(f"This is new pulse length {pulse['length']}")
+                print(f"This is new spacing length {pulse['spacing']}")
+
+    def _pulse_segment(self, pulse, lengthPt, spacingPt, marker, trig):
+        # segment description (see compile_channels) of a rounded pulse
+        def make_pulse():
+            spacing_I, spacing_Q = makeDC(spacingPt)
+            # Make Pulse
+            ON_I, ON_Q = makeSqPulse(modFreq = 0, segLen = lengthPt, amp = pulse['amp'], \
+                                phase = pulse['phase'], mods = pulse['mod'], sampleRateDAC = self.sampleRateDAC)
+            return np.concatenate((ON_I, spacing_I)), np.concatenate((ON_Q, spacing_Q))
+        # markers are high while the pulse is on, low during the spacing
+        return {'iq_key': (lengthPt, spacingPt, pulse['amp'], pulse['phase'], pulse['mod'], self.sampleRateDAC),
+                'make_iq': make_pulse, 'segLen': lengthPt + spacingPt,
+                'runs1': [(0, lengthPt)] if marker else [], 'runs2': [(0, lengthPt)] if trig else []}
+
+    def compile_channels(self, programs, dedupe = True, segment_banks = None):
+        """
+        Lays out the segments and task tables of several channels without
+        sending anything.
+
+        Args:
+            programs (dict): {ch: (block_l, repeatSeq)} as for makeBlocks
+            dedupe (bool): give identical segments (same IQ and markers) one
+                segment number instead of one per task
+            segment_banks (tuple): groups of channels sharing segment memory,
+                e.g. ((1, 2), (3, 4)); identical segments of a group are then
+                downloaded once, by the first channel that uses them
+
+        Returns:
+            {ch: {'block_l', 'repeatSeq', 'segs': segment number of each task,
+            'loads': segment descriptions (segMem, iq_key, make_iq, segLen, runs1,
+            runs2) this channel downloads, 'rounded': (pulse, lengthPt, spacingPt)
+            of each distinct pulse}}, in channel order; the pulse dicts are
+            not modified (see round_pulses)
+        """
+        bank_of = {}
+        for bank in segment_banks or ():
+            for ch in bank:
+                bank_of[ch] = tuple(bank)
         DClen = 64
-        holdI, holdQ = makeDC(DClen)
-        markHold = np.zeros(DClen).astype(np.uint8)
-
-        # Flatten the pulse list from the block_l
-        seg_num = 1
-        self.downloadIQ(ch, seg_num, holdI, holdQ)
-        self.download_marker(ch, seg_num, markHold, markHold)
-        seg_num = seg_num + 1
-        for block in block_l:
-            pulse_l = block['pulse_l']
-            markers = block['markers']
-            trigs = block['trigs']
-            for pulse_idx, pulse in enumerate(pulse_l):
-                #hard coded for now
-                spacingPt = self.sampleRateDAC * pulse['spacing'] // 64 * 64
-                lengthPt = self.sampleRateDAC * pulse['length'] // 64 * 64
-                spacingPt, lengthPt = int(spacingPt), int(lengthPt)
-                pulse_len = lengthPt / self.sampleRateDAC
-                spacing_len = spacingPt / self.sampleRateDAC
-                pulse['length'], pulse['spacing'] = pulse_len, spacing_len
-                print(f"This is new pulse length {pulse['length']} for pulse: {pulse_idx}")
-                print(f"This is new spacing length {pulse['spacing']} for pulse: {pulse_idx}")
-                spacing_I, spacing_Q = makeDC(spacingPt)
-                mark_DC, mark_DC2 = np.zeros(spacingPt), np.zeros(spacingPt)
-                
-                # Make Pulse
-                ON_I, ON_Q = makeSqPulse(modFreq = 0, segLen = lengthPt, amp = pulse['amp'], \
-                                    phase = pulse['phase'], mods = pulse['mod'], sampleRateDAC = self.sampleRateDAC)
-                mark_IQ, mark_IQ2  = np.zeros(lengthPt) + markers[pulse_idx], np.zeros(lengthPt) + trigs[pulse_idx]
-                pulse_I, pulse_Q = np.concatenate((ON_I, spacing_I)), np.concatenate((ON_Q, spacing_Q))
-                mark1, mark2 = np.concatenate((mark_IQ, mark_DC)).astype(np.uint8), np.concatenate((mark_IQ2, mark_DC2)).astype(np.uint8)
-
-                # downloadIQ and download_marker
-                self.downloadIQ(ch, seg_num, pulse_I, pulse_Q)
-                self.download_marker(ch, seg_num, mark1, mark2)
-                seg_num = seg_num + 1
-        self.downloadIQ(ch, seg_num, holdI, holdQ)
-        self.download_marker(ch, seg_num, markHold, markHold)
-        self.setTask_Pulse(block_l, ch, numSegs = seg_num, repeatSeq=repeatSeq)
-
-    def setTask_Pulse(self, block_l, ch, numSegs, repeatSeq):
+        hold = {'iq_key': ('DC', DClen), 'make_iq': lambda: makeDC(DClen), 'segLen': DClen, 'runs1': [], 'runs2': []}
+        next_seg, seg_of, rounded = {}, {}, {}
+        compiled = {}
+        for ch in sorted(programs):
+            block_l, repeatSeq = programs[ch]
+            assert len(block_l) == len(repeatSeq), "length of the array"
+            bank = bank_of.get(ch, (ch,))
+            # hold segment, the pulses, hold segment
+            tasks = [hold]
+            pulse_pts = []
+            for block in block_l:
+                for pulse_idx, pulse in enumerate(block['pulse_l']):
+                    # round each pulse once, even if it is played several times
+                    if id(pulse) not in rounded:
+                        rounded[id(pulse)] = self._round_pulse(pulse)
+                        pulse_pts.append((pulse,) + rounded[id(pulse)])
+                    tasks.append(self._pulse_segment(pulse, *rounded[id(pulse)],
+                                                     block['markers'][pulse_idx], block['trigs'][pulse_idx]))
+            tasks.append(hold)
+            segs, loads = [], []
+            for task in tasks:
+                content = (bank, task['iq_key'], task['segLen'], tuple(map(tuple, task['runs1'])), tuple(map(tuple, task['runs2'])))
+                if not dedupe or content not in seg_of:
+                    segMem = next_seg.get(bank, 1)
+                    next_seg[bank] = segMem + 1
+                    seg_of[content] = segMem
+                    loads.append((segMem, task['iq_key'], task['make_iq'], task['segLen'], task['runs1'], task['runs2']))
+                segs.append(seg_of[content])
+            compiled[ch] = {'block_l': block_l, 'repeatSeq': repeatSeq, 'segs': segs, 'loads': loads,
+                            'rounded': pulse_pts}
+        return compiled
+
+    @_exclusive
+    def program_channels(self, programs, dedupe = True, segment_banks = None, update_pulses = True):
+        """
+        Programs several DAC channels in one pass: compiles all channels
+        (compile_channels), renders every distinct IQ segment once into one
+        pooled buffer, then downloads channel by channel (a single :INST:CHAN
+        each) and writes each task table, all in one transaction.
+
+        Args:
+            programs (dict): {ch: (block_l, repeatSeq)} as for makeBlocks
+            dedupe, segment_banks: see compile_channels
+            update_pulses (bool): write the rounded lengths back into the
+                pulse dicts (round_pulses) once programmed
+
+        Returns:
+            the compiled layout (see compile_channels)
+        """
+        compiled = self.compile_channels(programs, dedupe, segment_banks)
+        # render what is not resident yet; equal IQ content is rendered once
+        # for all channels and downloaded zero-copy from the pool
+        render = {}
+        for ch, prog in compiled.items():
+            for segMem, iq_key, make_iq, segLen, runs1, runs2 in prog['loads']:
+                resident = self.resident_segments.get((ch, segMem), {})
+                force = self.recorder is not None or self.shared_session
+                if (force or resident.get('iq') != iq_key) and iq_key not in render:
+                    render[iq_key] = (make_iq, segLen)
+        pool = np.empty(2 * sum(segLen for _, segLen in render.values()), dtype=np.uint16)
+        rendered, offset = {}, 0
+        for iq_key, (make_iq, segLen) in render.items():
+            rendered[iq_key] = interleave_iq(*make_iq(), out = pool[offset:offset + 2*segLen])
+            offset += 2 * segLen
+        # all segments are downloaded at paranoia level 0, errors are read once
+        with self.transaction():
+            for ch, prog in compiled.items():
+                for segMem, iq_key, make_iq, segLen, runs1, runs2 in prog['loads']:
+                    make = (lambda iq_key = iq_key: (rendered[iq_key], None)) if iq_key in rendered else make_iq
+                    self.load_segment(ch, segMem, iq_key, make, segLen, runs1, runs2)
+                self.setTask_Pulse(prog['block_l'], ch, numSegs = len(prog['segs']), repeatSeq = prog['repeatSeq'], segs = prog['segs'])
+        if update_pulses:
+            self.round_pulses(compiled)
+        return compiled
+
+    @_exclusive
+    def setTask_Pulse(self, block_l, ch, numSegs, repeatSeq, segs = None):
+        # segs: segment number of each task (default: task i plays segment i)
         print('setting task table')
-        inst = self.inst
+        if segs is None:
+            segs = list(range(1, numSegs + 1))
         SEGM_num = 1
-        inst.send_scpi_cmd(f':INST:CHAN {ch}')
-        self.dacChan = ch
-        inst.send_scpi_cmd('TASK:ZERO:ALL')
-        inst.send_scpi_cmd(f':TASK:COMP:LENG {numSegs}')
-        inst.send_scpi_cmd(f':TASK:COMP:SEL {SEGM_num}')
-        inst.send_scpi_cmd(':TASK:COMP:LOOP 1')
-        inst.send_scpi_cmd(':TASK:COMP:ENAB CPU')
-        inst.send_scpi_cmd(f':TASK:COMP:SEGM {SEGM_num}')
-        inst.send_scpi_cmd(f':TASK:COMP:NEXT1 {SEGM_num+1}')
-        inst.send_scpi_cmd(':TASK:COMP:TYPE SING')
-        SEGM_num += 1
-        for b_idx, block in enumerate(block_l):
-            pulse_l, reps, trigs = block['pulse_l'], block['reps'], block['trigs']
-            for p_idx in range(len(pulse_l)):
-                inst.send_scpi_cmd(f':TASK:COMP:SEL {SEGM_num}')
-                inst.send_scpi_cmd(f':TASK:COMP:SEGM {SEGM_num}')
-                inst.send_scpi_cmd(f':TASK:COMP:LOOP {reps[p_idx]}')
+        with self.batch() as batch:
+            batch.add(f':INST:CHAN {ch}')
+            self.dacChan = ch
+            batch.add('TASK:ZERO:ALL')
+            batch.add(f':TASK:COMP:LENG {numSegs}')
+            batch.add(f':TASK:COMP:SEL {SEGM_num}')
+            batch.add(':TASK:COMP:LOOP 1')
+            batch.add(':TASK:COMP:ENAB CPU')
+            batch.add(f':TASK:COMP:SEGM {segs[SEGM_num - 1]}')
+            batch.add(f':TASK:COMP:NEXT1 {SEGM_num+1}')
+            batch.add(':TASK:COMP:TYPE SING')
+            SEGM_num += 1
+            for b_idx, block in enumerate(block_l):
+                pulse_l, reps, trigs = block['pulse_l'], block['reps'], block['trigs']
+                for p_idx in range(len(pulse_l)):
+                    batch.add(f':TASK:COMP:SEL {SEGM_num}')
+                    batch.add(f':TASK:COMP:SEGM {segs[SEGM_num - 1]}')
+                    batch.add(f':TASK:COMP:LOOP {reps[p_idx]}')
                 
-                if repeatSeq[b_idx] > 1 and p_idx == 0:
-                    inst.send_scpi_cmd('TASK:COMP:TYPE STAR')
-                    inst.send_scpi_cmd(f':TASK:COMP:SEQ {repeatSeq[b_idx]}')
-                elif repeatSeq[b_idx] > 1 and p_idx != (len(pulse_l) - 1):
-                    inst.send_scpi_cmd('TASK:COMP:TYPE SEQ')
-                elif repeatSeq[b_idx] > 1 and p_idx == (len(pulse_l) - 1):
-                    inst.send_scpi_cmd('TASK:COMP:TYPE END')
-                else:
-                    inst.send_scpi_cmd(':TASK:COMP:TYPE SING')
-                inst.send_scpi_cmd(f':TASK:COMP:NEXT1 {SEGM_num+1}')
-                SEGM_num += 1
+                    if repeatSeq[b_idx] > 1 and p_idx == 0:
+                        batch.add('TASK:COMP:TYPE STAR')
+                        batch.add(f':TASK:COMP:SEQ {repeatSeq[b_idx]}')
+                    elif repeatSeq[b_idx] > 1 and p_idx != (len(pulse_l) - 1):
+                        batch.add('TASK:COMP:TYPE SEQ')
+                    elif repeatSeq[b_idx] > 1 and p_idx == (len(pulse_l) - 1):
+                        batch.add('TASK:COMP:TYPE END')
+                    else:
+                        batch.add(':TASK:COMP:TYPE SING')
+                    batch.add(f':TASK:COMP:NEXT1 {SEGM_num+1}')
+                    SEGM_num += 1
         
-        inst.send_scpi_cmd(f':TASK:COMP:SEL {SEGM_num}')
-        inst.send_scpi_cmd(':TASK:COMP:LOOP 1')
-        inst.send_scpi_cmd(':TASK:COMP:ENAB CPU')
-        inst.send_scpi_cmd(f':TASK:COMP:SEGM {SEGM_num}')
-        inst.send_scpi_cmd(':TASK:COMP:NEXT1 1')
-        inst.send_scpi_cmd(':TASK:COMP:TYPE SING')
-
-        inst.send_scpi_cmd(':TASK:COMP:WRITE')
-        inst.send_scpi_cmd(':SOUR:FUNC:MODE TASK')
+            batch.add(f':TASK:COMP:SEL {SEGM_num}')
+            batch.add(':TASK:COMP:LOOP 1')
+            batch.add(':TASK:COMP:ENAB CPU')
+            batch.add(f':TASK:COMP:SEGM {segs[SEGM_num - 1]}')
+            batch.add(':TASK:COMP:NEXT1 1')
+            batch.add(':TASK:COMP:TYPE SING')
+
+            batch.add(':TASK:COMP:WRITE')
+            batch.add(':SOUR:FUNC:MODE TASK')
     
     def initialize_AWG(self, ch):
         print("Initializing AWG...")
-        inst = self.inst
         # set active channel
-        inst.send_scpi_cmd(f':INST:CHAN {ch}')
-        self.dacChan = ch
-        # pseudo command to use 16 bit mode
-        inst.send_scpi_cmd(':FREQ:RAST 2.5E9')
-        inst.send_scpi_cmd(':SOUR:VOLT MAX')
-        inst.send_scpi_cmd(':INIT:CONT ON')
-        inst.send_scpi_cmd(':TRAC:DEL:ALL')
+        with self.batch() as batch:
+            batch.add(f':INST:CHAN {ch}')
+            self.dacChan = ch
+            # pseudo command to use 16 bit mode
+            batch.add(':FREQ:RAST 2.5E9')
+            batch.add(':SOUR:VOLT MAX')
+            batch.add(':INIT:CONT ON')
+            batch.add(':TRAC:DEL:ALL')
         print("AWG Initialization done.")
     
     def set_NCO(self, cfr, phase):
         print("Setting NCO...")
-        inst = self.inst
-        inst.send_scpi_cmd(':SOUR:NCO:SIXD1 ON')
-        inst.send_scpi_cmd(f':SOUR:NCO:CFR1 {cfr}')
-        inst.send_scpi_cmd(f':SOUR:NCO:PHAS1 {phase}')
-        resp = inst.send_scpi_cmd(':OUTP ON')
+        batch = self.batch()
+        batch.add(':SOUR:NCO:SIXD1 ON')
+        batch.add(f':SOUR:NCO:CFR1 {cfr}')
+        batch.add(f':SOUR:NCO:PHAS1 {phase}')
+        batch.add(':OUTP ON')
+        resp = batch.flush()
         assert resp == 0, "NCO not correctly set"
         print("NCO IQ modulation set.")
 
@@ -311,138 +659,638 @@ class TaborProteus:
         """
         Returns new DAC's sample rate.
         """
-        inst = self.inst
         print("Setting Interpolation...")
-        inst.send_scpi_cmd(f':INST:CHAN {ch}')
-        self.dacChan = ch
-        # pseudo command to use 16 bit mode, also for IQ Modulation
-        inst.send_scpi_cmd(':FREQ:RAST 2.5E9')
+        with self.batch() as batch:
+            batch.add(f':INST:CHAN {ch}')
+            self.dacChan = ch
+            # pseudo command to use 16 bit mode, also for IQ Modulation
+            batch.add(':FREQ:RAST 2.5E9')
 
-        inst.send_scpi_cmd(f':SOUR:INT X{interp_factor}')
+            batch.add(f':SOUR:INT X{interp_factor}')
 
-        inst.send_scpi_cmd(':MODE DUC')
-        inst.send_scpi_cmd(':IQM ONE')
-        # multiply sampleRateDAC by 8 -- the interpolation factor -- and set it to AWG.
-        self.sampleRateDAC = self.sampleRateDAC * interp_factor
-        inst.send_scpi_cmd(f':FREQ:RAST {self.sampleRateDAC}')
+            batch.add(':MODE DUC')
+            batch.add(':IQM ONE')
+            # multiply sampleRateDAC by 8 -- the interpolation factor -- and set it to AWG.
+            self.sampleRateDAC = self.sampleRateDAC * interp_factor
+            batch.add(f':FREQ:RAST {self.sampleRateDAC}')
         print("Done setting interpolation factor.")
         return self.sampleRateDAC
         
-    def set_digitizer(self, sampleRateADC, numframes, cfr, tacq, acq_delay, ADC_ch):
-        inst = self.inst
-        readLen = int(tacq*(sampleRateADC)/16) // 96 * 96
-        cmd = ':DIG:MODE DUAL'
-        inst.send_scpi_cmd(cmd)
+    def set_digitizer(self, sampleRateADC, numframes, cfr, tacq, acq_delay, ADC_ch, bandwidth = 0):
+        """
+        Sets up frame capture of the DDC output.
+
+        The frame length comes from plan_acquisition: the shortest legal
+        frame that covers tacq. An infeasible request (including
+        sampleRateADC != sampleRateDAC/4) raises ValueError before any
+        command is sent.
+
+        Args:
+            ADC_ch (int or tuple): digitizer channel, or (1, 2) to capture both
+                channels in one shot (read them with read_channels)
+            cfr (float or tuple): DDC center frequency, or one per channel
+
+        Returns:
+            (readLen, numframes)
+        """
+        channels = tuple(np.atleast_1d(ADC_ch).tolist())
+        cfrs = tuple(np.broadcast_to(cfr, len(channels)).tolist())
+        # each channel captures into one DDR
+        max_bytes = self.slot_info['memory_bytes'] if self.slot_info else None
+        plan = plan_acquisition(tacq, numframes, sampleRateADC, sampleRateDAC = self.sampleRateDAC,
+                                bandwidth = bandwidth, max_bytes = max_bytes)
+        readLen = plan['readLen']
+        print(f"Acquisition plan: {plan}")
+        batch = self.batch()
+        batch.add(':DIG:MODE DUAL')
         print('ADC Clk Freq {0}'.format(sampleRateADC))
-        cmd = ':DIG:FREQ  {0}'.format(sampleRateADC)
-        inst.send_scpi_cmd(cmd)
-        resp = inst.send_scpi_query(':DIG:FREQ?')
+        batch.add(':DIG:FREQ  {0}'.format(sampleRateADC))
+        batch.flush()
+        resp = self.send_scpi_query(':DIG:FREQ?')
         print("Dig Frequency = ")
         print(resp)
 
-        # Enable capturing data from channel ADC_ch
-        cmd = f':DIG:CHAN:SEL {ADC_ch}'
-        inst.send_scpi_cmd(cmd)
-        self.adcChan = ADC_ch
-        resp = inst.send_scpi_query(':SYST:ERR?')
-        print("Dig error = ")
-        print(resp)
-        # DDC activation to complex i+jq
-        inst.send_scpi_cmd(':DIG:DDC:MODE COMP')
-        inst.send_scpi_cmd(f':DIG:DDC:CFR{ADC_ch} {cfr}')
-        inst.send_scpi_cmd(f':DIG:DDC:PHAS{ADC_ch} 0')
-        inst.send_scpi_cmd(':DIG:DDC:CLKS AWG')
-        resp = inst.send_scpi_query(':SYST:ERR?')
-        print("Set complex error = ")
-        print(resp)
-        inst.send_scpi_cmd(':DIG:CHAN:STATE ENAB')
+        # ~20 setup commands go out as a few compound messages with one *OPC?
+        with self.batch() as batch:
+            # DDC activation to complex i+jq
+            batch.add(':DIG:DDC:MODE COMP')
+            batch.add(':DIG:DDC:CLKS AWG')
+            for ch, ch_cfr in zip(channels, cfrs):
+                # Enable capturing data from channel ch
+                batch.add(f':DIG:CHAN:SEL {ch}')
+                batch.add(f':DIG:DDC:CFR{ch} {ch_cfr}')
+                batch.add(f':DIG:DDC:PHAS{ch} 0')
+                batch.add(':DIG:CHAN:STATE ENAB')
+            self.adcChan = channels[0]
+            batch.add(f':DIG:CHAN:SEL {channels[0]}')
 
-        # trigger from external source
-        inst.send_scpi_cmd(':DIG:TRIG:SOUR EXT')
-        inst.send_scpi_cmd(':DIG:TRIG:SLOP NEG')
-        
-        inst.send_scpi_cmd(':DIG:TRIG:LEV1 1')
-        inst.send_scpi_cmd(f':DIG:TRIG:DEL:EXT {acq_delay}' )
-        resp = inst.send_scpi_query(':SYST:ERR?')
-        print("Set complex error = ")
-        print(resp)
-        inst.send_scpi_cmd(':DIG:DDC:DEC X16')
+            # trigger from external source
+            batch.add(':DIG:TRIG:SOUR EXT')
+            batch.add(':DIG:TRIG:SLOP NEG')
+            batch.add(':DIG:TRIG:LEV1 1')
+            batch.add(f':DIG:TRIG:DEL:EXT {acq_delay}')
+            batch.add(f":DIG:DDC:DEC X{plan['decimation']}")
 
-        print(f"numframes = {numframes}, readLen = {readLen}")
-        inst.send_scpi_cmd(':DIG:ACQ:DEF {0},{1}'.format(numframes, 2*readLen))
-        inst.send_scpi_cmd(':DIG:ACQ:FRAM:CAPT:ALL')
-        inst.send_scpi_cmd(':DIG:ACQ:ZERO:ALL')
+            print(f"numframes = {numframes}, readLen = {readLen}")
+            batch.add(':DIG:ACQ:DEF {0},{1}'.format(numframes, 2*readLen))
+            batch.add(':DIG:ACQ:FRAM:CAPT:ALL')
+            batch.add(':DIG:ACQ:ZERO:ALL')
+        self.check_errors("Dig setup error", strict=False)
         ################################################################################
         # Start the digitizer's capturing machine
-        inst.send_scpi_cmd(':DIG:INIT OFF')
-        inst.send_scpi_cmd(':DIG:INIT ON')
+        self.send_scpi_cmd(':DIG:INIT OFF')
+        self.send_scpi_cmd(':DIG:INIT ON')
         return readLen, numframes
-    
-    def send_scpi_cmd(self, cmd):
-        self.inst.send_scpi_cmd(cmd)
+
+    def configure_dsp_decisions(self, numframes, cfr, readLen, acq_delay, ADC_ch = 1, kernel_pulse = None, ddr = 2):
+        """
+        Sets up the digitizer so that each frame is integrated on the FPGA and
+        only the 88-byte frame headers (holding the IQ decisions) are stored.
+
+        Args:
+            numframes (int): number of frames (triggers) to capture
+            cfr (float): DDC center frequency
+            readLen (int): frame length (multiple of 96); the DSP integrates readLen/4 points
+            acq_delay (float): delay after the external trigger [s]
+            ADC_ch (int): digitizer channel
+            kernel_pulse (dict): defPulse whose matched-filter kernel is uploaded
+                to DSP1 (the instrument's default kernel is used if None)
+            ddr (int): DDR the headers are stored in; it is enabled here and
+                read_decisions reads from it
+
+        Returns:
+            (readLen, numframes)
+
+        Note:
+            - Readout is numframes*88 bytes instead of numframes*2*readLen*2
+        """
+        assert readLen % FRAME_GRANULARITY == 0, f"readLen must be a multiple of {FRAME_GRANULARITY}"
+        assert readLen <= DSP_MAX_READLEN, f"the DSP integrates at most {DSP_MAX_READLEN} points per frame"
+        sampleRateADC = self.sampleRateADC
+        batch = self.batch()
+        batch.add(':DIG:ACQ:TYPE HEAD')
+        batch.add(':DIG:MODE DUAL')
+        print('ADC Clk Freq {0}'.format(sampleRateADC))
+        batch.add(':DIG:FREQ {0}'.format(sampleRateADC))
+        batch.flush()
+        resp = self.send_scpi_query(':DIG:FREQ?')
+        print("Dig Frequency = ")
+        print(resp)
+
+        with self.batch() as batch:
+            batch.add(f':DIG:CHAN:SEL {ADC_ch}')
+            self.adcChan = ADC_ch
+            # DDC activation to complex i+jq
+            batch.add(':DIG:DDC:MODE COMP')
+            batch.add(f':DIG:DDC:CFR{ADC_ch} {cfr}')
+            batch.add(f':DIG:DDC:PHAS{ADC_ch} 90')
+            batch.add(':DIG:DDC:CLKS AWG')
+            batch.add(':DIG:CHAN:STATE ENAB')
+            batch.add(':DIG:CHAN:RANG HIGH')
+            if ddr != ADC_ch:
+                # the DDR holding the headers has to capture as well
+                batch.add(f':DIG:CHAN:SEL {ddr}')
+                batch.add(':DIG:CHAN:STATE ENAB')
+                batch.add(':DIG:CHAN:RANG HIGH')
+            self.decision_ddr = ddr
+
+            # trigger from external source
+            batch.add(':DIG:TRIG:SOUR EXT')
+            batch.add(':DIG:TRIG:SLOP NEG')
+            batch.add(':DIG:TRIG:LEV1 1')
+            batch.add(f':DIG:TRIG:DEL:EXT {acq_delay}')
+
+            print(f"numframes = {numframes}, readLen = {readLen}")
+            batch.add(':DIG:ACQ:DEF {0},{1}'.format(numframes, 2*readLen))
+            batch.add(':DIG:ACQ:FRAM:CAPT:ALL')
+            batch.add(':DIG:ACQ:ZERO:ALL')
+
+            # store the DSP decisions, integrating over the whole frame
+            batch.add(':DIG:DDC:BIND ON')
+            batch.add(':DSP:STOR DSP')
+            batch.add(':DSP:DEC:FRAM {0}'.format(readLen // 4))
+        if kernel_pulse is not None:
+            self.kernels.upload_for_pulse(kernel_pulse, cfr)
+        self.check_errors("DSP decision setup error")
+        self.send_scpi_cmd(':DIG:INIT OFF')
+        self.send_scpi_cmd(':DIG:INIT ON')
+        return readLen, numframes
+
+    def wait_for_frames(self, numframes, max_iter = 1200, poll = 0.1):
+        """
+        Polls :DIG:ACQ:FRAM:STAT? until numframes frames were captured.
+
+        Returns:
+            number of frames captured (less than numframes on timeout)
+        """
+        frameRx = 0
+        for _ in range(max_iter):
+            resp = self.poll_query(':DIG:ACQuire:FRAM:STATus?')
+            frameRx = int(resp.split(",")[3])
+            if frameRx >= numframes:
+                break
+            time.sleep(poll)
+        return frameRx
+
+    @_exclusive
+    def read_headers(self, numframes, ddr = None, avgEn = False, out = None):
+        """
+        Reads the headers of the captured frames.
+
+        Args:
+            numframes (int): number of frames captured
+            ddr (int): DDR the DSP results are stored in (default: the one
+                configure_dsp_decisions set up)
+            avgEn (bool): frames were averaged on the FPGA
+            out (numpy.ndarray): optional uint8 buffer of numframes*88 bytes
+                (e.g. a CaptureRun memmap) to read into
+
+        Returns:
+            structured array of headers (see proteus_acquisition.HEADER_DTYPE)
+        """
+        ddr = self.decision_ddr if ddr is None else ddr
+        self.send_scpi_cmd(':DIG:INIT OFF')
+        with self.batch() as batch:
+            batch.add(':DIG:DATA:SEL ALL')
+            batch.add(':DIG:DATA:TYPE HEAD')
+            batch.add(f':DIG:CHAN:SEL {ddr}')
+        num_bytes = numframes * HEADER_SIZE
+        header = np.empty(num_bytes, dtype=np.uint8) if out is None else out
+        assert header.nbytes == num_bytes, f"header buffer must hold {num_bytes} bytes"
+        rc = self.read_binary_data(':DIG:DATA:READ?', header, num_bytes)
+        assert rc == 0, f"header readout failed. Error code: {rc}"
+        return parse_headers(header, avgEn)
+
+    @_exclusive
+    def read_frames(self, numframes, run = None, ddr = None):
+        """
+        Reads the captured frames (:DIG:DATA:TYPE FRAM) and, when a capture
+        run is given, their headers.
+
+        Args:
+            numframes (int): number of frames captured
+            run (CaptureRun): if given, frames and headers are read straight
+                into file-backed arrays of the run (see capture_store.py)
+            ddr (int): DDR to read (the selected digitizer channel if None)
+
+        Returns:
+            uint16 numpy.ndarray (numpy.memmap with a run) of the raw frame data
+        """
+        self.send_scpi_cmd(':DIG:INIT OFF')
+        ddr = self.adcChan if ddr is None else ddr
+        with self.batch() as batch:
+            batch.add(f':DIG:CHAN:SEL {ddr}')
+            # Choose which frames to read (all in this example)
+            batch.add(':DIG:DATA:SEL ALL')
+            # Choose what to read
+            batch.add(':DIG:DATA:TYPE FRAM')
+
+        # Get the total data size (in bytes)
+        resp = self.send_scpi_query(':DIG:DATA:SIZE?')
+        num_bytes = int(resp)
+        print('Total size in bytes: ' + resp)
+        # because read format is UINT16 we divide byte number by 2
+        if run is None:
+            frames = np.empty(num_bytes // 2, dtype=np.uint16)
+        else:
+            frames = run.allocate('frames', num_bytes // 2, np.uint16)
+        start = time.time()
+        rc = self.read_binary_data(':DIG:DATA:READ?', frames, num_bytes)
+        assert rc == 0, f"frame readout failed. Error code: {rc}"
+        if run is not None:
+            headers = run.allocate('headers', numframes * HEADER_SIZE, np.uint8)
+            self.read_headers(numframes, ddr, out = headers)
+            run.update(numframes = numframes, ddr = ddr, bytes = num_bytes, read_time = time.time() - start)
+            run.flush()
+        return frames
+
+    def time_axis(self, headers, period = None):
+        """
+        Trigger time of each frame from the header TimeStamps.
+
+        Args:
+            headers: frame headers (read_headers, CaptureRun.headers)
+            period (float): nominal trigger period [s]; calibrates the
+                TimeStamp tick unless timestamp_tick is set
+
+        Returns:
+            dict of proteus_acquisition.frame_times (time, period, missed, ...)
+        """
+        timing = frame_times(headers, self.timestamp_tick, period)
+        if timing['n_missed'] or len(timing['irregular']):
+            print(f"{timing['n_missed']} missed triggers before frames {timing['missed']}, "
+                  f"irregular spacing before frames {timing['irregular']}")
+        return timing
+
+    @_exclusive
+    def read_channels(self, numframes, channels = (1, 2), run = None):
+        """
+        Reads the frames of several digitizer channels (after
+        set_digitizer(..., ADC_ch = (1, 2), ...)) back to back into one
+        preallocated array.
+
+        Args:
+            numframes (int): number of frames captured
+            channels (tuple): DDRs to read
+            run (CaptureRun): if given, frames and headers are read into
+                file-backed arrays of the run
+
+        Returns:
+            array of shape (len(channels), samples) with dtype
+            proteus_acquisition.FRAME_SAMPLE_DTYPE; decode it with demux_frames
+        """
+        self.send_scpi_cmd(':DIG:INIT OFF')
+        with self.batch() as batch:
+            batch.add(f':DIG:CHAN:SEL {channels[0]}')
+            batch.add(':DIG:DATA:SEL ALL')
+            batch.add(':DIG:DATA:TYPE FRAM')
+        num_bytes = int(self.send_scpi_query(':DIG:DATA:SIZE?'))
+        assert num_bytes % FRAME_SAMPLE_DTYPE.itemsize == 0, f"unexpected frame data size {num_bytes}"
+        shape = (len(channels), num_bytes // FRAME_SAMPLE_DTYPE.itemsize)
+        if run is None:
+            raw = np.empty(shape, dtype=FRAME_SAMPLE_DTYPE)
+        else:
+            raw = run.allocate('frames', shape, FRAME_SAMPLE_DTYPE)
+        start = time.time()
+        for idx, ch in enumerate(channels):
+            if idx > 0:
+                self.send_scpi_cmd(f':DIG:CHAN:SEL {ch}')
+                size = int(self.send_scpi_query(':DIG:DATA:SIZE?'))
+                assert size == num_bytes, f"DDR{ch} holds {size} bytes, DDR{channels[0]} {num_bytes}"
+            rc = self.read_binary_data(':DIG:DATA:READ?', raw[idx], num_bytes)
+            assert rc == 0, f"frame readout of DDR{ch} failed. Error code: {rc}"
+        if run is not None:
+            headers = run.allocate('headers', (len(channels), numframes * HEADER_SIZE), np.uint8)
+            for idx, ch in enumerate(channels):
+                self.read_headers(numframes, ch, out = headers[idx])
+            run.update(numframes = numframes, channels = list(channels), bytes = len(channels) * num_bytes,
+                       read_time = time.time() - start)
+            run.flush()
+        return raw
+
+    def read_decisions(self, numframes, dsp = 1, ddr = None):
+        """
+        Reads the DSP decisions of all captured frames (after configure_dsp_decisions),
+        from the DDR it configured unless `ddr` is given.
+
+        Returns:
+            complex numpy.ndarray of numframes decisions (real + 1j*im)
+        """
+        return header_decisions(self.read_headers(numframes, ddr), dsp)
+
+    def send_scpi_cmd(self, cmd, paranoia_level=None):
+        """
+        Sends a SCPI command. Inside a transaction the command is sent bare
+        (paranoia level 0) and logged so errors can be attributed at commit.
+        Settings that are already in effect (per state_cache) are not sent.
+        """
+        with self._lock:
+            if self.recorder is not None:
+                self.recorder.command(cmd)
+            if self.state_cache.is_redundant(cmd):
+                return 0
+            ret = self._write_scpi(cmd, paranoia_level)
+            self.state_cache.update(cmd, ret)
+            return ret
+
+    def batch(self, max_len=None):
+        """
+        Returns a CommandBatch that sends the added commands as ';'-joined
+        compound messages. Used as a context manager it flushes on exit.
+        """
+        return CommandBatch(self, max_len)
+
+    def _write_scpi(self, cmd, paranoia_level=None):
+        # single place where SCPI strings reach the instrument
+        if self._txn is not None:
+            self._txn['cmds'].append(cmd)
+            paranoia_level = 0
+        upper = cmd.upper()
+        if '*RST' in upper or 'TRAC:DEL' in upper or 'TRACE:DEL' in upper:
+            self.resident_segments.clear()
+        if '*RST' in upper:
+            self.kernels.invalidate()
+        return self.inst.send_scpi_cmd(cmd, paranoia_level)
         
     def send_scpi_query(self, cmd):
         return self.inst.send_scpi_query(cmd)
-    
+
+    def poll_query(self, cmd):
+        """
+        Sends a status query that may overtake other threads' work: through
+        an InstrumentExecutor it goes ahead of queued commands and past a
+        held exclusive(); otherwise it is a plain query.
+        """
+        poll = getattr(self.inst, 'poll', None)
+        if poll is not None:
+            return poll(cmd).result()
+        return self.inst.send_scpi_query(cmd)
+
+    def interrupt(self, cmd = None):
+        """
+        Sends `cmd` (e.g. ':DIG:INIT OFF') from a monitoring thread. Through
+        an InstrumentExecutor it goes ahead of queued commands and a running
+        chunked download is stopped after its current piece; otherwise it is
+        a plain command. Cached settings are forgotten either way.
+
+        Returns:
+            error code of `cmd` (None without one)
+        """
+        abort = getattr(self.inst, 'abort', None)
+        if abort is not None:
+            ret = abort(cmd).result()
+        else:
+            ret = None if cmd is None else self.inst.send_scpi_cmd(cmd)
+        self.state_cache.invalidate()
+        return ret
+
+    def write_binary_data(self, prefix, data):
+        """
+        Sends a binary block. `data` may be any C-contiguous buffer-protocol
+        object (numpy array, memoryview, slice of a pooled buffer) and is
+        passed to the instrument without a copy.
+        """
+        with self._lock:
+            if self.recorder is not None:
+                self.recorder.binary(prefix, data)
+            nbytes = memoryview(data).nbytes
+            if self._txn is not None:
+                self._txn['cmds'].append(f'{prefix} <{nbytes} bytes>')
+            self.bytes_written += nbytes
+            return self.inst.write_binary_data(prefix, data)
+
+    def write_binary_stream(self, prefix, chunks, num_bytes, progress=None):
+        """
+        Sends a binary block of `num_bytes` given as an iterable of chunks,
+        e.g. a long waveform generated piece by piece. Over LAN the chunks are
+        sent while the rest is still being produced; other transports gather
+        them into one block (see proteus_transport.py).
+        """
+        with self._lock:
+            if self.recorder is not None:
+                # the recipe needs the whole block
+                chunks = [byte_view(chunk) for chunk in chunks]
+                self.recorder.binary(prefix, np.concatenate(chunks))
+            if self._txn is not None:
+                self._txn['cmds'].append(f'{prefix} <{num_bytes} bytes>')
+            self.bytes_written += int(num_bytes)
+            return self.inst.write_binary_stream(prefix, chunks, num_bytes, progress)
+
     def read_binary_data(self, cmd, data, num_bytes):
+        """
+        Reads exactly `num_bytes` into the start of `data` on any transport.
+        """
         return self.inst.read_binary_data(cmd, data, num_bytes)
 
+    def read_errors(self, max_errors=64):
+        """
+        Drains the instrument's error queue.
+
+        Returns:
+            list of the error strings (empty if the queue was clear)
+        """
+        errors = []
+        for _ in range(max_errors):
+            resp = self.send_scpi_query(':SYST:ERR?')
+            if int(resp.split(',')[0]) == 0:
+                break
+            errors.append(resp)
+        return errors
+
+    def check_errors(self, label, strict=True):
+        """
+        Checks the error queue after a group of commands.
+
+        Outside a transaction :SYST:ERR? is queried right away. Inside a
+        transaction the commands sent since the previous check are only
+        tagged with `label` and the queue is drained once at commit, unless
+        the transaction attributes errors (then it is drained here).
+
+        Args:
+            label (str): description of the commands being checked
+            strict (bool): assert on error if True, otherwise only print it
+        """
+        if self._txn is not None:
+            self._mark_range(label, strict)
+            if self._txn['attribute']:
+                self._drain_txn_errors()
+            return
+        resp = self.send_scpi_query(':SYST:ERR?')
+        if int(resp.split(',')[0]) != 0:
+            self.state_cache.invalidate()
+            self.resident_segments.clear()
+        if strict:
+            assert int(resp.split(',')[0]) == 0, f"{label}. Error code: {resp}"
+        else:
+            print(f"{label} = ")
+            print(resp)
+
+    def begin_transaction(self, attribute=False):
+        """
+        Starts deferred error checking. Transactions nest; only the outermost
+        commit drains the error queue.
+
+        Args:
+            attribute (bool): drain the queue at every check_errors, so each
+                error is reported with the group of commands that raised it
+                (one :SYST:ERR? per check; commands are still sent bare).
+                Otherwise an error at commit can only be narrowed down to
+                the groups checked since the last checkpoint.
+        """
+        self._txn_depth += 1
+        if self._txn is None:
+            self._txn = {'cmds': [], 'ranges': [], 'start': 0, 'attribute': False}
+        self._txn['attribute'] |= attribute
+
+    def checkpoint(self, label='checkpoint'):
+        """
+        Drains the error queue inside a transaction, so later errors are
+        attributed to a narrower range of commands.
+        """
+        if self._txn is None:
+            return self.check_errors(label)
+        self._mark_range(label, True)
+        self._drain_txn_errors()
+
+    def commit(self):
+        """
+        Ends a transaction. The outermost commit drains the error queue once
+        and asserts if any error was raised by the commands in a strict range.
+        """
+        assert self._txn_depth > 0, "no transaction to commit"
+        self._txn_depth -= 1
+        if self._txn_depth > 0:
+            return
+        self._mark_range('end of transaction', True)
+        errors = self.read_errors()
+        txn = self._txn
+        self._txn = None
+        self._raise_txn_errors(errors, txn)
+
+    def abort(self):
+        """
+        Drops the current transaction and clears the error queue.
+        """
+        with self._lock:
+            self._txn_depth = 0
+            self._txn = None
+            self.state_cache.invalidate()
+            self.resident_segments.clear()
+            self.inst.send_scpi_cmd('*CLS')
+
+    @contextmanager
+    def transaction(self, attribute=False):
+        """
+        Context manager around begin_transaction / commit.
+
+        Example:
+            with proteus.transaction():
+                proteus.downloadIQ(1, 2, I, Q)
+                proteus.download_marker(1, 2, m1, m2)
+
+        The instrument is held for the whole transaction (see exclusive()).
+        """
+        with self.exclusive():
+            self.begin_transaction(attribute)
+            try:
+                yield self
+            except BaseException:
+                self.abort()
+                raise
+            self.commit()
+
+    @contextmanager
+    def exclusive(self):
+        """
+        Keeps other threads (and, on a session daemon or InstrumentExecutor,
+        other clients) away from the instrument and from this object's caches
+        for the duration of the block. Reentrant. Take it through this
+        method rather than self.inst.exclusive(), so the locks are always
+        taken in the same order.
+
+        Example:
+            with proteus.exclusive():
+                proteus.send_scpi_cmd(':INST:CHAN 2')
+                proteus.send_scpi_query(':OUTP?')
+        """
+        with self._lock:
+            self._exclusive_depth += 1
+            try:
+                if self._exclusive_depth == 1 and hasattr(self.inst, 'exclusive'):
+                    with self.inst.exclusive():
+                        yield self
+                else:
+                    yield self
+            finally:
+                self._exclusive_depth -= 1
+
+    def _mark_range(self, label, strict):
+        # close the range of commands sent since the previous check
+        txn = self._txn
+        end = len(txn['cmds'])
+        if end > txn['start']:
+            txn['ranges'].append((label, txn['start'], end, strict))
+            txn['start'] = end
+
+    def _drain_txn_errors(self):
+        # errors in the queue now were raised by the ranges marked since the last drain
+        self._raise_txn_errors(self.read_errors())
+        self._txn['ranges'] = []
+
+    def _raise_txn_errors(self, errors, txn=None):
+        if not errors:
+            return
+        # some command failed, so the cached values cannot be trusted
+        self.state_cache.invalidate()
+        self.resident_segments.clear()
+        txn = self._txn if txn is None else txn
+        msg = [f"SYST:ERR: {err}" for err in errors]
+        if len(txn['ranges']) > 1:
+            # the queue does not say which command failed
+            msg.append(f"  raised by one of these {len(txn['ranges'])} groups "
+                       f"(transaction(attribute = True) tells them apart):")
+        for label, start, end, strict in txn['ranges']:
+            msg.append(f"  {label}: commands {start}..{end - 1} "
+                       f"({txn['cmds'][start]!r} .. {txn['cmds'][end - 1]!r})")
+        msg = '\n'.join(msg)
+        if any(strict for _, _, _, strict in txn['ranges']):
+            raise AssertionError(msg)
+        print(msg)
+
     def set_chirp_tasktable(self, ch, segMem, num_reps):
-        inst = self.inst
-        reps_per_entry = int(1e6)
-        num_full_reps = num_reps // reps_per_entry
-        num_left = num_reps % reps_per_entry
-        num_total_entries = num_full_reps + (1 if num_left else 0)
+        self._chirp_tasktable(ch, segMem, num_reps, 'CPU')
 
-        inst.send_scpi_cmd(f':INST:CHAN {ch}')
-        inst.send_scpi_cmd('TASK:ZERO:ALL')
-        inst.send_scpi_cmd(f':TASK:COMP:LENG {num_total_entries}')
-        inst.send_scpi_cmd(':TASK:COMP:ENAB CPU')
-
-        segNum = 1
-        for _ in range(int(num_full_reps)):
-            inst.send_scpi_cmd(f':TASK:COMP:SEL {segMem}')
-            inst.send_scpi_cmd(f':TASK:COMP:LOOP {reps_per_entry}')
-            inst.send_scpi_cmd(f':TASK:COMP:SEGM {segNum}')
-            inst.send_scpi_cmd(':TASK:COMP:TYPE SING')
-            inst.send_scpi_cmd(f':TASK:COMP:NEXT1 {segNum+1}')
-            segNum += 1
-
-        if num_left:
-            inst.send_scpi_cmd(f':TASK:COMP:SEL {segMem}')
-            inst.send_scpi_cmd(f':TASK:COMP:LOOP {int(num_left)}')
-            inst.send_scpi_cmd(f':TASK:COMP:SEGM {segNum}')
-            inst.send_scpi_cmd(':TASK:COMP:TYPE SING')
-            inst.send_scpi_cmd(f':TASK:COMP:NEXT1 0')
-        inst.send_scpi_cmd(':TASK:COMP:WRITE')
-        inst.send_scpi_cmd(':SOUR:FUNC:MODE TASK')
-    
     def set_chirp_tasktable_trig(self, ch, segMem, num_reps, trig_num):
-        inst = self.inst
+        self._chirp_tasktable(ch, segMem, num_reps, f'TRG{int(trig_num)}')
+
+    @_exclusive
+    def _chirp_tasktable(self, ch, segMem, num_reps, enable):
+        # the whole table goes out as a few compound messages
         reps_per_entry = int(1e6)
         num_full_reps = num_reps // reps_per_entry
         num_left = num_reps % reps_per_entry
         num_total_entries = num_full_reps + (1 if num_left else 0)
 
-        inst.send_scpi_cmd(f':INST:CHAN {ch}')
-        inst.send_scpi_cmd('TASK:ZERO:ALL')
-        inst.send_scpi_cmd(f':TASK:COMP:LENG {num_total_entries}')
-        inst.send_scpi_cmd(f':TASK:COMP:ENAB TRG{int(trig_num)}')
-
-        segNum = 1
-        for _ in range(int(num_full_reps)):
-            inst.send_scpi_cmd(f':TASK:COMP:SEL {segMem}')
-            inst.send_scpi_cmd(f':TASK:COMP:LOOP {reps_per_entry}')
-            inst.send_scpi_cmd(f':TASK:COMP:SEGM {segNum}')
-            inst.send_scpi_cmd(':TASK:COMP:TYPE SING')
-            inst.send_scpi_cmd(f':TASK:COMP:NEXT1 {segNum+1}')
-            segNum += 1
-
-        if num_left:
-            inst.send_scpi_cmd(f':TASK:COMP:SEL {segMem}')
-            inst.send_scpi_cmd(f':TASK:COMP:LOOP {int(num_left)}')
-            inst.send_scpi_cmd(f':TASK:COMP:SEGM {segNum}')
-            inst.send_scpi_cmd(':TASK:COMP:TYPE SING')
-            inst.send_scpi_cmd(f':TASK:COMP:NEXT1 0')
-        inst.send_scpi_cmd(':TASK:COMP:WRITE')
-        inst.send_scpi_cmd(':SOUR:FUNC:MODE TASK')
\ No newline at end of file
+        with self.batch() as batch:
+            batch.add(f':INST:CHAN {ch}')
+            batch.add('TASK:ZERO:ALL')
+            batch.add(f':TASK:COMP:LENG {num_total_entries}')
+            batch.add(f':TASK:COMP:ENAB {enable}')
+
+            segNum = 1
+            for _ in range(int(num_full_reps)):
+                batch.add(f':TASK:COMP:SEL {segMem}')
+                batch.add(f':TASK:COMP:LOOP {reps_per_entry}')
+                batch.add(f':TASK:COMP:SEGM {segNum}')
+                batch.add(':TASK:COMP:TYPE SING')
+                batch.add(f':TASK:COMP:NEXT1 {segNum+1}')
+                segNum += 1
+
+            if num_left:
+                batch.add(f':TASK:COMP:SEL {segMem}')
+                batch.add(f':TASK:COMP:LOOP {int(num_left)}')
+                batch.add(f':TASK:COMP:SEGM {segNum}')
+                batch.add(':TASK:COMP:TYPE SING')
+                batch.add(f':TASK:COMP:NEXT1 0')
+            batch.add(':TASK:COMP:WRITE')
+            batch.add(':SOUR:FUNC:MODE TASK')
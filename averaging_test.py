@@ -4,8 +4,6 @@ import os
 srcpath = os.path.realpath('D:/400_AWT/400_setup_python/Tabor Library/')
 print(srcpath)
 sys.path.append(srcpath)
-from tevisainst import TEVisaInst
-import matplotlib.pyplot as plt
 import numpy as np
 import time
 from teproteus import TEProteusAdmin as TepAdmin
@@ -339,6 +337,7 @@ def main():
         wave_i = convert_binoffset_to_signed(wave_i, 15)
         x=range((int)(readLen / 4))
         print(len(wave_i))
+        import matplotlib.pyplot as plt
         plt.plot(x, wave_q, x, wave_i)
         plt.show
 
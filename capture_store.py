@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import numpy as np
+from proteus_utils import json_default
+from proteus_acquisition import HEADER_DTYPE, AVG_HEADER_DTYPE
+
+
+class CaptureRun:
+    """
+    One acquisition on disk: a directory of raw .bin arrays plus meta.json.
+
+        meta.json     settings, creation time and the dtype/shape of each array
+        frames.bin    raw :DIG:DATA:READ? frame data
+        headers.bin   the 88-byte frame headers
+
+    Arrays are numpy.memmaps, so the digitizer can read straight into them
+    and later analysis opens them without loading the file into RAM.
+    """
+    def __init__(self, path, meta, mode='r'):
+        self.path = path
+        self.meta = meta
+        self.mode = mode
+        self._arrays = {}
+
+    @classmethod
+    def open(cls, path, mode='r'):
+        """
+        Opens an existing run (read-only by default).
+        """
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        return cls(path, meta, mode)
+
+    @property
+    def settings(self):
+        return self.meta['settings']
+
+    def allocate(self, name, shape, dtype):
+        """
+        Creates a file-backed array of the given shape/dtype in the run.
+
+        Returns:
+            numpy.memmap opened for writing
+        """
+        assert self.mode != 'r', "run is opened read-only"
+        dtype = np.dtype(dtype)
+        shape = tuple(np.atleast_1d(shape).tolist())
+        arr = np.memmap(os.path.join(self.path, f'{name}.bin'), dtype=dtype, mode='w+', shape=shape)
+        self.meta['arrays'][name] = {'dtype': _dtype_to_json(dtype), 'shape': list(shape)}
+        self._arrays[name] = arr
+        self.save_meta()
+        return arr
+
+    def __getitem__(self, name):
+        """
+        Returns a stored array as a memmap (zero-copy).
+        """
+        if name not in self._arrays:
+            info = self.meta['arrays'][name]
+            dtype = _dtype_from_json(info['dtype'])
+            self._arrays[name] = np.memmap(os.path.join(self.path, f'{name}.bin'), dtype=dtype,
+                                           mode='r' if self.mode == 'r' else 'r+', shape=tuple(info['shape']))
+        return self._arrays[name]
+
+    def __contains__(self, name):
+        return name in self.meta['arrays']
+
+    def headers(self):
+        """
+        Returns the frame headers as a structured array (see proteus_acquisition).
+        """
+        raw = self['headers']
+        dtype = AVG_HEADER_DTYPE if self.settings.get('avgEn') else HEADER_DTYPE
+        # one row per channel for read_channels runs
+        return np.frombuffer(raw, dtype=dtype).reshape(raw.shape[:-1] + (-1,))
+
+    def update(self, **meta):
+        """
+        Adds entries to meta.json (e.g. acquisition status after the read).
+        """
+        self.meta.update(meta)
+        self.save_meta()
+
+    def save_meta(self):
+        tmp = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.meta, f, indent=1, default=json_default)
+        os.replace(tmp, os.path.join(self.path, 'meta.json'))
+
+    def flush(self):
+        for arr in self._arrays.values():
+            if arr.mode != 'r':
+                arr.flush()
+
+    def close(self):
+        self.flush()
+        self._arrays = {}
+
+
+class CaptureStore:
+    """
+    Directory of capture runs, one subdirectory per acquisition.
+
+    Example:
+        store = CaptureStore('captures')
+        run = store.new_run(settings)
+        proteus.read_frames(numframes, run = run)
+        ...
+        run = store.open(store.runs()[-1])
+        frames = run['frames']
+    """
+    def __init__(self, root='captures'):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def new_run(self, settings, name=None):
+        """
+        Creates a run directory; `settings` (a JSON-able dict, e.g. the pulse,
+        digitizer and cfr parameters) is stored in meta.json.
+        """
+        if name is None:
+            name = time.strftime('%Y%m%d-%H%M%S') + f'-{time.time_ns() % 1000000:06d}'
+        path = os.path.join(self.root, name)
+        os.makedirs(path)
+        meta = {'name': name, 'created': time.time(), 'settings': settings, 'arrays': {}}
+        run = CaptureRun(path, meta, mode='w+')
+        run.save_meta()
+        return run
+
+    def runs(self):
+        """
+        Returns the run names, oldest first.
+        """
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.exists(os.path.join(self.root, name, 'meta.json')))
+
+    def open(self, name, mode='r'):
+        return CaptureRun.open(os.path.join(self.root, name), mode)
+
+
+def _dtype_to_json(dtype):
+    return dtype.descr if dtype.names else dtype.str
+
+
+def _dtype_from_json(desc):
+    if isinstance(desc, str):
+        return np.dtype(desc)
+    return np.dtype([tuple(field) for field in desc])
@@ -0,0 +1,81 @@
+import os
+import sys
+import subprocess
+import time
+
+# Measures how long the instrument modules and run scripts take to import,
+# each in a fresh interpreter (python -X importtime), and which imported
+# packages account for most of it.
+#
+#   python import_benchmark.py
+#   python import_benchmark.py TaborProteus test_Sage --top 5
+
+MODULES = ['proteus_utils', 'teproteus_functions_v3', 'TaborProteus', 'test_Sage']
+LIB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Tabor Library')
+
+
+def import_time(module, repeat=3):
+    """
+    Imports `module` in `repeat` fresh interpreters.
+
+    Returns:
+        (best wall time [s], {top-level package: cumulative import time [s]})
+        of the fastest run, or (None, error message) if the import fails
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [LIB_PATH, os.path.dirname(LIB_PATH), env.get('PYTHONPATH')]))
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                              env=env, capture_output=True, text=True)
+        wall = time.perf_counter() - t0
+        if proc.returncode != 0:
+            return None, proc.stderr.strip().splitlines()[-1]
+        if best is None or wall < best[0]:
+            best = (wall, _by_package(proc.stderr, module))
+    return best
+
+
+def _by_package(stderr, module):
+    # "import time: self [us] | cumulative | imported package"; nesting is
+    # two spaces per level, so the imports made directly by `module` are
+    # the lines one level deep
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        if depth > 1 or name == module or name in ('site', 'encodings'):
+            continue
+        name = name.split('.')[0]
+        packages[name] = packages.get(name, 0) + int(cumulative) * 1e-6
+    return packages
+
+
+def main(argv):
+    top = 8
+    if '--top' in argv:
+        i = argv.index('--top')
+        top = int(argv[i + 1])
+        argv = argv[:i] + argv[i + 2:]
+    modules = argv or MODULES
+    # baseline: interpreter start-up alone
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'])
+    startup = time.perf_counter() - t0
+    print(f"interpreter start-up: {startup * 1e3:8.1f} ms")
+    for module in modules:
+        wall, packages = import_time(module)
+        if wall is None:
+            print(f"{module}: import failed ({packages})")
+            continue
+        print(f"{module}: {wall * 1e3:8.1f} ms wall, {(wall - startup) * 1e3:8.1f} ms over start-up")
+        for name, t in sorted(packages.items(), key=lambda kv: -kv[1])[:top]:
+            print(f"    {name:<28}{t * 1e3:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
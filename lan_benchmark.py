@@ -0,0 +1,156 @@
+import os
+import sys
+import socket
+import threading
+import time
+import numpy as np
+srcpath = os.path.realpath('D:/400_AWT/400_setup_python/Tabor Library')
+sys.path.append(srcpath)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Tabor Library'))
+from tevisainst import TEVisaInst, LAN_CHUNK_SIZE
+
+# LAN read/write benchmark of TEVisaInst against a local stand-in for the
+# instrument's SCPI socket (no hardware needed):
+#
+#   python lan_benchmark.py [size_MB]
+
+
+class LanStandIn:
+    """
+    Local TCP server answering like the Proteus SCPI socket: '*OPC?' -> 1,
+    ':SYST:ERR?' -> no error, '*IDN?' -> an id string, a query ending in 'READ?' -> an IEEE binary
+    block of `block_size` bytes, and incoming binary blocks are consumed.
+    """
+    def __init__(self, block_size, port=0):
+        self.block = np.random.randint(0, 2**16, block_size // 2, dtype=np.uint16)
+        self.received = 0
+        self._server = socket.create_server(('127.0.0.1', port))
+        self.port = self._server.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        rfile = conn.makefile('rb', buffering=1 << 20)
+        scratch = bytearray(1 << 20)
+        with conn:
+            try:
+                self._serve_connection(conn, rfile, scratch)
+            except (ConnectionError, OSError):
+                pass
+
+    def _serve_connection(self, conn, rfile, scratch):
+        while True:
+            line = bytearray()
+            while True:
+                ch = rfile.read(1)
+                if not ch:
+                    return
+                if ch == b'#':
+                    # binary block: #<digits><length><data>
+                    ndigits = int(rfile.read(1))
+                    remaining = int(rfile.read(ndigits))
+                    while remaining:
+                        n = rfile.readinto(memoryview(scratch)[:min(remaining, len(scratch))])
+                        remaining -= n
+                        self.received += n
+                    continue
+                if ch == b'\n':
+                    break
+                line += ch
+            cmd = line.decode().strip()
+            replies = []
+            for part in cmd.split(';'):
+                part = part.strip().upper()
+                if part == '*OPC?':
+                    replies.append(b'1\n')
+                elif part == ':SYST:ERR?':
+                    replies.append(b'0, no error\n')
+                elif part == '*IDN?':
+                    replies.append(b'Tabor Electronics,LAN stand-in,0,0\n')
+                elif part.endswith('READ?'):
+                    nbytes = str(self.block.nbytes).encode()
+                    conn.sendall(b'#' + str(len(nbytes)).encode() + nbytes)
+                    conn.sendall(memoryview(self.block).cast('B'))
+                    replies.append(b'\n')
+            for reply in replies:
+                conn.sendall(reply)
+
+    def close(self):
+        self._server.close()
+
+
+def bench_read(inst, nbytes, chunk, repeat=3):
+    inst.vi.chunk_size = chunk
+    out = np.empty(nbytes // 2, dtype=np.uint16)
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        ret = inst.read_binary_data(':DIG:DATA:READ?', out, nbytes)
+        dt = time.perf_counter() - t0
+        assert ret == 0, f"read failed ({ret})"
+        best = dt if best is None else min(best, dt)
+    return best, out
+
+
+def bench_write(inst, data, chunk, repeat=3):
+    best = None
+    for _ in range(repeat):
+        ret = inst.write_binary_data(':TRAC:DATA', data, chunk_size=chunk)
+        assert ret == 0, f"write failed ({ret})"
+        stats = inst.last_write_stats
+        best = stats if best is None or stats['seconds'] < best['seconds'] else best
+    return best
+
+
+def chirp_chunks(num_samples, chunk_samples):
+    # generates a uint16 chirp piece by piece, as a long segment would be
+    for start in range(0, num_samples, chunk_samples):
+        t = np.arange(start, min(start + chunk_samples, num_samples)) / num_samples
+        yield (32767 * np.cos(2 * np.pi * 1e3 * t * t) + 32768).astype(np.uint16)
+
+
+def main(argv):
+    size_mb = float(argv[0]) if argv else 256
+    nbytes = int(size_mb * 2**20) // 2 * 2
+    server = LanStandIn(nbytes)
+    inst = TEVisaInst('127.0.0.1', port=server.port, raw_socket=True)
+    print(f"Connected to {inst.send_scpi_query('*IDN?')} on port {server.port}")
+    print(f"read_binary_data, {nbytes / 2**20:.0f} MB block:")
+    for chunk in (4096, 65536, LAN_CHUNK_SIZE):
+        dt, out = bench_read(inst, nbytes, chunk)
+        assert np.array_equal(out, server.block), "data mismatch"
+        print(f"    recv chunk {chunk:>8} B: {dt * 1e3:8.1f} ms, {nbytes / dt / 1e6:8.1f} MB/s")
+    print(f"write_binary_data, {nbytes / 2**20:.0f} MB block:")
+    data = server.block.copy()
+    for chunk in (4096, 65536, LAN_CHUNK_SIZE):
+        stats = bench_write(inst, data, chunk)
+        print(f"    send chunk {chunk:>8} B: {stats['seconds'] * 1e3:8.1f} ms, "
+              f"{stats['MBps']:8.1f} MB/s ({stats['chunks']} chunks)")
+    num_samples = nbytes // 2
+    chunk_samples = LAN_CHUNK_SIZE // 2
+    t0 = time.perf_counter()
+    wave = np.concatenate(list(chirp_chunks(num_samples, chunk_samples)))
+    inst.write_binary_data(':TRAC:DATA', wave)
+    serial = time.perf_counter() - t0
+    del wave
+    t0 = time.perf_counter()
+    ret = inst.write_binary_stream(':TRAC:DATA', chirp_chunks(num_samples, chunk_samples), nbytes)
+    assert ret == 0, f"stream write failed ({ret})"
+    streamed = time.perf_counter() - t0
+    print(f"generate + write chirp: {serial * 1e3:8.1f} ms one after the other, "
+          f"{streamed * 1e3:8.1f} ms streamed (holds ~3 chunks instead of the whole segment)")
+    inst.close_instrument()
+    server.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,314 @@
+import numpy as np
+
+# Every captured frame comes with an 88-byte header
+# (see teproteus_functions_v3.get_cpatured_header)
+HEADER_SIZE = 88
+
+HEADER_DTYPE = np.dtype({
+    'names': ['TriggerPos', 'GateLength', 'minVpp', 'maxVpp', 'TimeStamp',
+              'real1_dec', 'im1_dec', 'real2_dec', 'im2_dec', 'real3_dec', 'im3_dec',
+              'real4_dec', 'im4_dec', 'real5_dec', 'im5_dec',
+              'state1', 'state2', 'state3', 'state4', 'state5'],
+    'formats': ['<u4', '<u4', '<u4', '<u4', '<u8'] + ['<i4'] * 10 + ['u1'] * 5,
+    'offsets': [0, 4, 8, 12, 16] + list(range(24, 64, 4)) + list(range(64, 69)),
+    'itemsize': HEADER_SIZE,
+})
+
+# header layout when the frames are averaged on the FPGA
+AVG_HEADER_DTYPE = np.dtype({
+    'names': ['TimeStamp', 'im1_dec', 'real1_dec', 'im2_dec', 'real2_dec', 'im3_dec',
+              'real3_dec', 'im4_dec', 'real4_dec', 'im5_dec', 'real5_dec'],
+    'formats': ['<u8'] + ['<i8'] * 10,
+    'offsets': list(range(0, HEADER_SIZE, 8)),
+    'itemsize': HEADER_SIZE,
+})
+
+
+def parse_headers(buf, avgEn=False):
+    """
+    Decodes a block of frame headers in one step.
+
+    Args:
+        buf: uint8 array (or any buffer) holding N*88 header bytes
+        avgEn (bool): headers of averaged frames
+
+    Returns:
+        structured array of N headers with the fields of get_cpatured_header.
+        It is a view on `buf`; minVpp/maxVpp are raw (halve them if the DSP
+        was enabled, as get_cpatured_header(dspEn=True) does).
+    """
+    buf = np.frombuffer(buf, dtype=np.uint8)
+    assert len(buf) % HEADER_SIZE == 0, f"header block must be a multiple of {HEADER_SIZE} bytes"
+    return buf.view(AVG_HEADER_DTYPE if avgEn else HEADER_DTYPE)
+
+
+def header_decisions(headers, dsp=1):
+    """
+    Returns the complex decisions (real + 1j*im) of DSP `dsp` (1..5) for every
+    header.
+    """
+    assert 1 <= dsp <= 5, "dsp must be 1..5"
+    decisions = np.empty(len(headers), dtype=np.complex128)
+    decisions.real = headers[f'real{dsp}_dec']
+    decisions.imag = headers[f'im{dsp}_dec']
+    return decisions
+
+
+# digitizer frame constraints
+FRAME_GRANULARITY = 96      # readLen must be a multiple of this
+DSP_MAX_READLEN = 4032      # longest frame the DSP decision path integrates
+DDC_DECIMATION = 16         # :DIG:DDC:DEC factor, fixed in complex DDC mode
+BYTES_PER_SAMPLE = 8        # per decimated complex sample as read back (4 x uint16)
+
+
+def plan_acquisition(tacq, numframes, sampleRateADC, sampleRateDAC=None, bandwidth=0,
+                     dsp=False, max_bytes=None):
+    """
+    Picks the smallest legal digitizer frame that covers the acquisition
+    window, before any SCPI command is sent. The complex DDC decimates by
+    DDC_DECIMATION, so the frame length is the only free parameter.
+
+    Args:
+        tacq (float): acquisition window per frame [s]
+        numframes (int): number of frames (triggers)
+        sampleRateADC (float): digitizer sample rate
+        sampleRateDAC (float): if given, checked against sampleRateADC = sampleRateDAC/4
+        bandwidth (float): minimum decimated sample rate needed [Hz]
+        dsp (bool): frames are integrated by the DSP (readLen <= DSP_MAX_READLEN)
+        max_bytes (int): optional limit on the captured bytes
+
+    Returns:
+        dict with readLen (decimated samples per frame), frameLen (the
+        :DIG:ACQ:DEF length, 2*readLen), decimation, numframes, window (the
+        covered time [s]) and bytes (captured/transferred bytes)
+
+    Raises:
+        ValueError: if no legal configuration covers the window
+    """
+    if tacq <= 0 or numframes < 1:
+        raise ValueError(f"invalid acquisition: tacq = {tacq}, numframes = {numframes}")
+    if sampleRateDAC is not None and sampleRateDAC / 4 != sampleRateADC:
+        raise ValueError(f"sampleRateADC ({sampleRateADC}) must be sampleRateDAC/4 ({sampleRateDAC/4})")
+    fs = sampleRateADC / DDC_DECIMATION
+    if fs < bandwidth:
+        raise ValueError(f"decimated sample rate {fs} S/s is below bandwidth = {bandwidth}")
+    # round up so the whole window is captured (1e-9 absorbs float noise)
+    readLen = int(np.ceil(tacq * fs / FRAME_GRANULARITY - 1e-9)) * FRAME_GRANULARITY
+    if dsp and readLen > DSP_MAX_READLEN:
+        raise ValueError(f"tacq = {tacq} s needs readLen = {readLen}, the DSP integrates at most {DSP_MAX_READLEN}")
+    nbytes = numframes * readLen * BYTES_PER_SAMPLE
+    if max_bytes is not None and nbytes > max_bytes:
+        raise ValueError(f"{numframes} frames of readLen = {readLen} need {nbytes} bytes, max_bytes = {max_bytes}")
+    return {'readLen': readLen, 'frameLen': 2*readLen, 'decimation': DDC_DECIMATION,
+            'numframes': numframes, 'window': readLen / fs, 'bytes': nbytes}
+
+
+def unwrap_timestamps(timestamps, bits=64):
+    """
+    Converts header TimeStamps into ticks since the first frame, undoing
+    counter wrap-around (the difference of consecutive stamps is taken
+    modulo 2**bits).
+    """
+    ts = np.asarray(timestamps, dtype=np.uint64)
+    ticks = np.zeros(len(ts), dtype=np.uint64)
+    if len(ts) > 1:
+        # uint64 arithmetic wraps, so a counter overflow gives the right difference
+        diff = np.diff(ts)
+        if bits < 64:
+            diff &= np.uint64((1 << bits) - 1)
+        np.cumsum(diff, out=ticks[1:])
+    return ticks
+
+
+def frame_times(headers, tick=None, period=None, bits=64, tol=0.25):
+    """
+    Trigger time of every frame from the header TimeStamps, with detection
+    of missed triggers.
+
+    Args:
+        headers: structured header array (see parse_headers)
+        tick (float): duration of one TimeStamp count [s]; if None it is
+            calibrated so that the median trigger spacing equals `period`
+        period (float): nominal trigger period [s] (needed if tick is None)
+        bits (int): width of the TimeStamp counter
+        tol (float): spacings further than tol*period from a whole number of
+            periods are reported as irregular
+
+    Returns:
+        dict with time (seconds since the first frame), period (median
+        spacing [s]), tick, missed (frame indices preceded by a gap of more
+        than one period), n_missed (number of triggers lost in those gaps)
+        and irregular (frame indices whose spacing is not a whole number of
+        periods)
+    """
+    ticks = unwrap_timestamps(headers['TimeStamp'], bits)
+    diff = np.diff(ticks).astype(np.float64)
+    nominal = np.median(diff) if len(diff) else 0.0
+    if tick is None:
+        assert period is not None, "either tick or period is needed"
+        tick = period / nominal if nominal > 0 else 0.0
+    times = ticks.astype(np.float64) * tick
+    if nominal > 0:
+        ratio = diff / nominal
+        steps = np.rint(ratio)
+        missed = np.nonzero(steps > 1)[0] + 1
+        n_missed = int(np.sum(steps[steps > 1] - 1))
+        irregular = np.nonzero((np.abs(ratio - steps) > tol) | (steps < 1))[0] + 1
+    else:
+        missed = irregular = np.zeros(0, dtype=np.int64)
+        n_missed = 0
+    return {'time': times, 'period': nominal * tick, 'tick': tick,
+            'missed': missed, 'n_missed': n_missed, 'irregular': irregular}
+
+
+# one decimated complex sample of :DIG:DATA:READ? frame data (DDC output in
+# DUAL mode): I and Q, each followed by a word that is not used
+FRAME_SAMPLE_DTYPE = np.dtype([('I', '<u2'), ('I_aux', '<u2'), ('Q', '<u2'), ('Q_aux', '<u2')])
+SAMPLE_OFFSET = 16384
+
+
+def demux_frames(raw, readLen, dtype=np.complex128):
+    """
+    Decodes raw frame data into complex samples in one vectorized pass.
+
+    Args:
+        raw: uint16 frame data (read_frames) or FRAME_SAMPLE_DTYPE records
+            (read_channels), with any number of leading channel axes
+        readLen (int): decimated samples per frame
+
+    Returns:
+        complex array of shape (..., frames, readLen); samples of an
+        incomplete last frame are dropped
+    """
+    raw = np.asarray(raw)
+    if raw.dtype != FRAME_SAMPLE_DTYPE:
+        words = len(FRAME_SAMPLE_DTYPE)
+        if raw.shape[-1] % words:
+            raw = np.ascontiguousarray(raw[..., :raw.shape[-1] // words * words])
+        raw = raw.view(FRAME_SAMPLE_DTYPE)
+    numframes = raw.shape[-1] // readLen
+    raw = raw[..., :numframes * readLen].reshape(raw.shape[:-1] + (numframes, readLen))
+    out = np.empty(raw.shape, dtype=dtype)
+    np.subtract(raw['I'], SAMPLE_OFFSET, out=out.real, dtype=out.real.dtype)
+    np.subtract(raw['Q'], SAMPLE_OFFSET, out=out.imag, dtype=out.real.dtype)
+    return out
+
+
+# FrameFilter rejection reasons (bit flags)
+REJECT_CLIPPED = 1
+REJECT_TRIGGER = 2
+REJECT_OUTLIER = 4
+
+
+class FrameFilter:
+    """
+    Drops bad frames before averaging, chunk by chunk, so multi-GB captures
+    are filtered in the same pass that decodes them.
+
+    Predicates (each optional):
+        clip_level: a frame whose |I| or |Q| reaches this level is clipped
+        vpp_limits: (lo, hi) raw ADC limits checked against the header
+            minVpp/maxVpp (clipped if minVpp <= lo or maxVpp >= hi)
+        trigger_window: (lo, hi) allowed header TriggerPos
+        zmax: frames whose mean amplitude is more than zmax standard
+            deviations from the mean of the frames accepted in earlier chunks
+            are outliers; only accepted frames update those statistics
+
+    Example:
+        ff = FrameFilter(clip_level = 16000, zmax = 6)
+        res = ff.run(run['frames'], readLen, run.headers())
+        res['average'], res['keep']
+    """
+    def __init__(self, clip_level=None, vpp_limits=None, trigger_window=None, zmax=None):
+        self.clip_level = clip_level
+        self.vpp_limits = vpp_limits
+        self.trigger_window = trigger_window
+        self.zmax = zmax
+        self.reset()
+
+    def reset(self):
+        # running count/mean/M2 of accepted amplitudes and sum of accepted means
+        self._n = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._sum = 0j
+
+    def apply(self, frames, headers=None):
+        """
+        Filters one chunk of decoded frames.
+
+        Args:
+            frames: complex array (frames, readLen) (see demux_frames)
+            headers: the matching frame headers, or None
+
+        Returns:
+            (means, reasons): per-frame complex means and the REJECT_* flags
+            of each frame (0 = kept)
+        """
+        means = frames.mean(axis=1)
+        reasons = np.zeros(len(frames), dtype=np.uint8)
+        if self.clip_level is not None:
+            peak = np.maximum(np.abs(frames.real).max(axis=1), np.abs(frames.imag).max(axis=1))
+            reasons[peak >= self.clip_level] |= REJECT_CLIPPED
+        if headers is not None and self.vpp_limits is not None:
+            lo, hi = self.vpp_limits
+            reasons[(headers['minVpp'] <= lo) | (headers['maxVpp'] >= hi)] |= REJECT_CLIPPED
+        if headers is not None and self.trigger_window is not None:
+            lo, hi = self.trigger_window
+            pos = headers['TriggerPos']
+            reasons[(pos < lo) | (pos > hi)] |= REJECT_TRIGGER
+        amps = np.abs(means)
+        if self.zmax is not None:
+            # z-score against the frames accepted before this chunk, so a
+            # chunk of outliers cannot widen its own threshold; the first
+            # chunk has no history and is scored against its own candidates
+            n, mean, m2 = self._n, self._mean, self._m2
+            if n < 2:
+                n, mean, m2 = self._combine(amps[reasons == 0])
+            std = np.sqrt(m2 / n) if n > 1 else 0.0
+            if std > 0:
+                reasons[(reasons == 0) & (np.abs(amps - mean) > self.zmax * std)] |= REJECT_OUTLIER
+        self._n, self._mean, self._m2 = self._combine(amps[reasons == 0])
+        self._sum += means[reasons == 0].sum()
+        return means, reasons
+
+    def run(self, raw, readLen, headers=None, chunk=4096):
+        """
+        Decodes and filters raw frame data (e.g. a CaptureRun memmap) in
+        chunks of `chunk` frames.
+
+        Returns:
+            dict with means (per-frame complex means), keep (bool mask),
+            reasons (REJECT_* flags), average (mean of the kept frames) and
+            kept/rejected counts
+        """
+        self.reset()
+        raw = np.asarray(raw)
+        assert raw.ndim == 1, "one channel at a time"
+        # raw items per frame
+        frame_items = readLen * (1 if raw.dtype == FRAME_SAMPLE_DTYPE else len(FRAME_SAMPLE_DTYPE))
+        numframes = len(raw) // frame_items
+        means = np.empty(numframes, dtype=np.complex128)
+        reasons = np.empty(numframes, dtype=np.uint8)
+        for start in range(0, numframes, chunk):
+            stop = min(start + chunk, numframes)
+            frames = demux_frames(raw[start * frame_items:stop * frame_items], readLen)
+            hdr = headers[start:stop] if headers is not None else None
+            means[start:stop], reasons[start:stop] = self.apply(frames, hdr)
+        keep = reasons == 0
+        return {'means': means, 'keep': keep, 'reasons': reasons,
+                'average': self._sum / self._n if self._n else np.nan + 0j,
+                'kept': int(keep.sum()), 'rejected': int(numframes - keep.sum())}
+
+    def _combine(self, amps):
+        # Chan et al. parallel update of count/mean/M2
+        n_b = len(amps)
+        if n_b == 0:
+            return self._n, self._mean, self._m2
+        mean_b = amps.mean()
+        m2_b = ((amps - mean_b)**2).sum()
+        n = self._n + n_b
+        delta = mean_b - self._mean
+        mean = self._mean + delta * n_b / n
+        m2 = self._m2 + m2_b + delta**2 * self._n * n_b / n
+        return n, mean, m2
@@ -0,0 +1,192 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from TaborProteus import TaborProteus
+from teproteus import TEProteusAdmin as TepAdmin
+
+
+class TaborProteusCluster:
+    """
+    Several Proteus modules driven as one: DAC channels are numbered across
+    the modules (1..n on the first module, n+1.. on the second, ..., with n
+    the channels of each slot's inventory entry, or channels_per_slot when
+    it has none) and work for different modules runs concurrently on a
+    thread pool. The DLL
+    calls are made through ctypes, which releases the GIL, so the per-slot
+    transfers overlap; commands to one module stay sequential.
+
+    Each module is a separate instrument with its own communication
+    interface. A multi-slot instrument (open_multi_slots_instrument) has a
+    single interface, so its slots cannot be programmed in parallel.
+
+    Example:
+        cluster = TaborProteusCluster.open(num_slots = 2)
+        cluster.make_blocks({1: ([b1], [1]), 5: ([b2], [1])})   # ch 5 = ch 1 of the second slot
+        stats = cluster.download([(1, 2, wave_a), (5, 2, wave_b)])
+    """
+    def __init__(self, members, channels_per_slot=4):
+        self.members = list(members)
+        self.channels_per_slot = channels_per_slot
+        # DAC channels of each member
+        self.channels = [(member.slot_info or {}).get('channels') or channels_per_slot for member in self.members]
+        self._pool = ThreadPoolExecutor(max_workers=len(self.members), thread_name_prefix='proteus')
+        self.last_stats = None
+        self.admin = None
+        # passed to TaborProteus.program_channels by make_blocks
+        self.dedupe = True
+        self.segment_banks = None
+
+    @classmethod
+    def open(cls, num_slots=None, slot=None, channels_per_slot=4, **kw):
+        """
+        Opens the free slots that meet the requirements `slot` (see
+        proteus_inventory.Inventory.find), at most `num_slots` of them.
+        Further keyword arguments go to each TaborProteus.
+        """
+        from proteus_inventory import Inventory
+        admin = TepAdmin()
+        found = Inventory().find(admin, **(slot or {}))
+        if num_slots is not None:
+            found = found[:num_slots]
+        assert found and (num_slots is None or len(found) == num_slots), \
+            f"need {num_slots} free slots, found {len(found)}"
+        members = []
+        for info in found:
+            inst = admin.open_instrument(slot_id=info['slot_id'])
+            assert inst is not None, f"unable to open slot {info['slot_id']}"
+            inst.slot_info = info
+            members.append(TaborProteus(inst = inst, **kw))
+        cluster = cls(members, channels_per_slot)
+        cluster.admin = admin  # closed with the cluster
+        return cluster
+
+    @property
+    def num_channels(self):
+        return sum(self.channels)
+
+    def locate(self, ch):
+        """
+        Maps a cluster channel to (member index, channel on that module).
+        """
+        assert 1 <= ch <= self.num_channels, f"channel {ch} not in 1..{self.num_channels}"
+        local = ch
+        for idx, channels in enumerate(self.channels):
+            if local <= channels:
+                return idx, local
+            local -= channels
+
+    def partition(self, items):
+        """
+        Splits (ch, ...) tuples by module, replacing the cluster channel with
+        the module-local one.
+
+        Returns:
+            {member index: [local items]}
+        """
+        parts = {}
+        for item in items:
+            idx, local = self.locate(item[0])
+            parts.setdefault(idx, []).append((local,) + tuple(item[1:]))
+        return parts
+
+    def run(self, jobs):
+        """
+        Runs fn(member) for every {member index: fn} concurrently.
+
+        Returns:
+            ({member index: result}, stats) where stats holds the elapsed
+            time, bytes written and aggregate bandwidth [MB/s], also per slot
+        """
+        start = {idx: self.members[idx].bytes_written for idx in jobs}
+        t0 = time.perf_counter()
+
+        def timed(idx, fn):
+            t = time.perf_counter()
+            result = fn(self.members[idx])
+            return result, time.perf_counter() - t
+
+        futures = {idx: self._pool.submit(timed, idx, fn) for idx, fn in jobs.items()}
+        # result() re-raises the first failure in the calling thread
+        done = {idx: future.result() for idx, future in futures.items()}
+        elapsed = time.perf_counter() - t0
+        per_slot = {}
+        for idx, (_, seconds) in done.items():
+            nbytes = self.members[idx].bytes_written - start[idx]
+            per_slot[idx] = {'bytes': nbytes, 'seconds': seconds, 'MBps': nbytes / seconds / 1e6 if seconds else 0.0}
+        total = sum(slot['bytes'] for slot in per_slot.values())
+        stats = {'bytes': total, 'seconds': elapsed, 'MBps': total / elapsed / 1e6 if elapsed else 0.0,
+                 'per_slot': per_slot}
+        self.last_stats = stats
+        return {idx: result for idx, (result, _) in done.items()}, stats
+
+    def download(self, segments):
+        """
+        Downloads segments to their modules in parallel.
+
+        Args:
+            segments: list of (ch, segMem, dacWaveI[, dacWaveQ]) with cluster
+                channel numbers; without dacWaveQ the data is pre-interleaved
+
+        Returns:
+            stats (see run())
+        """
+        jobs = {}
+        for idx, segs in self.partition(segments).items():
+            def job(member, segs=segs):
+                # one transaction per module: bare writes, errors read once
+                with member.transaction():
+                    for seg in segs:
+                        member.downloadIQ(*seg)
+            jobs[idx] = job
+        _, stats = self.run(jobs)
+        print(f"Downloaded {stats['bytes'] / 1e6:.1f} MB to {len(jobs)} slots "
+              f"in {stats['seconds']:.3f} s ({stats['MBps']:.1f} MB/s)")
+        return stats
+
+    def make_blocks(self, programs):
+        """
+        Programs segments and task tables of several channels
+        (TaborProteus.program_channels per module), the modules in parallel.
+
+        Args:
+            programs: {ch: (block_l, repeatSeq)} with cluster channel numbers
+
+        Returns:
+            stats (see run())
+        """
+        parts = self.partition([(ch, block_l, repeatSeq) for ch, (block_l, repeatSeq) in programs.items()])
+        jobs = {}
+        for idx, progs in parts.items():
+            def job(member, progs=progs):
+                # all channels of a module in one compile/download pass; pulse
+                # dicts may be shared between modules, so none is modified here
+                return member.program_channels({ch: (block_l, repeatSeq) for ch, block_l, repeatSeq in progs},
+                                               dedupe = self.dedupe, segment_banks = self.segment_banks,
+                                               update_pulses = False)
+            jobs[idx] = job
+        compiled, stats = self.run(jobs)
+        # rounded lengths written back from this thread only, module by module
+        for idx in sorted(compiled):
+            self.members[idx].round_pulses(compiled[idx])
+        print(f"Programmed {len(programs)} channels on {len(jobs)} slots in {stats['seconds']:.3f} s "
+              f"({stats['MBps']:.1f} MB/s)")
+        return stats
+
+    def broadcast(self, method, *args, **kw):
+        """
+        Calls the same TaborProteus method on every module in parallel,
+        e.g. cluster.broadcast('initialize_AWG', ch = 1).
+
+        Returns:
+            list of the results, in module order
+        """
+        results, _ = self.run({idx: (lambda member: getattr(member, method)(*args, **kw))
+                               for idx in range(len(self.members))})
+        return [results[idx] for idx in range(len(self.members))]
+
+    def close(self):
+        self._pool.shutdown()
+        for member in self.members:
+            member.inst.close_instrument()
+        if self.admin is not None:
+            self.admin.close_inst_admin()
+            self.admin = None
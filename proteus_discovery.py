@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import threading
+import numpy as np
+
+# LAN discovery of Proteus units (the UDP query of
+# pyte_visa_utils._list_udp_awg_instruments), but asynchronous: it returns as
+# soon as the expected units answered instead of always waiting out a 2 s
+# timeout, re-sends the query with backoff when packets are lost and caches
+# the result.
+#
+#   units = discover(expected = 2)
+#   units = discover(serial = '000002210203')
+#   inst = TEVisaInst(units[0]['address'], units[0]['port'])
+
+UDPSRVPORT = 7501           # local port the vendor code listens on
+UPFRMPORT = 7502            # port the units listen on
+FRMHEADERLEN = 22
+FRMDATALEN = 1024
+FLASHLINELEN = 32
+
+# opcode of each attribute line of a response frame
+FIELDS = {'manufacturer': 0x44, 'model': 0x49, 'serial': 0x53, 'address': 0x57, 'port': 0x51}
+
+DEFAULT_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'proteus_lan_units.json')
+DEFAULT_TTL = 300           # [s]; units get new DHCP addresses rarely
+
+
+def query_message():
+    msg = bytearray([0xff] * FRMHEADERLEN)
+    msg[0:4] = b'TEID'
+    return bytes(msg)
+
+
+def decode_frames(frames):
+    """
+    Decodes response frames in one pass: all frames are stacked into a
+    (frames, lines, 32) byte array and every attribute is picked by opcode
+    for all frames at once.
+
+    Returns:
+        list of dicts with the FIELDS keys (missing attributes are '')
+    """
+    if not frames:
+        return []
+    nlines = max((len(f) - FRMHEADERLEN) // FLASHLINELEN for f in frames)
+    size = FRMHEADERLEN + nlines * FLASHLINELEN
+    buf = np.zeros((len(frames), size), dtype=np.uint8)
+    for row, frame in enumerate(frames):
+        # whole lines only, as the vendor loop (a truncated line stays zero,
+        # i.e. has no opcode)
+        whole = FRMHEADERLEN + max(len(frame) - FRMHEADERLEN, 0) // FLASHLINELEN * FLASHLINELEN
+        frame = frame[:min(size, whole)]
+        buf[row, :len(frame)] = np.frombuffer(frame, dtype=np.uint8)
+    lines = buf[:, FRMHEADERLEN:].reshape(len(frames), nlines, FLASHLINELEN)
+    opcodes = lines[:, :, 0]
+    # attribute text: bytes 1..30 of the line, NULs and spaces stripped
+    attrs = lines[:, :, 1:FLASHLINELEN - 1]
+    units = [{} for _ in frames]
+    for name, opcode in FIELDS.items():
+        hit = opcodes == opcode
+        # the last line with this opcode wins, as in the vendor loop
+        idx = nlines - 1 - np.argmax(hit[:, ::-1], axis=1)
+        found = hit.any(axis=1)
+        values = attrs[np.arange(len(frames)), idx]
+        for row in range(len(frames)):
+            units[row][name] = values[row].tobytes().decode('ascii', 'replace').strip().strip('\x00').strip() \
+                if found[row] else ''
+    for unit in units:
+        unit['idn'] = '{manufacturer},{model},{serial},{address},{port}'.format(**unit)
+        unit['resource'] = f"TCPIP::{unit['address']}::{unit['port'] or 5025}::SOCKET"
+    return units
+
+
+class _DiscoveryProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.frames = {}
+        self.event = asyncio.Event()
+
+    def datagram_received(self, data, addr):
+        # a unit answers every re-send with the same frame: keep one copy
+        # (our own broadcast query comes back too and is ignored)
+        if data[:FRMHEADERLEN] != query_message() and data not in self.frames:
+            self.frames[data] = addr
+            self.event.set()
+
+
+async def discover_async(expected=None, serial=None, timeout=2.0, retries=3, backoff=0.2,
+                         broadcast='255.255.255.255', port=UPFRMPORT, bind_port=UDPSRVPORT):
+    """
+    Broadcasts the discovery query and collects the answers.
+
+    Args:
+        expected (int): return as soon as this many units answered
+        serial (str): return as soon as the unit with this serial answered
+        timeout (float): overall limit [s]; without expected/serial all
+            answers within it are collected (the call takes the full timeout)
+        retries (int): re-sends of the query after a quiet window
+        backoff (float): wait before the first re-send [s], doubled each time
+        broadcast (str): destination address (a unit's IP for a directed query)
+        port (int): units' discovery port
+        bind_port (int): local port (0 for any free one)
+
+    Returns:
+        list of unit dicts (see decode_frames), in order of arrival
+    """
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    sock.bind(('0.0.0.0', bind_port))
+    transport, protocol = await loop.create_datagram_endpoint(_DiscoveryProtocol, sock=sock)
+
+    def satisfied():
+        if expected is None and serial is None:
+            return False
+        units = decode_frames(list(protocol.frames))
+        if serial is not None and any(unit['serial'] == serial for unit in units):
+            return True
+        return expected is not None and len(units) >= expected
+
+    try:
+        deadline = loop.time() + timeout
+        wait = backoff
+        sends = 0
+        while True:
+            transport.sendto(query_message(), (broadcast, port))
+            sends += 1
+            # an open-ended query listens out the whole timeout after its last send
+            last = sends > retries
+            listen_all = last and expected is None and serial is None
+            # wait for answers; every new one restarts this attempt's window
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                protocol.event.clear()
+                try:
+                    await asyncio.wait_for(protocol.event.wait(), remaining if listen_all else min(wait, remaining))
+                except asyncio.TimeoutError:
+                    break
+                if satisfied():
+                    return decode_frames(list(protocol.frames))
+            if last or loop.time() >= deadline:
+                break
+            wait *= 2
+        return decode_frames(list(protocol.frames))
+    finally:
+        transport.close()
+
+
+def discover(expected=None, serial=None, cache=True, ttl=DEFAULT_TTL, path=DEFAULT_CACHE, **kw):
+    """
+    Synchronous discover_async with a JSON cache: a fresh cache that already
+    satisfies `expected`/`serial` is returned without touching the network.
+    """
+    if cache:
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+            units = cached['units']
+            if time.time() - cached['time'] <= ttl and (
+                    (serial is not None and any(unit['serial'] == serial for unit in units))
+                    or (serial is None and expected is not None and len(units) >= expected)):
+                return units
+        except (OSError, ValueError, KeyError):
+            pass
+    units = asyncio.run(discover_async(expected, serial, **kw))
+    if cache and units:
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'time': time.time(), 'units': units}, f, indent=1)
+        os.replace(tmp, path)
+    return units
+
+
+class LocalResponder:
+    """
+    Stand-in for LAN units on this machine: answers discovery queries on
+    `port` with one frame per unit (optionally dropping the first
+    `drop` queries, to exercise the retries).
+
+    Example:
+        responder = LocalResponder([{'serial': '1', 'address': '127.0.0.1'}], port = 17502)
+        units = discover(expected = 1, broadcast = '127.0.0.1', port = 17502, bind_port = 0, cache = False)
+    """
+    def __init__(self, units, port=UPFRMPORT, drop=0, delay=0.0):
+        self.frames = [self.frame(unit) for unit in units]
+        self.drop = drop
+        self.delay = delay
+        self.queries = 0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(('127.0.0.1', port))
+        self.port = self._sock.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def frame(unit):
+        frame = bytearray(FRMHEADERLEN)
+        frame[0:4] = b'TEID'
+        fields = dict({'manufacturer': 'Tabor Electronics', 'model': 'P9484M', 'port': '5025'}, **unit)
+        for name, opcode in FIELDS.items():
+            line = bytearray(FLASHLINELEN)
+            line[0] = opcode
+            text = str(fields.get(name, '')).encode('ascii')[:FLASHLINELEN - 2]
+            line[1:1 + len(text)] = text
+            frame += line
+        return bytes(frame)
+
+    def _serve(self):
+        while True:
+            try:
+                data, addr = self._sock.recvfrom(FRMHEADERLEN + FRMDATALEN)
+            except OSError:
+                return
+            self.queries += 1
+            if self.queries <= self.drop:
+                continue
+            for frame in self.frames:
+                if self.delay:
+                    time.sleep(self.delay)
+                self._sock.sendto(frame, addr)
+
+    def close(self):
+        self._sock.close()
+
+
+if __name__ == '__main__':
+    expected = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    t0 = time.perf_counter()
+    for unit in discover(expected = expected, cache = False):
+        print(unit['idn'])
+    print(f"discovery took {time.perf_counter() - t0:.3f} s")
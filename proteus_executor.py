@@ -0,0 +1,212 @@
+import queue
+import itertools
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future, CancelledError
+from proteus_transport import Transport, open_transport, byte_view
+
+# Serialized instrument access: one I/O thread owns the instrument handle and
+# runs everything sent to it from a priority queue, so readout, monitoring
+# and programming threads can share one Proteus. Callers get futures (or
+# block on them through the usual Transport methods).
+#
+#   executor = InstrumentExecutor(inst)
+#   proteus = TaborProteus(inst = executor)
+#   status = executor.poll(':DIG:ACQ:FRAM:STAT?')       # from a monitoring thread
+#   executor.abort(':DIG:INIT OFF')
+#
+# Aborts run before polls and polls before everything else (see
+# TaborProteus.poll_query and TaborProteus.interrupt). With
+# bulk_chunk set, a long :TRAC:DATA download is split into pieces written at
+# increasing offsets, and pending polls and aborts are served between the
+# pieces, so monitoring never waits for the whole download and an abort
+# stops it after the current piece.
+#
+# Chunking is opt-in and untested on hardware: the unit of the :TRAC:DATA
+# offset (OFFSET_BYTES) is not verified, and a wrong unit would corrupt
+# every chunked segment. By default a download is one block, and a poll
+# submitted during it waits until the whole block is written.
+
+PRIORITY_ABORT = 0
+PRIORITY_POLL = 1
+PRIORITY_NORMAL = 2
+_PRIORITY_STOP = 99
+
+
+class InstrumentExecutor(Transport):
+    """
+    Transport that forwards every operation to a single I/O thread.
+
+    Commands and transfers (PRIORITY_NORMAL) run in the order they were
+    submitted; between the pieces of a bulk transfer only polls and aborts
+    may run, which must not change the instrument state the transfer relies
+    on (selected channel and segment). Use exclusive() to keep a sequence of
+    normal operations from one thread together, e.g. :TRAC:SEL + :TRAC:DATA.
+
+    Calls made from the I/O thread itself (from a function given to
+    submit()) run directly, so the executor is reentrant.
+    """
+    name = 'executor'
+    BULK_CHUNK = 4 * 2**20          # suggested bytes per :TRAC:DATA piece
+    OFFSET_BYTES = 2                # bytes per unit of the :TRAC:DATA offset (16-bit points, unverified)
+
+    def __init__(self, inst, bulk_chunk=None):
+        # bulk_chunk: split :TRAC:DATA writes into pieces of this many bytes
+        # (e.g. BULK_CHUNK); None sends every block whole
+        super().__init__(open_transport(inst))
+        self.streaming = self.inst.streaming
+        self.max_block = self.inst.max_block
+        self.zero_copy = self.inst.zero_copy
+        assert bulk_chunk is None or bulk_chunk % (64 * self.OFFSET_BYTES) == 0, \
+            "bulk_chunk must be a multiple of 64 points"
+        self.bulk_chunk = bulk_chunk
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        # bumped by abort(); a running bulk transfer stops when it changes
+        self._abort_count = 0
+        self._exclusive = threading.RLock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='proteus-io', daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args, priority=PRIORITY_NORMAL, **kw):
+        """
+        Queues fn(transport, *args, **kw) for the I/O thread.
+
+        Returns:
+            concurrent.futures.Future with the result of fn
+        """
+        if threading.current_thread() is self._thread:
+            future = Future()
+            self._execute(future, fn, args, kw)
+            return future
+        assert not self._closed, "executor is closed"
+        future = Future()
+        self._queue.put((priority, next(self._seq), future, fn, args, kw))
+        return future
+
+    def poll(self, query):
+        """
+        Sends a status query ahead of queued commands and between the pieces
+        of a running download.
+
+        Returns:
+            Future with the response string
+        """
+        assert '?' in query, "only queries can be polls"
+        return self.submit(lambda transport: transport.send_scpi_query(query), priority=PRIORITY_POLL)
+
+    def abort(self, cmd=None):
+        """
+        Stops a running bulk transfer after its current piece (its future
+        raises CancelledError) and then sends `cmd`, if any, before
+        anything else in the queue.
+
+        Returns:
+            Future with the error code of `cmd` (None without one)
+        """
+        self._abort_count += 1
+        return self.submit(lambda transport: None if cmd is None else transport.send_scpi_cmd(cmd),
+                           priority=PRIORITY_ABORT)
+
+    @contextmanager
+    def exclusive(self):
+        """
+        Keeps other threads' commands and transfers out for the duration of
+        the block (polls and aborts still get through).
+        """
+        with self._exclusive:
+            yield self
+
+    def _call(self, fn, *args):
+        # blocking normal-priority call
+        if threading.current_thread() is self._thread:
+            return self.submit(fn, *args).result()
+        with self._exclusive:
+            return self.submit(fn, *args).result()
+
+    @property
+    def default_paranoia_level(self):
+        return self._call(lambda transport: transport.default_paranoia_level)
+
+    @default_paranoia_level.setter
+    def default_paranoia_level(self, value):
+        def set_level(transport):
+            transport.default_paranoia_level = value
+        self._call(set_level)
+
+    def send_scpi_cmd(self, scpi_str, paranoia_level=None):
+        return self._call(lambda transport: transport.send_scpi_cmd(scpi_str, paranoia_level))
+
+    def send_scpi_query(self, scpi_str, max_resp_len=256):
+        return self._call(lambda transport: transport.send_scpi_query(scpi_str, max_resp_len))
+
+    def write_binary_stream(self, scpi_pref, chunks, num_bytes, progress=None):
+        return self._call(lambda transport: transport.write_binary_stream(scpi_pref, chunks, num_bytes, progress))
+
+    def _write(self, scpi_pref, bin_dat):
+        return self._call(self._bulk_write, scpi_pref, bin_dat)
+
+    def _read(self, scpi_pref, out_array, num_bytes):
+        return self._call(lambda transport: transport.read_binary_data(scpi_pref, out_array, num_bytes))
+
+    def _bulk_write(self, transport, scpi_pref, bin_dat):
+        # runs on the I/O thread
+        data = byte_view(bin_dat)
+        pref = '' if scpi_pref is None else str(scpi_pref).rstrip()
+        if self.bulk_chunk is None or len(data) <= self.bulk_chunk or \
+                not pref.upper().endswith((':TRAC:DATA', ':TRACE:DATA')):
+            return transport.write_binary_data(scpi_pref, data)
+        aborts = self._abort_count
+        for offset in range(0, len(data), self.bulk_chunk):
+            if offset:
+                self._run_urgent()
+                if self._abort_count != aborts:
+                    raise CancelledError(f"{pref} aborted after {offset} of {len(data)} bytes")
+            ret = transport.write_binary_data(f'{pref} {offset // self.OFFSET_BYTES},',
+                                              data[offset:offset + self.bulk_chunk])
+            if ret != 0:
+                return ret
+        return 0
+
+    def _run_urgent(self):
+        # serves queued polls and aborts in the middle of a bulk transfer
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item[0] > PRIORITY_POLL:
+                # (priority, seq) puts it back in its place
+                self._queue.put(item)
+                return
+            self._execute(*item[2:])
+
+    def _execute(self, future, fn, args, kw):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = fn(self.inst, *args, **kw)
+        except BaseException as ex:  # pylint: disable=broad-except
+            future.set_exception(ex)
+        else:
+            future.set_result(result)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item[0] == _PRIORITY_STOP:
+                return
+            self._execute(*item[2:])
+
+    def close_instrument(self):
+        """
+        Runs what is already queued, stops the I/O thread and closes the
+        instrument.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put((_PRIORITY_STOP, next(self._seq), None, None, (), {}))
+        self._thread.join()
+        self.inst.close_instrument()
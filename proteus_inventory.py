@@ -0,0 +1,148 @@
+import os
+import re
+import json
+import time
+
+# Cached snapshot of the Proteus slots in the chassis (see
+# TEProteusAdmin.get_slots_info), so opening an instrument does not query
+# every attribute of every slot through the DLL on each start, and slots are
+# chosen by what they can do rather than by their position in get_slot_ids().
+
+DEFAULT_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'proteus_inventory.json')
+DEFAULT_TTL = 24 * 3600     # [s]; FPGA, options and memory change only with hardware or firmware
+
+
+def idn_model(idn):
+    """
+    Model name from the *IDN string, e.g. 'P9484M' from
+    'Tabor Electronics,P9484M,000002210203,1.238.6 --slot#: 5'.
+    """
+    fields = idn.split(',')
+    return fields[1].strip() if len(fields) > 1 else ''
+
+
+def model_channels(model):
+    """
+    Number of DAC channels of a model: the last digit of its number, e.g. 4
+    for 'P9484M' (None if the name does not follow that pattern).
+    """
+    m = re.match(r'P\d{3}(\d)', model.upper())
+    return int(m.group(1)) if m else None
+
+
+def capabilities(slot):
+    """
+    Adds derived fields to a slot-info dict: model, channels (DAC channels,
+    None if unknown), has_digitizer (the 'M' models carry the digitizer) and
+    memory_bytes (installed memory per DDR).
+    """
+    slot = dict(slot)
+    slot['model'] = idn_model(slot.get('idn', ''))
+    slot['channels'] = model_channels(slot['model'])
+    slot['has_digitizer'] = slot['model'].upper().endswith('M')
+    slot['memory_bytes'] = slot.get('installed_memory', 0) * 2**30
+    return slot
+
+
+class Inventory:
+    """
+    Slot inventory with a JSON cache file and a time-to-live.
+
+    Example:
+        inventory = Inventory()
+        slot = inventory.select(admin, digitizer = True, min_memory = 8)
+        inst = admin.open_instrument(slot_id = slot['slot_id'])
+    """
+    def __init__(self, path=DEFAULT_CACHE, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._snapshot = None
+
+    def load(self):
+        """
+        Returns the cached snapshot if it exists and is younger than the TTL,
+        otherwise None.
+        """
+        if self._snapshot is None:
+            try:
+                with open(self.path) as f:
+                    self._snapshot = json.load(f)
+            except (OSError, ValueError):
+                return None
+        if time.time() - self._snapshot.get('time', 0) > self.ttl:
+            return None
+        return self._snapshot
+
+    def refresh(self, admin):
+        """
+        Reads all slots in one pass and writes the cache.
+        """
+        slots = [capabilities(slot) for slot in admin.get_slots_info()]
+        self._snapshot = {'time': time.time(), 'slots': slots}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._snapshot, f, indent=1)
+        os.replace(tmp, self.path)
+        return self._snapshot
+
+    def slots(self, admin=None, refresh=False):
+        """
+        Returns the slot list, from the cache while it is fresh.
+
+        Args:
+            admin (TEProteusAdmin): used when the cache is stale or refresh
+                is set; a new one is created if None
+        """
+        snapshot = None if refresh else self.load()
+        if snapshot is None:
+            if admin is None:
+                from teproteus import TEProteusAdmin as TepAdmin
+                admin = TepAdmin()
+            snapshot = self.refresh(admin)
+        return snapshot['slots']
+
+    def find(self, admin=None, refresh=False, digitizer=None, min_memory=None, model=None,
+             min_fpga_version=None, fw_options=0, free=True):
+        """
+        Returns the slots that satisfy all given requirements, in chassis/slot order.
+
+        Args:
+            digitizer (bool): require (True) or exclude (False) a digitizer
+            min_memory (int): minimum installed memory per DDR [GB]
+            model (str): model name prefix, e.g. 'P9484'
+            min_fpga_version (int): minimum FPGA version
+            fw_options (int): firmware-option bits that must all be set
+            free (bool): skip dummy slots and slots in use
+        """
+        found = []
+        for slot in self.slots(admin, refresh):
+            if free and (slot['is_dummy'] or slot['is_in_use']):
+                continue
+            if digitizer is not None and slot['has_digitizer'] != digitizer:
+                continue
+            if min_memory is not None and slot['installed_memory'] < min_memory:
+                continue
+            if model is not None and not slot['model'].startswith(model):
+                continue
+            if min_fpga_version is not None and slot['fpga_version'] < min_fpga_version:
+                continue
+            if slot['fw_options'] & fw_options != fw_options:
+                continue
+            found.append(slot)
+        return sorted(found, key=lambda slot: (slot['chassis_index'], slot['slot_number']))
+
+    def select(self, admin=None, refresh=False, **requirements):
+        """
+        Returns the first slot matching `requirements` (see find()). A
+        stale "in use" flag in the cache is not trusted: if nothing matches,
+        the slots are read again before giving up.
+
+        Raises:
+            ValueError: if no slot matches
+        """
+        found = self.find(admin, refresh, **requirements)
+        if not found and not refresh:
+            found = self.find(admin, True, **requirements)
+        if not found:
+            raise ValueError(f"no Proteus slot matches {requirements}")
+        return found[0]
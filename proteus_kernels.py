@@ -0,0 +1,124 @@
+import numpy as np
+from proteus_utils import pulse_envelope
+
+# the FPGA packs the 12-bit kernel taps five at a time into four 15-bit words
+KERNEL_RES = 10
+MAX_KERNEL_LEN = 10240
+
+
+def matched_kernel(length, mods, sampleRateADC, cfr, phase=0, kernel_len=MAX_KERNEL_LEN):
+    """
+    Builds a matched-filter IQ-demodulation kernel for a pulse played by
+    makeSqPulse (same as teproteus_functions_v3.iq_kernel, weighted by the
+    pulse envelope).
+
+    Args:
+        length (float): pulse length [s]
+        mods (int): pulse shape (see proteus_utils.pulse_envelope)
+        sampleRateADC (float): digitizer sample rate
+        cfr (float): DDC center frequency
+        phase (float): LO phase [deg]
+        kernel_len (int): kernel length in ADC samples (rounded up to 10)
+
+    Returns:
+        (k_i, k_q)
+    """
+    L = KERNEL_RES * int(np.ceil(kernel_len / KERNEL_RES))
+    assert L <= MAX_KERNEL_LEN, f"kernel longer than {MAX_KERNEL_LEN} samples"
+    envLen = min(int(round(length * sampleRateADC)), L)
+    env = np.zeros(L)
+    env[:envLen] = pulse_envelope(envLen, mods)
+    t = np.arange(L) / sampleRateADC
+    lo = phase * np.pi / 180 + 2 * np.pi * cfr * t
+    return env * np.cos(lo), -env * np.sin(lo)
+
+
+def _to_fix12(x, M=2**11, A=2**12):
+    # same rounding as teproteus_functions_v3.convert_IQ_to_sample
+    return np.where(x < 0, np.trunc(x * M) + A, np.trunc(x * (M - 1))).astype(np.uint32)
+
+
+def _to_15bit(b):
+    b = b.reshape(-1, 5)
+    out = np.empty((len(b), 4), dtype=np.uint32)
+    out[:, 0] = (b[:, 1] & 0x7) * 4096 + b[:, 0]
+    out[:, 1] = (b[:, 2] & 0x3F) * 512 + ((b[:, 1] & 0xFF8) >> 3)
+    out[:, 2] = (b[:, 3] & 0x1FF) * 64 + ((b[:, 2] & 0xFC0) >> 6)
+    out[:, 3] = (b[:, 4] & 0xFFF) * 8 + ((b[:, 3] & 0xE00) >> 9)
+    return out.reshape(-1)
+
+
+def pack_kernel(k_i, k_q):
+    """
+    Vectorized teproteus_functions_v3.pack_kernel_data: normalizes the
+    kernel, converts it to 12-bit fixed point and packs it into the uint32
+    words expected by :DSP:IQD:KER:DATA (bit-identical output).
+    """
+    assert k_i.size == k_q.size and k_i.size % 5 == 0, "kernel length must be a multiple of 5"
+    norm = np.sqrt(np.amax(k_i**2 + k_q**2))
+    out_i = _to_15bit(_to_fix12(k_i / norm))
+    out_q = _to_15bit(_to_fix12(k_q / norm))
+    return (out_q << 16) + out_i
+
+
+class KernelManager:
+    """
+    Builds, caches and uploads the DSP IQ-demodulation kernels.
+
+    Packed kernels are cached by (pulse length, shape, cfr, phase, ADC rate,
+    kernel length) and a kernel is only uploaded when the one resident on a
+    DSP path differs.
+
+    Example:
+        proteus.kernels.upload_for_pulse(p2, cfr, dsp = 1)
+    """
+    def __init__(self, proteus, kernel_len=MAX_KERNEL_LEN):
+        self.proteus = proteus
+        self.kernel_len = kernel_len
+        self._packed = {}
+        self._resident = {}
+
+    def key(self, length, mods, cfr, phase=0):
+        return (float(length), int(mods), float(cfr), float(phase),
+                float(self.proteus.sampleRateADC), self.kernel_len)
+
+    def packed(self, length, mods, cfr, phase=0):
+        """
+        Returns the packed kernel, building it only on the first request.
+        """
+        key = self.key(length, mods, cfr, phase)
+        if key not in self._packed:
+            k_i, k_q = matched_kernel(length, mods, self.proteus.sampleRateADC, cfr, phase, self.kernel_len)
+            self._packed[key] = pack_kernel(k_i, k_q)
+        return self._packed[key]
+
+    def upload(self, length, mods, cfr, phase=0, dsp=1):
+        """
+        Uploads the kernel to DSP path `dsp` unless it is already there.
+
+        Returns:
+            True if the kernel was sent
+        """
+        key = self.key(length, mods, cfr, phase)
+        if self._resident.get(dsp) == key and self.proteus.recorder is None:
+            return False
+        kernel = self.packed(length, mods, cfr, phase)
+        with self.proteus.exclusive():
+            self.proteus.send_scpi_cmd(f':DSP:IQD:SEL DSP{dsp}')
+            self.proteus.write_binary_data(':DSP:IQD:KER:DATA', kernel)
+            self.proteus.check_errors(f"kernel not uploaded to DSP{dsp}")
+            self._resident[dsp] = key
+        return True
+
+    def upload_for_pulse(self, pulse, cfr, dsp=1):
+        """
+        Uploads the matched kernel of a defPulse pulse (after makeBlocks has
+        rounded its length).
+        """
+        return self.upload(pulse['length'], pulse['mod'], cfr, pulse['phase'], dsp)
+
+    def invalidate(self):
+        """
+        Forgets which kernels are on the instrument (the cache is kept).
+        """
+        self._resident = {}
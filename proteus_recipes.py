@@ -0,0 +1,207 @@
+import os
+import json
+import hashlib
+import importlib.util
+import numpy as np
+from proteus_utils import json_default
+
+# TaborProteus attributes restored when a recipe is replayed
+RECIPE_ATTRS = ('sampleRateDAC', 'sampleRateADC', 'interp', 'adcChan', 'dacChan')
+
+# bump when the recipe layout or replay semantics change
+RECIPE_VERSION = 1
+
+# modules whose source generates the recorded streams; a change in any of
+# them gives every recipe a new key, so stale recipes are never replayed
+RECIPE_SOURCES = ('TaborProteus', 'proteus_utils', 'proteus_kernels', 'proteus_acquisition', 'scpi_cache')
+
+
+def source_fingerprint(sources=RECIPE_SOURCES):
+    """
+    Hash of the source files of `sources` (module names, module objects or
+    file paths); a source that cannot be found counts by name only.
+    """
+    sha = hashlib.sha1()
+    for source in sources:
+        if isinstance(source, str):
+            sha.update(source.encode())
+            path = source if os.path.isfile(source) else None
+            if path is None:
+                spec = importlib.util.find_spec(source)
+                path = spec.origin if spec is not None else None
+        else:
+            sha.update(source.__name__.encode())
+            path = getattr(source, '__file__', None)
+        if path and os.path.isfile(path):
+            with open(path, 'rb') as f:
+                sha.update(f.read())
+    return sha.hexdigest()[:16]
+
+
+class RecipeRecorder:
+    """
+    Collects the SCPI commands and binary blocks sent by a TaborProteus while
+    it is attached as `proteus.recorder`.
+    """
+    def __init__(self):
+        self.ops = []
+        self.payloads = []
+        self.nbytes = 0
+
+    def command(self, cmd):
+        self.ops.append(['cmd', str(cmd)])
+
+    def binary(self, prefix, data):
+        if not isinstance(data, np.ndarray):
+            data = np.frombuffer(data, dtype=np.uint8)
+        data = np.ascontiguousarray(data)
+        self.ops.append(['bin', str(prefix), self.nbytes, data.nbytes, data.dtype.str])
+        self.payloads.append(data.view(np.uint8).reshape(-1))
+        self.nbytes += data.nbytes
+
+
+class RecipeBook:
+    """
+    On-disk cache of compiled setup sequences ("recipes").
+
+    A recipe is the full command/binary stream produced by a TaborProteus
+    setup call for one set of input parameters. Each recipe lives in its own
+    directory under `root`:
+
+        recipe.json   commands, binary-block offsets, attributes and result
+        payload.bin   all binary blocks back to back (opened as np.memmap)
+
+    The key of a recipe covers RECIPE_VERSION and the source of the modules
+    that generate it (RECIPE_SOURCES plus `sources`), so editing any of them
+    records the recipe anew instead of replaying a stale stream.
+
+    Example:
+        book = RecipeBook(proteus, 'recipes', sources = [__file__])
+        readLen = book.run('pulses', params, lambda: setup(proteus, **params))
+    """
+    def __init__(self, proteus, root='recipes', sources=()):
+        # sources: further modules or files the setup functions live in
+        self.proteus = proteus
+        self.root = root
+        self.fingerprint = source_fingerprint(RECIPE_SOURCES + tuple(sources))
+        self._loaded = {}
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, name, params):
+        blob = json.dumps({'name': name, 'params': params, 'version': RECIPE_VERSION,
+                           'source': self.fingerprint}, sort_keys=True, default=json_default)
+        return f"{name}-{hashlib.sha1(blob.encode()).hexdigest()[:16]}"
+
+    def path(self, name, params):
+        return os.path.join(self.root, self.key(name, params))
+
+    def has(self, name, params):
+        key = self.key(name, params)
+        return key in self._loaded or os.path.exists(os.path.join(self.root, key, 'recipe.json'))
+
+    def run(self, name, params, setup_fn):
+        """
+        Replays the recipe for (name, params) if one exists, otherwise runs
+        `setup_fn()` on the instrument while recording it.
+
+        Returns:
+            the (JSON round-tripped) return value of setup_fn
+        """
+        if self.has(name, params):
+            return self.replay(name, params)
+        return self.record(name, params, setup_fn)
+
+    def record(self, name, params, setup_fn):
+        proteus = self.proteus
+        assert proteus.recorder is None, "already recording"
+        recorder = RecipeRecorder()
+        proteus.recorder = recorder
+        try:
+            result = setup_fn()
+        finally:
+            proteus.recorder = None
+        recipe = {
+            'name': name,
+            'params': params,
+            'version': RECIPE_VERSION,
+            'source': self.fingerprint,
+            'ops': recorder.ops,
+            'attrs': {attr: getattr(proteus, attr) for attr in RECIPE_ATTRS},
+            'result': result,
+        }
+        recipe = json.loads(json.dumps(recipe, default=json_default))
+        path = self.path(name, params)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'payload.bin'), 'wb') as f:
+            for payload in recorder.payloads:
+                f.write(payload)
+        # recipe.json last: its presence marks a complete recipe
+        with open(os.path.join(path, 'recipe.json'), 'w') as f:
+            json.dump(recipe, f)
+        self._loaded.pop(self.key(name, params), None)
+        return recipe['result']
+
+    def load(self, key):
+        """
+        Loads a recipe by key; binary payloads are memory-mapped, not read.
+        """
+        if key not in self._loaded:
+            path = os.path.join(self.root, key)
+            with open(os.path.join(path, 'recipe.json')) as f:
+                recipe = json.load(f)
+            payload_path = os.path.join(path, 'payload.bin')
+            if os.path.getsize(payload_path) > 0:
+                recipe['payload'] = np.memmap(payload_path, dtype=np.uint8, mode='r')
+            else:
+                recipe['payload'] = np.zeros(0, dtype=np.uint8)
+            self._loaded[key] = recipe
+        return self._loaded[key]
+
+    def prewarm(self, touch=False):
+        """
+        Loads every recipe under `root` (e.g. on server start).
+
+        Args:
+            touch (bool): also read the payloads once to fill the OS page cache
+
+        Returns:
+            list of the loaded recipe keys
+        """
+        keys = []
+        for key in sorted(os.listdir(self.root)):
+            if not os.path.exists(os.path.join(self.root, key, 'recipe.json')):
+                continue
+            recipe = self.load(key)
+            if touch and len(recipe['payload']):
+                int(np.add.reduce(recipe['payload'][::4096], dtype=np.uint64))
+            keys.append(key)
+        return keys
+
+    def replay(self, name, params):
+        """
+        Pushes a recorded recipe back to the instrument. Commands between two
+        binary blocks go out as compound messages and the error queue is
+        checked once at the end.
+        """
+        proteus = self.proteus
+        recipe = self.load(self.key(name, params))
+        payload = recipe['payload']
+        print(f"Replaying recipe {self.key(name, params)} ({len(recipe['ops'])} operations)")
+        # nothing from other threads may land between the recorded steps
+        with proteus.exclusive():
+            batch = proteus.batch()
+            for op in recipe['ops']:
+                if op[0] == 'cmd':
+                    batch.add(op[1])
+                    continue
+                _, prefix, offset, nbytes, dtype = op
+                batch.flush()
+                data = payload[offset:offset + nbytes].view(np.dtype(dtype))
+                proteus.write_binary_data(prefix, data)
+            batch.flush()
+            proteus.check_errors(f"recipe {name} not replayed correctly")
+            # segment contents written by the recipe are not tracked
+            proteus.resident_segments.clear()
+            for attr, value in recipe['attrs'].items():
+                setattr(proteus, attr, value)
+        return recipe['result']
@@ -0,0 +1,387 @@
+import os
+import sys
+import socket
+import struct
+import threading
+import socketserver
+from contextlib import contextmanager
+import numpy as np
+
+# Local session daemon: one process owns the TEProteusAdmin/TEProteusInst
+# handles and scripts attach to it instead of loading the DLL, enumerating
+# the slots and opening the instrument every time they start.
+#
+#   python proteus_session.py [--slot N] [--address PATH|HOST:PORT]
+#   proteus = TaborProteus(session = True)
+#
+# Clients talk a small binary protocol over a Unix socket (a localhost TCP
+# port where AF_UNIX is not available, i.e. Windows):
+#
+#   request  <BiIQ  op, arg, len(text), len(payload)  + text + payload
+#   reply    <iIQ   code, len(text), len(payload)     + text + payload
+#
+# Binary data is sent as-is in the payload, so :TRAC:DATA writes and
+# :DIG:DATA:READ? reads cost one copy through the socket and nothing else.
+
+REQUEST = struct.Struct('<BiIQ')
+REPLY = struct.Struct('<iIQ')
+
+OP_PING = 0
+OP_CMD = 1            # arg: paranoia level (-1 for the default)
+OP_QUERY = 2          # arg: max response length
+OP_WRITE_BIN = 3
+OP_READ_BIN = 4       # payload: uint64 number of bytes to read
+OP_GET_PARANOIA = 5
+OP_SET_PARANOIA = 6   # arg: level
+OP_LOCK = 7
+OP_UNLOCK = 8
+OP_SHUTDOWN = 9
+
+ERR_EXCEPTION = -1000
+
+DEFAULT_TCP_PORT = 5125
+_NUM_BYTES = struct.Struct('<Q')
+
+
+def default_address():
+    """
+    Address of the session daemon: $PROTEUS_SESSION if set ('HOST:PORT' or a
+    socket path), otherwise a Unix socket in the user's runtime directory
+    ($XDG_RUNTIME_DIR, or a per-user name in the temp directory), or
+    localhost:5125 where AF_UNIX is missing.
+    """
+    addr = os.environ.get('PROTEUS_SESSION')
+    if addr:
+        return parse_address(addr)
+    if hasattr(socket, 'AF_UNIX'):
+        runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+        if runtime_dir and os.path.isdir(runtime_dir):
+            return os.path.join(runtime_dir, 'proteus_session.sock')
+        return os.path.join(os.environ.get('TMPDIR', '/tmp'), f'proteus_session-{os.getuid()}.sock')
+    return ('127.0.0.1', DEFAULT_TCP_PORT)
+
+
+def parse_address(addr):
+    if isinstance(addr, tuple):
+        return addr
+    host, sep, port = addr.rpartition(':')
+    if sep and port.isdigit() and os.sep not in port:
+        return (host or '127.0.0.1', int(port))
+    return addr
+
+
+def _family(address):
+    return socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+
+
+def _recv_exact(sock, view):
+    view = memoryview(view).cast('B')
+    while len(view):
+        n = sock.recv_into(view)
+        if n == 0:
+            raise ConnectionError("session connection closed")
+        view = view[n:]
+
+
+def _recv_bytes(sock, n):
+    buf = bytearray(n)
+    _recv_exact(sock, buf)
+    return bytes(buf)
+
+
+class _SessionHandler(socketserver.BaseRequestHandler):
+    """
+    Serves one client connection; every request runs under the daemon's
+    instrument lock, so requests of different tools never interleave.
+    """
+    def setup(self):
+        self.held = 0
+
+    def handle(self):
+        sock = self.request
+        hdr = bytearray(REQUEST.size)
+        while True:
+            try:
+                _recv_exact(sock, hdr)
+            except (ConnectionError, OSError):
+                return
+            op, arg, text_len, payload_len = REQUEST.unpack(hdr)
+            text = _recv_bytes(sock, text_len).decode() if text_len else ''
+            payload = None
+            if payload_len:
+                payload = np.empty(payload_len, dtype=np.uint8)
+                _recv_exact(sock, payload)
+            try:
+                with self.server.lock:
+                    code, rtext, rpayload = self.execute(op, arg, text, payload)
+            except Exception as e:  # report to the client, keep serving
+                code, rtext, rpayload = ERR_EXCEPTION, f"{type(e).__name__}: {e}", None
+            rtext = rtext.encode()
+            nbytes = 0 if rpayload is None else rpayload.nbytes
+            sock.sendall(REPLY.pack(code, len(rtext), nbytes) + rtext)
+            if nbytes:
+                sock.sendall(memoryview(rpayload).cast('B'))
+            if op == OP_SHUTDOWN:
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return
+
+    def execute(self, op, arg, text, payload):
+        inst = self.server.inst
+        if op == OP_PING:
+            return 0, self.server.description, None
+        if op == OP_CMD:
+            return inst.send_scpi_cmd(text, None if arg < 0 else arg), '', None
+        if op == OP_QUERY:
+            return 0, inst.send_scpi_query(text, arg), None
+        if op == OP_WRITE_BIN:
+            data = payload if payload is not None else np.zeros(0, dtype=np.uint8)
+            return inst.write_binary_data(text, data), '', None
+        if op == OP_READ_BIN:
+            num_bytes = _NUM_BYTES.unpack(payload.tobytes())[0]
+            out = np.empty(num_bytes, dtype=np.uint8)
+            return inst.read_binary_data(text, out, num_bytes), '', out
+        if op == OP_GET_PARANOIA:
+            return inst.default_paranoia_level, '', None
+        if op == OP_SET_PARANOIA:
+            inst.default_paranoia_level = arg
+            return 0, '', None
+        if op == OP_LOCK:
+            # the request already holds the lock; take it once more for the client
+            self.server.lock.acquire()
+            self.held += 1
+            return 0, '', None
+        if op == OP_UNLOCK:
+            assert self.held > 0, "session is not locked by this client"
+            self.server.lock.release()
+            self.held -= 1
+            return 0, '', None
+        if op == OP_SHUTDOWN:
+            return 0, '', None
+        raise ValueError(f"unknown session op {op}")
+
+    def finish(self):
+        # a client that exits inside exclusive() must not block the others
+        while self.held:
+            self.server.lock.release()
+            self.held -= 1
+
+
+class SessionDaemon(socketserver.ThreadingMixIn, socketserver.BaseServer):
+    """
+    Owns one open instrument and serves it to local clients. The Unix socket
+    is accessible to the daemon's user only; the TCP fallback (Windows)
+    accepts any local process.
+
+    Example:
+        daemon = SessionDaemon.open(slot_id = None)   # first free slot
+        daemon.serve_forever()
+    """
+    daemon_threads = True
+
+    def __init__(self, inst, admin=None, address=None, description=''):
+        self.address = parse_address(address) if address is not None else default_address()
+        self.socket = socket.socket(_family(self.address), socket.SOCK_STREAM)
+        if isinstance(self.address, tuple):
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        elif os.path.exists(self.address):
+            client = attach(self.address)
+            if client is not None:
+                client.close_instrument()
+                raise RuntimeError(f"a session daemon is already serving {self.address}")
+            os.unlink(self.address)  # stale socket of a daemon that did not exit cleanly
+        socketserver.BaseServer.__init__(self, self.address, _SessionHandler)
+        if isinstance(self.address, tuple):
+            self.socket.bind(self.address)
+        else:
+            # only this user may drive (or OP_LOCK) the instrument
+            umask = os.umask(0o177)
+            try:
+                self.socket.bind(self.address)
+            finally:
+                os.umask(umask)
+            os.chmod(self.address, 0o600)
+        self.socket.listen(8)
+        self.inst = inst
+        self.admin = admin
+        self.description = description
+        # RLock: OP_LOCK keeps it held across requests of the same connection
+        self.lock = threading.RLock()
+
+    @classmethod
+    def open(cls, slot_id=None, address=None, lib_dir_path=None):
+        """
+        Loads the DLL and opens `slot_id` (the first free slot if None).
+        """
+        from teproteus import TEProteusAdmin as TepAdmin
+        admin = TepAdmin(lib_dir_path)
+        if slot_id is None:
+            from proteus_inventory import Inventory
+            slot_id = Inventory().select(admin)['slot_id']
+        inst = admin.open_instrument(slot_id=slot_id)
+        idn = inst.send_scpi_query('*IDN?')
+        return cls(inst, admin, address, description=f"slot {slot_id}: {idn}")
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def get_request(self):
+        conn, addr = self.socket.accept()
+        if conn.family == socket.AF_INET:
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn, addr
+
+    def shutdown_request(self, request):
+        try:
+            request.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        request.close()
+
+    def server_close(self):
+        super().server_close()
+        self.socket.close()
+        if not isinstance(self.address, tuple) and os.path.exists(self.address):
+            os.unlink(self.address)
+        if self.inst is not None:
+            self.inst.close_instrument()
+            self.inst = None
+        if self.admin is not None:
+            self.admin.close_inst_admin()
+            self.admin = None
+
+
+class SessionClient:
+    """
+    Attached instrument session with the TEProteusInst interface
+    (send_scpi_cmd, send_scpi_query, write_binary_data, read_binary_data,
+    default_paranoia_level, close_instrument), so it can be passed to
+    TaborProteus(inst = ...).
+
+    Every call is atomic with respect to other clients; use exclusive() to
+    keep a whole sequence (e.g. a segment download or a readout) together.
+    Other clients' commands are not seen by any client, so TaborProteus
+    turns its SCPI state cache and resident-segment skipping off on a
+    session.
+    """
+    def __init__(self, address=None, timeout=None):
+        self.address = parse_address(address) if address is not None else default_address()
+        self._sock = socket.socket(_family(self.address), socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(self.address)
+        self._sock.settimeout(None)
+        if isinstance(self.address, tuple):
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.description = self._request(OP_PING)[1]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close_instrument()
+
+    def _request(self, op, arg=0, text='', payload=None, out=None):
+        text = str(text).encode()
+        nbytes = 0 if payload is None else memoryview(payload).nbytes
+        self._sock.sendall(REQUEST.pack(op, arg, len(text), nbytes) + text)
+        if nbytes:
+            self._sock.sendall(memoryview(payload).cast('B'))
+        hdr = bytearray(REPLY.size)
+        _recv_exact(self._sock, hdr)
+        code, text_len, payload_len = REPLY.unpack(hdr)
+        rtext = _recv_bytes(self._sock, text_len).decode() if text_len else ''
+        if code == ERR_EXCEPTION:
+            raise RuntimeError(f"session daemon: {rtext}")
+        if payload_len:
+            if out is None:
+                out = np.empty(payload_len, dtype=np.uint8)
+            # straight into the caller's array
+            _recv_exact(self._sock, memoryview(out).cast('B')[:payload_len])
+        return code, rtext
+
+    @property
+    def default_paranoia_level(self):
+        return self._request(OP_GET_PARANOIA)[0]
+
+    @default_paranoia_level.setter
+    def default_paranoia_level(self, value):
+        self._request(OP_SET_PARANOIA, int(value))
+
+    def send_scpi_cmd(self, scpi_str, paranoia_level=None):
+        return self._request(OP_CMD, -1 if paranoia_level is None else paranoia_level, scpi_str)[0]
+
+    def send_scpi_query(self, scpi_str, max_resp_len=256):
+        return self._request(OP_QUERY, max_resp_len, scpi_str)[1]
+
+    def write_binary_data(self, scpi_pref, bin_dat):
+        if isinstance(bin_dat, np.ndarray) and not bin_dat.flags.c_contiguous:
+            bin_dat = np.ascontiguousarray(bin_dat)
+        return self._request(OP_WRITE_BIN, 0, scpi_pref, bin_dat)[0]
+
+    def read_binary_data(self, scpi_pref, out_array, num_bytes):
+        assert out_array.flags.c_contiguous and out_array.nbytes >= num_bytes, "out_array too small"
+        return self._request(OP_READ_BIN, 0, scpi_pref, _NUM_BYTES.pack(int(num_bytes)), out=out_array)[0]
+
+    @contextmanager
+    def exclusive(self):
+        """
+        Holds the instrument for this client for the duration of the block.
+        """
+        self._request(OP_LOCK)
+        try:
+            yield self
+        finally:
+            self._request(OP_UNLOCK)
+
+    def shutdown_daemon(self):
+        """
+        Closes the instrument and stops the daemon.
+        """
+        self._request(OP_SHUTDOWN)
+        self.close_instrument()
+
+    def close_instrument(self):
+        """
+        Detaches from the daemon; the instrument stays open.
+        """
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+def attach(address=None, timeout=0.5):
+    """
+    Returns a SessionClient if a session daemon is running, otherwise None.
+    Without a daemon this costs one refused connection (or a missing socket
+    file), not the timeout.
+    """
+    address = parse_address(address) if address is not None else default_address()
+    if isinstance(address, str) and not os.path.exists(address):
+        return None
+    try:
+        return SessionClient(address, timeout)
+    except (ConnectionError, FileNotFoundError, socket.timeout, OSError):
+        return None
+
+
+def main(argv):
+    slot_id, address = None, None
+    if '--slot' in argv:
+        slot_id = int(argv[argv.index('--slot') + 1])
+    if '--address' in argv:
+        address = argv[argv.index('--address') + 1]
+    srcpath = os.path.realpath('D:/400_AWT/400_setup_python/Tabor Library')
+    sys.path.append(srcpath)
+    daemon = SessionDaemon.open(slot_id, address)
+    print(f"Proteus session on {daemon.address} ({daemon.description})")
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.server_close()
+        print("Proteus session closed")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
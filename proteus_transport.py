@@ -0,0 +1,230 @@
+import numpy as np
+
+# One interface over the ways of reaching a Proteus, which TaborProteus
+# talks to instead of the instrument classes directly:
+#
+#   PXI      TEProteusInst (TEProteus.dll)
+#   session  proteus_session.SessionClient (the DLL in a daemon process)
+#   LAN      tevisainst.TEVisaInst (VISA or a raw SCPI socket)
+#
+# Their methods share names but not semantics (TEVisaInst.read_binary_data
+# ignores num_bytes and resizes the array to whatever block arrives, the DLL
+# reads exactly num_bytes). A Transport fixes the semantics and states what
+# the link can do in capability flags; the binary operations pick the
+# fastest path from those flags rather than from the instrument type:
+#
+#   streaming  a block can be sent while it is still being produced
+#   max_block  bytes per send of a binary block (None: the whole block at once)
+#   zero_copy  binary data goes from the caller's buffer to the link in place
+#
+#   transport = open_transport(inst)
+#   transport.write_binary_stream(':TRAC:DATA', chunks, num_bytes)
+
+
+def byte_view(chunk):
+    """
+    uint8 view of a buffer-protocol object (a non-contiguous numpy array is
+    copied once).
+    """
+    if isinstance(chunk, np.ndarray):
+        chunk = np.ascontiguousarray(chunk)
+    return np.frombuffer(memoryview(chunk).cast('B'), dtype=np.uint8)
+
+
+class Transport:
+    """
+    Base transport: passes SCPI through to the wrapped instrument and
+    implements the binary operations in terms of the capability flags.
+    Attributes it does not define (slot_info, exclusive(), vi, ...) are
+    those of the wrapped instrument.
+    """
+    name = 'generic'
+    streaming = False
+    max_block = None
+    zero_copy = True
+
+    def __init__(self, inst):
+        self.inst = inst
+
+    @staticmethod
+    def accepts(inst):
+        return True
+
+    def __getattr__(self, name):
+        # only called for attributes not found on the transport
+        if name == 'inst':
+            raise AttributeError(name)
+        return getattr(self.inst, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close_instrument()
+
+    def __repr__(self):
+        return (f"<{type(self).__name__} {self.name}: streaming={self.streaming}, "
+                f"max_block={self.max_block}, zero_copy={self.zero_copy}>")
+
+    @property
+    def capabilities(self):
+        return {'streaming': self.streaming, 'max_block': self.max_block, 'zero_copy': self.zero_copy}
+
+    @property
+    def default_paranoia_level(self):
+        return self.inst.default_paranoia_level
+
+    @default_paranoia_level.setter
+    def default_paranoia_level(self, value):
+        self.inst.default_paranoia_level = value
+
+    def send_scpi_cmd(self, scpi_str, paranoia_level=None):
+        return self.inst.send_scpi_cmd(scpi_str, paranoia_level)
+
+    def send_scpi_query(self, scpi_str, max_resp_len=256):
+        return self.inst.send_scpi_query(scpi_str, max_resp_len)
+
+    def write_binary_data(self, scpi_pref, bin_dat):
+        """
+        Sends one binary block from any C-contiguous buffer (a non-contiguous
+        numpy array is copied once).
+
+        Returns:
+            zero if succeeded; otherwise, error code
+        """
+        if isinstance(bin_dat, np.ndarray) and not bin_dat.flags.c_contiguous:
+            bin_dat = np.ascontiguousarray(bin_dat)
+        return self._write(scpi_pref, bin_dat)
+
+    def write_binary_stream(self, scpi_pref, chunks, num_bytes, progress=None):
+        """
+        Sends one binary block of `num_bytes` given as an iterable of chunks.
+        A streaming transport sends each chunk as it is produced; otherwise
+        the chunks are gathered into one buffer and sent at once.
+
+        Args:
+            progress: callback progress(sent_bytes, total_bytes) (optional;
+                only called by streaming transports)
+
+        Returns:
+            zero if succeeded; otherwise, error code
+        """
+        return self._write_stream(scpi_pref, chunks, int(num_bytes), progress)
+
+    def read_binary_data(self, scpi_pref, out_array, num_bytes):
+        """
+        Reads a binary block of exactly `num_bytes` into the start of
+        out_array, which is never resized.
+
+        Returns:
+            zero if succeeded; otherwise, error code
+        """
+        assert out_array.flags.c_contiguous and out_array.nbytes >= num_bytes, \
+            f"out_array holds {out_array.nbytes} bytes, {num_bytes} requested"
+        return self._read(scpi_pref, out_array, int(num_bytes))
+
+    def close_instrument(self):
+        self.inst.close_instrument()
+
+    def _write(self, scpi_pref, bin_dat):
+        return self.inst.write_binary_data(scpi_pref, bin_dat)
+
+    def _write_stream(self, scpi_pref, chunks, num_bytes, progress):
+        # no streaming: gather the chunks into one block and send it at once
+        block = np.empty(num_bytes, dtype=np.uint8)
+        offset = 0
+        for chunk in chunks:
+            chunk = byte_view(chunk)
+            assert offset + len(chunk) <= block.size, f"chunks exceed num_bytes = {num_bytes}"
+            block[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+        assert offset == block.size, f"chunks hold {offset} bytes, num_bytes = {num_bytes}"
+        return self._write(scpi_pref, block)
+
+    def _read(self, scpi_pref, out_array, num_bytes):
+        return self.inst.read_binary_data(scpi_pref, out_array, num_bytes)
+
+
+class PxiTransport(Transport):
+    """
+    TEProteusInst: the DLL takes the whole block from the caller's buffer in
+    one call, so a gathered block in one write beats any chunking.
+    """
+    name = 'PXI'
+
+    @staticmethod
+    def accepts(inst):
+        return hasattr(inst, 'acquire_stream_intf')
+
+
+class SessionTransport(Transport):
+    """
+    proteus_session.SessionClient: the block is copied once through the
+    daemon's socket and written by the daemon in one DLL call.
+    """
+    name = 'session'
+    zero_copy = False
+
+    @staticmethod
+    def accepts(inst):
+        return hasattr(inst, 'shutdown_daemon')
+
+
+class LanTransport(Transport):
+    """
+    TEVisaInst: binary blocks go out in max_block sends straight from the
+    caller's buffer, and chunked blocks are streamed while being produced.
+    Binary prefixes mean what they mean to the DLL: only a leading '*OPC?'
+    makes the write wait for completion.
+    """
+    name = 'LAN'
+    streaming = True
+
+    def __init__(self, inst, max_block=None):
+        super().__init__(inst)
+        from tevisainst import LAN_CHUNK_SIZE
+        self.max_block = LAN_CHUNK_SIZE if max_block is None else int(max_block)
+
+    @staticmethod
+    def accepts(inst):
+        return hasattr(inst, 'write_binary_stream')
+
+    @staticmethod
+    def _paranoia(scpi_pref):
+        # the DLL sends the prefix as given ('*OPC?; :TRAC:DATA' waits for
+        # completion), TEVisaInst prepends '*OPC?' itself per paranoia level
+        pref = '' if scpi_pref is None else str(scpi_pref).strip()
+        if pref.upper().startswith('*OPC?'):
+            return pref[len('*OPC?'):].lstrip('; '), 1
+        return pref, 0
+
+    def _write(self, scpi_pref, bin_dat):
+        pref, level = self._paranoia(scpi_pref)
+        return self.inst.write_binary_data(pref, bin_dat, paranoia_level=level, chunk_size=self.max_block)
+
+    def _write_stream(self, scpi_pref, chunks, num_bytes, progress):
+        pref, level = self._paranoia(scpi_pref)
+        return self.inst.write_binary_stream(pref, chunks, num_bytes, paranoia_level=level, progress=progress)
+
+    def _read(self, scpi_pref, out_array, num_bytes):
+        # a byte view of exactly num_bytes: TEVisaInst fills what the block
+        # header announces and raises instead of resizing a view
+        view = out_array.reshape(-1).view(np.uint8)[:num_bytes]
+        return self.inst.read_binary_data(scpi_pref, view, num_bytes)
+
+
+# tried in order; the first whose accepts() matches wraps the instrument
+TRANSPORTS = [LanTransport, SessionTransport, PxiTransport]
+
+
+def open_transport(inst):
+    """
+    Wraps an open instrument in the matching Transport (an instrument that
+    is already a Transport is returned as is).
+    """
+    if isinstance(inst, Transport):
+        return inst
+    for cls in TRANSPORTS:
+        if cls.accepts(inst):
+            return cls(inst)
+    return Transport(inst)
@@ -1,5 +1,4 @@
 import numpy as np
-import scipy as sp
 
 def makeDC(segLen):
     """
@@ -26,14 +25,17 @@ def makeDC(segLen):
     dacWaveI, dacWaveQ = dacWave.copy(), dacWave.copy()
     return dacWaveI, dacWaveQ
 
-def makeSqPulse(modFreq, segLen, amp, phase, mods, sampleRateDAC):
-    assert segLen % 64 == 0, "segment length must be multiple of 64"
-    ampI, ampQ = amp, amp
-    dt = 1 / sampleRateDAC
-    cycles = segLen * dt * modFreq
-    time = np.arange(0, segLen - 0.5, 1)
-    omega = 2 * np.pi * cycles
+def pulse_envelope(segLen, mods):
+    """
+    Envelope of the pulses made by makeSqPulse.
+
+    Parameters:
+    segLen (int): number of samples
+    mods (int): 0 square, 1 gaussian, 2 cosh^(-2), 3 Hermite
 
+    Returns:
+    np.ndarray of segLen envelope samples (peak 1)
+    """
     if mods == 0:
         #simple square pulse
         modWave = np.ones(segLen)
@@ -54,6 +56,17 @@ def makeSqPulse(modFreq, segLen, amp, phase, mods, sampleRateDAC):
         modWave = np.multiply((1 - factor*0.5*(timeHerm/sigma)**2), np.exp(-0.5*(timeHerm/sigma)**2))
     else:
         raise ValueError("mods form not valid")
+    return modWave
+
+def makeSqPulse(modFreq, segLen, amp, phase, mods, sampleRateDAC):
+    assert segLen % 64 == 0, "segment length must be multiple of 64"
+    ampI, ampQ = amp, amp
+    dt = 1 / sampleRateDAC
+    cycles = segLen * dt * modFreq
+    time = np.arange(0, segLen - 0.5, 1)
+    omega = 2 * np.pi * cycles
+
+    modWave = pulse_envelope(segLen, mods)
     
     max_dac = 2**16 - 1
     half_dac = np.floor(max_dac / 2)
@@ -66,6 +79,112 @@ def makeSqPulse(modFreq, segLen, amp, phase, mods, sampleRateDAC):
 
     return dacWaveI, dacWaveQ
 
+def as_u16_buffer(wave):
+    """
+    Returns `wave` as a flat, C-contiguous uint16 array for :TRAC:DATA.
+
+    Parameters:
+    wave: numpy array, memoryview or any other buffer-protocol object. Non-numpy
+        buffers are taken as raw U16 samples.
+
+    Returns:
+    np.ndarray that shares memory with `wave` whenever it already holds
+    contiguous uint16 data. Other dtypes (e.g. the float output of makeSqPulse)
+    and strided arrays cannot be sent in place and are converted in one copy.
+    """
+    if not isinstance(wave, np.ndarray):
+        return np.frombuffer(wave, dtype=np.uint16)
+    if wave.dtype == np.uint16 and wave.flags.c_contiguous:
+        return wave.reshape(-1)
+    return wave.astype(np.uint16, order='C').reshape(-1)
+
+def interleave_iq(dacWaveI, dacWaveQ, out=None):
+    """
+    Interleaves I and Q (I0, Q0, I1, Q1, ...) as uint16 in a single pass.
+
+    Parameters:
+    dacWaveI, dacWaveQ: arrays of equal length, any numeric dtype
+    out: optional uint16 array of 2*len(dacWaveI) samples to write into, e.g. a
+        slice of a larger pooled buffer. Allocated if None.
+
+    Returns:
+    out
+    """
+    assert len(dacWaveI) == len(dacWaveQ), "I and Q must have the same length"
+    if out is None:
+        out = np.empty(2*len(dacWaveI), dtype=np.uint16)
+    assert out.dtype == np.uint16 and out.shape == (2*len(dacWaveI),), "out must be uint16 of length 2*len(I)"
+    # the casting assignment truncates exactly like astype(np.uint16)
+    out[0::2] = dacWaveI
+    out[1::2] = dacWaveQ
+    return out
+
+def pack_markers(mark1, mark2, out=None):
+    """
+    Packs two marker arrays into the :MARK:DATA format (two samples per
+    byte, each nibble holding mark1 + 2*mark2) without temporaries.
+
+    Parameters:
+    mark1, mark2: 0/1 arrays of equal, even length
+    out: optional uint8 array of len(mark1)//2 bytes to write into
+
+    Returns:
+    out
+    """
+    assert len(mark1) == len(mark2) and len(mark1) % 2 == 0, "markers must have the same, even length"
+    if out is None:
+        out = np.empty(len(mark1)//2, dtype=np.uint8)
+    assert out.dtype == np.uint8 and out.shape == (len(mark1)//2,), "out must be uint8 of length len(mark1)//2"
+    # odd samples go to the high nibble
+    np.multiply(mark2[1::2], 2, out=out, casting='unsafe')
+    np.add(out, mark1[1::2], out=out, casting='unsafe')
+    np.left_shift(out, 4, out=out)
+    np.add(out, mark1[0::2], out=out, casting='unsafe')
+    np.add(out, mark2[0::2], out=out, casting='unsafe')
+    np.add(out, mark2[0::2], out=out, casting='unsafe')
+    return out
+
+def pack_marker_runs(segLen, runs1, runs2, out=None):
+    """
+    Builds the packed :MARK:DATA stream directly from run-length marker
+    descriptions, without materializing per-sample marker arrays.
+
+    Parameters:
+    segLen (int): segment length in samples (even)
+    runs1, runs2: lists of (start, stop) sample intervals in which marker 1 /
+        marker 2 is high (stop exclusive, overlapping intervals allowed)
+    out: optional uint8 array of segLen//2 bytes to write into
+
+    Returns:
+    out, identical to pack_markers() of the equivalent full-length arrays.
+    The work is one slice fill per constant run plus a fix-up per odd edge.
+
+    Example:
+        packed = pack_marker_runs(6400, [(0, 1280)], [(0, 1280)])
+    """
+    assert segLen % 2 == 0, "segment length must be even"
+    if out is None:
+        out = np.empty(segLen//2, dtype=np.uint8)
+    assert out.dtype == np.uint8 and out.shape == (segLen//2,), "out must be uint8 of length segLen//2"
+    runs = [np.asarray(r, dtype=np.int64).reshape(-1, 2) for r in (runs1, runs2)]
+    for r in runs:
+        assert np.all((0 <= r[:, 0]) & (r[:, 0] <= r[:, 1]) & (r[:, 1] <= segLen)), "runs must lie within the segment"
+    bounds = np.unique(np.concatenate([[0, segLen]] + [r.ravel() for r in runs]))
+    # value (mark1 + 2*mark2) of each constant interval [bounds[i], bounds[i+1])
+    values = np.zeros(len(bounds) - 1, dtype=np.uint8)
+    for bit, r in zip((1, 2), runs):
+        delta = np.zeros(len(bounds), dtype=np.int64)
+        np.add.at(delta, np.searchsorted(bounds, r[:, 0]), 1)
+        np.add.at(delta, np.searchsorted(bounds, r[:, 1]), -1)
+        values |= (np.cumsum(delta)[:-1] > 0).astype(np.uint8) * bit
+    # bytes fully inside an interval hold the value in both nibbles
+    for value, b0, b1 in zip(values * 17, (bounds[:-1] + 1)//2, bounds[1:]//2):
+        out[b0:b1] = value
+    # an edge at an odd sample splits its byte between two intervals
+    odd = np.nonzero(bounds[1:-1] % 2)[0] + 1
+    out[bounds[odd]//2] = values[odd - 1] | (values[odd] << 4)
+    return out
+
 def defPulse(amp, mod, length, phase, spacing):
     """
     Define Pulse
@@ -143,10 +262,20 @@ def ampScale(bits, rawSignal):
     return dacSignal
 
 def makeChirp(sampleRateDAC, rampTime, fStart, fStop, bits):
+    # scipy is imported here, not at module level: it is slow to load and only chirps need it
+    from scipy.signal import chirp
     dt = 1/sampleRateDAC
     t = np.arange(0, rampTime + dt/2, dt)
     # round t to valid number
     t = t[:len(t)//64 * 64]
-    dacWave = sp.signal.chirp(t, fStart, np.max(t), fStop)
+    dacWave = chirp(t, fStart, np.max(t), fStop)
     dacWave = ampScale(bits, dacWave)
     return dacWave
+
+def json_default(obj):
+    # json.dump(..., default = json_default) for numpy scalars and arrays
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import numpy as np
+from proteus_utils import json_default
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
+class ResultStore:
+    """
+    Append-only store of per-run results.
+
+    Every run is one uncompressed .npz file holding its per-frame columns
+    (e.g. frame_means_I, frame_means_Q, time_axis); its parameters and scalar
+    metadata go into one line of index.jsonl. The index is loaded into
+    numpy columns, so selecting runs by parameter or time ranges is a
+    vectorized mask instead of a pass over the run files.
+
+        root/index.jsonl        {"run_id": 0, "time": ..., "file": "run_000000.npz", "cfr": ..., ...}
+        root/run_000000.npz
+
+    Example:
+        results = ResultStore('results')
+        results.append({'cfr': cfr, 'tref': tref}, frame_means_I = I, frame_means_Q = Q)
+        ids = results.query(cfr = (100e6, 101e6), time = (t0, None))
+        I = results.stack('frame_means_I', ids)
+    """
+    def __init__(self, root='results'):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._index_path = os.path.join(root, 'index.jsonl')
+        self._rows = []
+        self._offset = 0
+        self._columns = None
+
+    def append(self, meta, **columns):
+        """
+        Stores one run.
+
+        Args:
+            meta (dict): parameters and scalar metadata (JSON-able; nested
+                dicts are flattened to 'outer.inner' keys in the index)
+            columns: per-frame numpy arrays
+
+        Returns:
+            run_id (int)
+
+        Several processes may append to one store: the index is locked from
+        allocating the run_id until its line is written.
+        """
+        with open(self._index_path, 'ab') as index:
+            _lock(index)
+            try:
+                self._refresh()
+                run_id = self._rows[-1]['run_id'] + 1 if self._rows else 0
+                name = f'run_{run_id:06d}.npz'
+                tmp = os.path.join(self.root, name + '.tmp')
+                with open(tmp, 'wb') as f:
+                    np.savez(f, **{key: np.asarray(value) for key, value in columns.items()})
+                os.replace(tmp, os.path.join(self.root, name))
+                row = {'run_id': run_id, 'time': time.time(), 'file': name,
+                       'columns': sorted(columns), 'nframes': max([len(np.atleast_1d(c)) for c in columns.values()], default=0)}
+                row.update(_flatten(meta))
+                # the index line is written last, a run without one does not exist
+                index.write((json.dumps(row, default=json_default) + '\n').encode())
+                index.flush()
+            finally:
+                _unlock(index)
+        return run_id
+
+    def index(self):
+        """
+        Returns the index as a dict of numpy columns (one entry per run;
+        missing values are None).
+        """
+        self._refresh()
+        if self._columns is None:
+            keys = sorted({key for row in self._rows for key in row})
+            self._columns = {key: _column([row.get(key) for row in self._rows]) for key in keys}
+        return self._columns
+
+    def query(self, **ranges):
+        """
+        Selects runs by index columns.
+
+        Args:
+            ranges: column=(lo, hi) for an inclusive range (either end may be
+                None) or column=value for equality, e.g. time=(t0, None).
+                A range needs a column of numbers or of strings (compared
+                lexically); anything else raises ValueError
+
+        Returns:
+            numpy array of matching run_ids
+        """
+        cols = self.index()
+        if not self._rows:
+            return np.zeros(0, dtype=np.int64)
+        mask = np.ones(len(self._rows), dtype=bool)
+        for key, cond in ranges.items():
+            col = cols.get(key)
+            if col is None:
+                return np.zeros(0, dtype=np.int64)
+            if isinstance(cond, tuple):
+                lo, hi = cond
+                if col.dtype == object:
+                    # mixed or missing values: compare element by element,
+                    # numbers with numbers and strings with strings only
+                    kinds = {_kind(v) for v in col if v is not None} | {_kind(b) for b in cond if b is not None}
+                    if len(kinds) > 1 or not kinds <= {'number', 'str'}:
+                        raise ValueError(f"range query on column '{key}' needs numbers or strings throughout, "
+                                         f"got {', '.join(sorted(kinds))}")
+                    valid = np.array([v is not None and (lo is None or v >= lo) and (hi is None or v <= hi)
+                                      for v in col], dtype=bool)
+                else:
+                    valid = np.ones(len(col), dtype=bool)
+                    if lo is not None:
+                        valid &= col >= lo
+                    if hi is not None:
+                        valid &= col <= hi
+                mask &= valid
+            else:
+                mask &= col == cond
+        return cols['run_id'][mask]
+
+    def load(self, run_id, columns=None):
+        """
+        Returns the per-frame columns of one run as a dict.
+        """
+        row = self._row(run_id)
+        with np.load(os.path.join(self.root, row['file'])) as data:
+            names = data.files if columns is None else columns
+            return {name: data[name] for name in names}
+
+    def meta(self, run_id):
+        return dict(self._row(run_id))
+
+    def stack(self, column, run_ids):
+        """
+        Loads one column of many runs; equal-length columns are stacked into
+        a 2D array, otherwise a list is returned.
+        """
+        arrays = [self.load(run_id, [column])[column] for run_id in run_ids]
+        if arrays and all(a.shape == arrays[0].shape for a in arrays):
+            return np.stack(arrays)
+        return arrays
+
+    def __len__(self):
+        self._refresh()
+        return len(self._rows)
+
+    def _row(self, run_id):
+        self._refresh()
+        row = self._rows[int(run_id)]
+        assert row['run_id'] == int(run_id), "index out of order"
+        return row
+
+    def _refresh(self):
+        # read only the index lines appended since the last call
+        if not os.path.exists(self._index_path):
+            return
+        with open(self._index_path, 'rb') as f:
+            f.seek(self._offset)
+            new = f.read()
+        lines = new.split(b'\n')
+        complete = lines[:-1]
+        if not complete:
+            return
+        self._offset += sum(len(line) + 1 for line in complete)
+        self._rows.extend(json.loads(line) for line in complete if line.strip())
+        self._columns = None
+
+
+def _lock(f):
+    # exclusive lock on the whole file, blocking
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _flatten(meta, prefix=''):
+    flat = {}
+    for key, value in meta.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f'{prefix}{key}.'))
+        else:
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def _kind(value):
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+        return 'number'
+    if isinstance(value, str):
+        return 'str'
+    return type(value).__name__
+
+
+def _column(values):
+    if all(isinstance(v, (int, float, np.number)) and not isinstance(v, bool) for v in values):
+        return np.array(values)
+    col = np.empty(len(values), dtype=object)
+    col[:] = values
+    return col
@@ -0,0 +1,148 @@
+import re
+
+# Settable SCPI paths whose last value is cached (3-letter short nodes, no
+# channel suffix digits). Everything else (actions such as :TRAC:DEF,
+# :TASK:COMP:WRITE, :DIG:INIT, *TRG ...) is always sent.
+CACHED_PATHS = {
+    'INS:CHA', 'FRE:RAS', 'VOL', 'INI:CON', 'INT', 'MOD', 'IQM',
+    'NCO:SIX', 'NCO:CFR', 'NCO:PHA', 'OUT', 'FUN:MOD', 'TRA:FOR',
+    'MAR:SEL', 'MAR:STA', 'TRI:ACT:SEL', 'TRI:ACT:STA', 'TRI:LEV',
+    'DIG:MOD', 'DIG:FRE', 'DIG:CHA:SEL', 'DIG:CHA:STA', 'DIG:CHA:RAN',
+    'DIG:DDC:MOD', 'DIG:DDC:CFR', 'DIG:DDC:PHA', 'DIG:DDC:CLK',
+    'DIG:DDC:DEC', 'DIG:DDC:BIN', 'DIG:TRI:SOU', 'DIG:TRI:SLO',
+    'DIG:TRI:LEV', 'DIG:TRI:DEL:EXT', 'DIG:ACQ:TYP', 'DIG:DAT:SEL',
+    'DIG:DAT:TYP', 'DSP:STO', 'DSP:DEC:FRA',
+}
+
+# Setting the key path may silently change the listed paths on the instrument
+DEPENDENT_PATHS = {
+    'INT': ('FRE:RAS',),
+    'MOD': ('FRE:RAS',),
+    'IQM': ('FRE:RAS',),
+    'DIG:MOD': ('DIG:FRE',),
+}
+
+# Common commands that change (or may change) the instrument state
+RESET_CMDS = ('*RST', '*CLS')
+
+_NODE_RE = re.compile(r'([A-Z]+)(\d*)$')
+
+
+def _short_node(node):
+    """
+    Reduces a SCPI node to its first three letters plus suffix digits so that
+    short and long forms map to the same key (e.g. RANGe/RANG -> RAN).
+    """
+    node = node.strip().upper()
+    m = _NODE_RE.match(node)
+    if m is None:
+        return node
+    return m.group(1)[:3] + m.group(2)
+
+
+def split_scpi(cmd):
+    """
+    Splits a (possibly ';'-joined) SCPI message into its commands.
+    """
+    return [part.strip() for part in str(cmd).split(';') if part.strip()]
+
+
+def parse_scpi(part):
+    """
+    Parses a single SCPI command.
+
+    Returns:
+        (path, value) where path is the normalized header without the optional
+        SOURce root and value is a tuple of normalized arguments, or
+        (None, None) for common commands and queries.
+    """
+    if part.startswith('*') or '?' in part:
+        return None, None
+    fields = part.split(None, 1)
+    nodes = [_short_node(n) for n in fields[0].strip(':').split(':') if n]
+    if nodes and nodes[0] == 'SOU':
+        nodes = nodes[1:]
+    args = fields[1].split(',') if len(fields) > 1 else []
+    value = []
+    for arg in args:
+        arg = arg.strip()
+        try:
+            value.append(repr(float(arg)))
+        except ValueError:
+            value.append(arg.upper())
+    return ':'.join(nodes), tuple(value)
+
+
+class SCPIStateCache:
+    """
+    Write-through cache of the last value sent to each settable SCPI path.
+
+    Channel-scoped settings are keyed by the selected :INST:CHAN (and
+    :MARK:SEL / :TRIG:ACT:SEL / :DIG:CHAN:SEL where relevant), so switching
+    channels, markers or triggers never elides a command meant for another.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.saved = 0
+        self._state = {}
+
+    def invalidate(self):
+        """
+        Forgets everything; the next command of every path is sent.
+        """
+        self._state = {}
+
+    def is_redundant(self, cmd):
+        """
+        Returns True (and counts a saved round-trip) if sending `cmd` would
+        not change the cached instrument state.
+        """
+        if not self.enabled:
+            return False
+        parts = split_scpi(cmd)
+        if len(parts) != 1:
+            return False
+        path, value = parse_scpi(parts[0])
+        if not self._cacheable(path):
+            return False
+        if self._state.get(self._key(path)) == value:
+            self.saved += 1
+            return True
+        return False
+
+    def update(self, cmd, ret_code=0):
+        """
+        Records the values set by a command that was sent to the instrument.
+        """
+        for part in split_scpi(cmd):
+            if part.upper() in RESET_CMDS:
+                self.invalidate()
+                continue
+            path, value = parse_scpi(part)
+            if not self._cacheable(path):
+                continue
+            key = self._key(path)
+            if ret_code != 0:
+                self._state.pop(key, None)
+                continue
+            self._state[key] = value
+            for dep in DEPENDENT_PATHS.get(re.sub(r'\d', '', path), ()):
+                self._state.pop(self._key(dep), None)
+
+    def _cacheable(self, path):
+        return path is not None and re.sub(r'\d', '', path) in CACHED_PATHS
+
+    def _key(self, path):
+        state = self._state
+        if path.startswith('INS'):
+            return ('inst', path)
+        if path.startswith('DIG:CHA') and path != 'DIG:CHA:SEL':
+            return ('dig', state.get(('dig', 'DIG:CHA:SEL')), path)
+        if path.startswith('DIG') or path.startswith('DSP'):
+            return ('dig', path)
+        chan = state.get(('inst', 'INS:CHA'))
+        if path.startswith('MAR:STA'):
+            return ('dac', chan, state.get(('dac', chan, 'MAR:SEL')), path)
+        if path.startswith('TRI') and path != 'TRI:ACT:SEL':
+            return ('dac', chan, state.get(('dac', chan, 'TRI:ACT:SEL')), path)
+        return ('dac', chan, path)
@@ -2,20 +2,114 @@ import numpy as np
 import socket
 import signal
 import time
-import matplotlib.pyplot as plt
 import os
 import sys
 srcpath = os.path.realpath('D:/400_AWT/400_setup_python/Tabor Library')
 sys.path.append(srcpath)
 from teproteus_functions_v3 import get_cpatured_header
 from teproteus_functions_v3 import connect, disconnect
-from tevisainst import TEVisaInst
 from teproteus import TEProteusAdmin as TepAdmin
 from teproteus import TEProteusInst as TepInst
 from TaborProteus import TaborProteus
 from proteus_utils import defPulse, defBlock, makeChirp
+from proteus_recipes import RecipeBook
+from capture_store import CaptureStore
+from result_store import ResultStore
+from proteus_acquisition import demux_frames, FrameFilter
 import traceback
 
+def setup_pulse_sequence(inst, p1_len, p2_len, p2_spacing, tacq, tref, tof):
+    sampleRateDAC = 1.125e9
+    sampleRateADC = 2.25e9
+    ADC_ch = 2
+    
+    # Set sample rate for ADC and DAC
+    inst.sampleRateDAC, inst.sampleRateADC = sampleRateDAC, sampleRateADC
+    
+    print("Generating pulse sequence...")
+    p1 = defPulse(amp = 1, mod = 0, length = p1_len, phase = 0, spacing = 5e-6)
+    p2 = defPulse(amp = 1, mod = 0, length = p2_len, phase = 90, spacing = p2_spacing)
+    # round it up to 64 (Need to check if it rounds up correctly)
+
+    b1 = defBlock([p1, p2], reps = [1, 100000], markers = [1, 1], trigs = [0, 1])
+    # b2 = defBlock([p1, p2], reps = [num_Pulses, num_Pulses], markers = [1, 1], trigs = [1, 1])
+    inst.makeBlocks(block_l = [b1], ch = 1, repeatSeq = [1])
+    print("Pulse sequence generation done.")
+    
+    cfr = 100.524e6 + tref + tof  # carrier frequency + reference frequency + offset frequency
+
+    inst.set_interpolation(ch = 1, interp_factor = 8)
+    inst.set_NCO(cfr = cfr, phase = 90)
+
+    # This is hard-coded for now.
+    numframes = b1['reps'][1]
+    
+    # Handle trigger-based data acquisition
+    # SET DIGITIZER
+    assert inst.sampleRateDAC / 4 == inst.sampleRateADC, "sampleRateDAC must be set multiple of 4"
+    
+    print("Setting Digitizer...")
+    acq_delay = 12e-6
+    readLen, numframes= inst.set_digitizer(inst.sampleRateADC, numframes, cfr, tacq, acq_delay, ADC_ch)
+    inst.send_scpi_query(':DIG:ACQuire:FRAM:STATus?')
+    print("Done setting digitizer.")
+    return {'numframes': numframes, 'readLen': readLen, 'p2': p2, 'cfr': cfr}
+
+def program_chirp(inst, awg_center_freq, awg_bw_freq, sweep_freq, srs_freq, pol_time):
+    # Program the MW Chirp waveform
+    sampleRateDAC = 9e9
+    bits = 16
+    # pol_time in seconds
+    
+    fCenter = awg_center_freq - srs_freq
+    fStart, fStop = fCenter - 0.5*awg_bw_freq, fCenter + 0.5*awg_bw_freq
+    rampTime = 1/sweep_freq
+    dac_chan = 3
+    trig_num = 2
+
+    print("Initializing...")
+    # Initialize the instrument or device
+    inst.reset()
+    inst.initialize_AWG(ch = dac_chan)
+    print("Done initializing.")
+    
+    # generate chirp form
+    seg_dict = {}
+    chirp = makeChirp(sampleRateDAC, rampTime, fStart, fStop, bits)
+
+    seg_dict[1] = chirp
+    seg_dict[2] = np.flip(chirp)
+
+    inst.send_scpi_cmd(f':FREQ:RAST {sampleRateDAC}')
+    # DOWNLOAD TWO SEGMENTS
+    for k, dacWave in seg_dict.items():
+        segMem = k
+        inst.download_waveform(dac_chan, segMem, dacWave)
+    
+    #CONTINUOUS MODE ON
+    inst.send_scpi_cmd(":INIT:CONT OFF")
+    inst.send_scpi_cmd(":INIT:CONT ON")
+
+    #TURN ANY OUTPUT OFF
+    inst.send_scpi_cmd(":OUTP OFF")
+
+    # TURN ON OUTPUT WITH NCO FREQUENCY SET AS CARRIER FREQUENCY
+    # maybe need to create a image frequency
+    inst.send_scpi_cmd(f":SOUR:NCO:CFR1 {srs_freq}")
+    inst.send_scpi_cmd(':NCO:SIXD1 ON')
+    inst.send_scpi_cmd(':SOUR:MODE DUC')
+
+    #set trigger as source
+    voltage_level = 1
+    inst.send_scpi_cmd(f':TRIG:ACTIVE:SEL TRG{trig_num}')
+    inst.send_scpi_cmd(f':TRIG:LEV {voltage_level}')
+    inst.send_scpi_cmd(':TRIG:ACTIVE:STAT ON')
+    num_cycles = int(np.floor(pol_time * sweep_freq))
+    
+    inst.set_chirp_tasktable_trig(ch = dac_chan, segMem = 1, num_reps = num_cycles, trig_num = trig_num)
+    inst.send_scpi_cmd(':SOUR:VOLT MAX')
+    inst.send_scpi_cmd(':SOUR:FUNC:MODE TASK')
+
 def main():
     # Set up the UDP connection
     remote_addr = '192.168.0.122'  # Replace with the remote server IP address
@@ -28,6 +122,15 @@ def main():
 
     #initialize Proteus
     inst = TaborProteus()
+    # recorded setups, keyed by the UDP command parameters
+    recipes = RecipeBook(inst, 'recipes', sources = [__file__])
+    print(f"Pre-warmed {len(recipes.prewarm())} recipes")
+    # raw frames of every measurement (see capture_store.py)
+    captures = CaptureStore('captures')
+    # per-frame results and parameters of every measurement (see result_store.py)
+    results = ResultStore('results')
+    # rejects outlier frames before averaging (see proteus_acquisition.FrameFilter)
+    frame_filter = FrameFilter(zmax = 6)
 
     # Flag to control the connection status
     connect = True  # Equivalent to 'on'
@@ -59,49 +162,13 @@ def main():
                     print("Done initializing.")
                     
                 elif cmd_byte == 2:  # Pulse sequence on CPU Trigger
-                    p1_len = cmd_bytes[1]*1e-6
-                    p2_len = cmd_bytes[2]*1e-6
-                    p2_spacing = cmd_bytes[3]*1e-6
-                    #expt_time not used...!
-                    expt_time = cmd_bytes[4]
-                    tacq = cmd_bytes[5]*1e-6
-                    tref = cmd_bytes[6]
-                    tof = cmd_bytes[7]
-                    sampleRateDAC = 1.125e9
-                    sampleRateADC = 2.25e9
-                    ADC_ch = 2
-                    
-                    # Set sample rate for ADC and DAC
-                    inst.sampleRateDAC, inst.sampleRateADC = sampleRateDAC, sampleRateADC
-                    
-                    print("Generating pulse sequence...")
-                    p1 = defPulse(amp = 1, mod = 0, length = p1_len, phase = 0, spacing = 5e-6)
-                    p2 = defPulse(amp = 1, mod = 0, length = p2_len, phase = 90, spacing = p2_spacing)
-                    pulse_l = [p1, p2]
-                    # round it up to 64 (Need to check if it rounds up correctly)
-
-                    b1 = defBlock([p1, p2], reps = [1, 100000], markers = [1, 1], trigs = [0, 1])
-                    # b2 = defBlock([p1, p2], reps = [num_Pulses, num_Pulses], markers = [1, 1], trigs = [1, 1])
-                    inst.makeBlocks(block_l = [b1], ch = 1, repeatSeq = [1])
-                    print("Pulse sequence generation done.")
-                    
-                    cfr = 100.524e6 + tref + tof  # carrier frequency + reference frequency + offset frequency
-
-                    inst.set_interpolation(ch = 1, interp_factor = 8)
-                    inst.set_NCO(cfr = cfr, phase = 90)
-
-                    # This is hard-coded for now.
-                    numframes = b1['reps'][1]
-                    
-                    # Handle trigger-based data acquisition
-                    # SET DIGITIZER
-                    assert inst.sampleRateDAC / 4 == inst.sampleRateADC, "sampleRateDAC must be set multiple of 4"
-                    
-                    print("Setting Digitizer...")
-                    acq_delay = 12e-6
-                    readLen, numframes= inst.set_digitizer(inst.sampleRateADC, numframes, cfr, tacq, acq_delay, ADC_ch)
-                    inst.send_scpi_query(':DIG:ACQuire:FRAM:STATus?')
-                    print("Done setting digitizer.")
+                    #expt_time (cmd_bytes[4]) not used...!
+                    params = {'p1_len': cmd_bytes[1]*1e-6, 'p2_len': cmd_bytes[2]*1e-6,
+                              'p2_spacing': cmd_bytes[3]*1e-6, 'tacq': cmd_bytes[5]*1e-6,
+                              'tref': cmd_bytes[6], 'tof': cmd_bytes[7]}
+                    # replays the recorded commands/waveforms if this configuration was seen before
+                    setup = recipes.run('pulse_sequence', params, lambda: setup_pulse_sequence(inst, **params))
+                    numframes, readLen, p2 = setup['numframes'], setup['readLen'], setup['p2']
 
                 elif cmd_byte == 3:  # Measure
                     print("Measuring...")
@@ -121,46 +188,36 @@ def main():
                         if times > max_iter:
                             break
                     print(resp)
-                    inst.send_scpi_cmd(':DIG:INIT OFF')
-                    
-                    # Choose which frames to read (all in this example)
-                    inst.send_scpi_cmd(':DIG:DATA:SEL ALL')
-
-                    # Choose what to read 
-                    inst.send_scpi_cmd(':DIG:DATA:TYPE FRAM')
-
-                    # Get the total data size (in bytes)
-                    resp = inst.send_scpi_query(':DIG:DATA:SIZE?')
-                    num_bytes = np.uint64(resp)
-                    print('Total size in bytes: ' + resp)
 
-
-                    # because read format is UINT16 we divide byte number by 2
-                    wavlen = num_bytes // 2
-                    wav1 = np.zeros(wavlen, dtype=np.uint16)
-                    rc = inst.read_binary_data(':DIG:DATA:READ?', wav1, num_bytes)
+                    # frames and headers go straight to a file-backed run directory
+                    run = captures.new_run({'params': params, 'numframes': numframes, 'readLen': readLen})
+                    wav1 = inst.read_frames(numframes, run = run)
                     resp = inst.send_scpi_query(':SYST:ERR?')
-                    print("read data from DDR1")
-                    wav1 = np.int32(wav1)
-                    wave = wav1[0::2] - 16384
-                    samplesI = wave[0::2]
-                    samplesQ = wave[1::2]
-                    samples = samplesI + 1j *samplesQ
-                    num_frames = len(samples) // readLen
-                    samples = samples[:num_frames * readLen]  # Trim to full frames only
-                    frames = samples.reshape((num_frames, readLen))
+                    print(f"read data from DDR1 into {run.path}")
+                    # decode and filter chunk by chunk; rejected frames never reach the averages
+                    filt = frame_filter.run(wav1, readLen, run.headers())
+                    frame_means = filt['means']  # This will be complex: mean I + 1j*mean Q
+                    keep = filt['keep']
+                    num_frames = len(frame_means)
+                    print(f"Kept {filt['kept']} frames, rejected {filt['rejected']}")
 
-                    #TODO NEED TO generate time-axis 
-                    time_axis = (np.arange(numframes) + 1) * (p2['length'] + p2['spacing'])
+                    # trigger times from the header TimeStamps (first frame at one period, as before)
+                    period = p2['length'] + p2['spacing']
+                    timing = inst.time_axis(run.headers()[:num_frames], period = period)
+                    time_axis = timing['time'] + period
+                    run.update(n_missed = timing['n_missed'], missed = timing['missed'])
 
-                    # Compute averages for each frame
-                    frame_means = frames.mean(axis=1)  # This will be complex: mean I + 1j*mean Q
-                    frame_means_I = frames.real.mean(axis=1)
-                    frame_means_Q = frames.imag.mean(axis=1)
+                    frame_means_I = frame_means.real
+                    frame_means_Q = frame_means.imag
                     amps = np.sqrt(frame_means_I**2 + frame_means_Q**2)
-                    # After the code that creates 'frames'
-                    first_frame = frames[0]
+                    run_id = results.append({'params': params, 'p2': p2, 'cfr': setup['cfr'], 'numframes': numframes,
+                                             'readLen': readLen, 'capture': run.path, 'n_missed': timing['n_missed']},
+                                            time_axis = time_axis, frame_means_I = frame_means_I, frame_means_Q = frame_means_Q,
+                                            keep = keep, reject_reasons = filt['reasons'])
+                    print(f"Stored result run {run_id}")
+                    first_frame = demux_frames(wav1[:4*readLen], readLen)[0]
 
+                    import matplotlib.pyplot as plt  # imported on first plot, not at server start
                     plt.figure(num = 1, figsize=(6, 6))
                     plt.scatter(first_frame.real, first_frame.imag, s= 1, alpha= 1, rasterized = True)
                     plt.xlabel('I (Real)')
@@ -170,10 +227,10 @@ def main():
                     plt.axis('equal')  # Ensures aspect ratio is 1:1
 
                     plt.figure(num = 2, figsize = (10,6))
-                    plt.scatter(time_axis, amps, c='r', s= 1, alpha= 1, rasterized = True)
+                    plt.scatter(time_axis[keep], amps[keep], c='r', s= 1, alpha= 1, rasterized = True)
                     plt.xlabel('Time [s]')
                     plt.ylabel('Ampltitude [a.u.]')
-                    plt.title(f'time vs Amplitude plot of {num_frames} frames')
+                    plt.title(f"time vs Amplitude plot of {filt['kept']} of {num_frames} frames")
                     plt.show()
                     breakpoint()
 
@@ -187,63 +244,10 @@ def main():
                     
                 elif cmd_byte == 6:  # Program MW Chirp Waveform
                     print("Programming MW Chirp waveform...")
-                    # Program the MW Chirp waveform
-                    sampleRateDAC = 9e9
-                    awg_center_freq = cmd_bytes[1]
-                    awg_bw_freq = cmd_bytes[2]
-                    sweep_freq = cmd_bytes[4]
-                    srs_freq = cmd_bytes[5]
-                    bits = 16
-                    pol_time = cmd_bytes[6] # seconds
-                    
-                    fCenter = awg_center_freq - srs_freq
-                    fStart, fStop = fCenter - 0.5*awg_bw_freq, fCenter + 0.5*awg_bw_freq
-                    rampTime = 1/sweep_freq
-                    dac_chan = 3
-                    trig_num = 2
-
-                    print("Initializing...")
-                    # Initialize the instrument or device
-                    inst.reset()
-                    inst.initialize_AWG(ch = dac_chan)
-                    print("Done initializing.")
-                    
-                    # generate chirp form
-                    seg_dict = {}
-                    chirp = makeChirp(sampleRateDAC, rampTime, fStart, fStop, bits)
-
-                    seg_dict[1] = chirp
-                    seg_dict[2] = np.flip(chirp)
-
-                    inst.send_scpi_cmd(f':FREQ:RAST {sampleRateDAC}')
-                    # DOWNLOAD TWO SEGMENTS
-                    for k, dacWave in seg_dict.items():
-                        segMem = k
-                        inst.download_waveform(dac_chan, segMem, dacWave)
-                    
-                    #CONTINUOUS MODE ON
-                    inst.send_scpi_cmd(":INIT:CONT OFF")
-                    inst.send_scpi_cmd(":INIT:CONT ON")
-
-                    #TURN ANY OUTPUT OFF
-                    inst.send_scpi_cmd(":OUTP OFF")
-
-                    # TURN ON OUTPUT WITH NCO FREQUENCY SET AS CARRIER FREQUENCY
-                    # maybe need to create a image frequency
-                    inst.send_scpi_cmd(f":SOUR:NCO:CFR1 {srs_freq}")
-                    inst.send_scpi_cmd(':NCO:SIXD1 ON')
-                    inst.send_scpi_cmd(':SOUR:MODE DUC')
-
-                    #set trigger as source
-                    voltage_level = 1
-                    inst.send_scpi_cmd(f':TRIG:ACTIVE:SEL TRG{trig_num}')
-                    inst.send_scpi_cmd(f':TRIG:LEV {voltage_level}')
-                    inst.send_scpi_cmd(':TRIG:ACTIVE:STAT ON')
-                    num_cycles = int(np.floor(pol_time * sweep_freq))
-                    
-                    inst.set_chirp_tasktable_trig(ch = dac_chan, segMem = 1, num_reps = num_cycles, trig_num = trig_num)
-                    inst.send_scpi_cmd(':SOUR:VOLT MAX')
-                    inst.send_scpi_cmd(':SOUR:FUNC:MODE TASK')
+                    params = {'awg_center_freq': cmd_bytes[1], 'awg_bw_freq': cmd_bytes[2],
+                              'sweep_freq': cmd_bytes[4], 'srs_freq': cmd_bytes[5],
+                              'pol_time': cmd_bytes[6]}
+                    recipes.run('mw_chirp', params, lambda: program_chirp(inst, **params))
 
                 elif cmd_byte == 7:  # Play MW Chirp Waveform
                     print("Playing MW Chirp waveform...")
@@ -0,0 +1,69 @@
+import os
+import sys
+import pytest
+
+# the modules live at the repository root and in 'Tabor Library'
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'Tabor Library'))
+sys.path.insert(0, ROOT)
+
+
+class FakeInst:
+    """
+    Mock instrument: logs every command, query and binary block, and
+    answers queries from `replies` (substring -> response).
+    """
+    def __init__(self, replies=None):
+        self.log = []
+        self.replies = {'SYST:ERR': '0, no error'}
+        self.replies.update(replies or {})
+        self.default_paranoia_level = 1
+
+    def send_scpi_cmd(self, cmd, paranoia_level=None):
+        self.log.append(('cmd', cmd, paranoia_level))
+        return 0
+
+    def send_scpi_query(self, cmd, max_resp_len=256):
+        self.log.append(('query', cmd))
+        for key, reply in self.replies.items():
+            if key in cmd:
+                return reply
+        return '0'
+
+    def write_binary_data(self, prefix, data):
+        self.log.append(('bin', prefix, bytes(memoryview(data).cast('B'))))
+        return 0
+
+    def read_binary_data(self, prefix, out_array, num_bytes):
+        self.log.append(('read', prefix, num_bytes))
+        return 0
+
+    def close_instrument(self):
+        self.log.append(('close',))
+
+    def commands(self):
+        return [entry[1] for entry in self.log if entry[0] == 'cmd']
+
+
+@pytest.fixture
+def fake_inst():
+    return FakeInst()
+
+
+@pytest.fixture
+def make_proteus(monkeypatch):
+    """
+    Returns make(inst, **kwargs), which builds a TaborProteus on the mock
+    instrument `inst` (proteus_instance is patched, so nothing is opened).
+    """
+    from TaborProteus import TaborProteus
+
+    def make(inst, **kwargs):
+        monkeypatch.setattr(TaborProteus, 'proteus_instance', staticmethod(lambda *args, **kw: inst))
+        return TaborProteus(**kwargs)
+    return make
+
+
+@pytest.fixture
+def proteus(fake_inst, make_proteus):
+    return make_proteus(fake_inst)
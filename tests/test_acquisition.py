@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+from proteus_acquisition import FrameFilter, HEADER_DTYPE, REJECT_CLIPPED, REJECT_OUTLIER, frame_times, plan_acquisition, FRAME_GRANULARITY, DSP_MAX_READLEN, DDC_DECIMATION, BYTES_PER_SAMPLE
+
+
+def test_frame_covers_window():
+    plan = plan_acquisition(2e-6, 10, 2.25e9, 9e9)
+    fs = 2.25e9 / DDC_DECIMATION
+    assert plan['readLen'] % FRAME_GRANULARITY == 0
+    assert plan['window'] >= 2e-6
+    # the shortest such frame
+    assert (plan['readLen'] - FRAME_GRANULARITY) / fs < 2e-6
+    assert plan['frameLen'] == 2 * plan['readLen']
+    assert plan['bytes'] == 10 * plan['readLen'] * BYTES_PER_SAMPLE
+
+
+def test_exact_window_is_not_rounded_up():
+    fs = 2.25e9 / DDC_DECIMATION
+    plan = plan_acquisition(2 * FRAME_GRANULARITY / fs, 1, 2.25e9)
+    assert plan['readLen'] == 2 * FRAME_GRANULARITY
+
+
+@pytest.mark.parametrize('kw', [
+    dict(tacq=0, numframes=1, sampleRateADC=2.25e9),
+    dict(tacq=1e-6, numframes=0, sampleRateADC=2.25e9),
+    dict(tacq=1e-6, numframes=1, sampleRateADC=2.7e9, sampleRateDAC=9e9),
+    dict(tacq=1e-6, numframes=1, sampleRateADC=2.25e9, bandwidth=1e9),
+    dict(tacq=1e-4, numframes=1, sampleRateADC=2.25e9, dsp=True),
+    dict(tacq=1e-6, numframes=1000, sampleRateADC=2.25e9, max_bytes=1000),
+])
+def test_infeasible_requests_raise(kw):
+    with pytest.raises(ValueError):
+        plan_acquisition(**kw)
+
+
+def test_dsp_limit_is_inclusive():
+    fs = 2.25e9 / DDC_DECIMATION
+    plan = plan_acquisition(DSP_MAX_READLEN / fs, 1, 2.25e9, dsp=True)
+    assert plan['readLen'] == DSP_MAX_READLEN
+
+
+def test_set_digitizer_checks_before_sending(fake_inst, make_proteus):
+    proteus = make_proteus(fake_inst, sampleRateDAC = 9e9, sampleRateADC = 2.7e9)
+    with pytest.raises(ValueError):
+        proteus.set_digitizer(proteus.sampleRateADC, 10, 50e6, 2e-6, 0, 1)
+    assert fake_inst.log == []
+
+
+def test_set_digitizer_uses_plan(fake_inst, make_proteus):
+    proteus = make_proteus(fake_inst, sampleRateDAC = 9e9, sampleRateADC = 2.25e9)
+    readLen, numframes = proteus.set_digitizer(proteus.sampleRateADC, 10, 50e6, 2e-6, 0, 1)
+    assert readLen == plan_acquisition(2e-6, 10, 2.25e9)['readLen']
+    sent = ';'.join(fake_inst.commands())
+    assert f':DIG:ACQ:DEF 10,{2 * readLen}' in sent
+    assert f':DIG:DDC:DEC X{DDC_DECIMATION}' in sent
+
+
+def _stamps(ticks):
+    headers = np.zeros(len(ticks), dtype=HEADER_DTYPE)
+    headers['TimeStamp'] = ticks
+    return headers
+
+
+def test_frame_times_calibrates_tick_and_finds_missed_triggers():
+    # frame 3 comes two periods after frame 2: one trigger was missed
+    timing = frame_times(_stamps([1000, 1100, 1200, 1400, 1500]), period = 1e-6)
+    assert timing['tick'] == pytest.approx(1e-8)
+    assert timing['period'] == pytest.approx(1e-6)
+    assert np.allclose(timing['time'], [0, 1e-6, 2e-6, 4e-6, 5e-6])
+    assert list(timing['missed']) == [3] and timing['n_missed'] == 1
+    assert len(timing['irregular']) == 0
+
+
+def test_frame_times_unwraps_counter_and_flags_irregular_spacing():
+    top = 2**32
+    timing = frame_times(_stamps([top - 150, top - 50, 50, 190, 290]), tick = 1e-8, bits = 32)
+    assert np.allclose(timing['time'], [0, 1e-6, 2e-6, 3.4e-6, 4.4e-6])
+    assert list(timing['irregular']) == [3]
+    assert timing['n_missed'] == 0
+
+
+def _frames(amps, readLen=16):
+    rng = np.random.default_rng(0)
+    amps = np.asarray(amps, dtype=float)[:, None]
+    return amps + 0.01 * rng.standard_normal((len(amps), readLen)) + 0j
+
+
+def test_frame_filter_scores_chunk_against_earlier_frames():
+    ff = FrameFilter(zmax=6)
+    base = 1 + 0.01 * np.random.default_rng(1).standard_normal(100)
+    _, reasons = ff.apply(_frames(base))
+    assert not reasons.any()
+    # a whole chunk of outliers must not widen its own threshold
+    _, reasons = ff.apply(_frames(np.full(100, 10.0)))
+    assert (reasons == REJECT_OUTLIER).all()
+    assert ff._n == 100
+
+
+def test_frame_filter_rejected_frames_do_not_update_stats():
+    ff = FrameFilter(clip_level=5, zmax=6)
+    means, reasons = ff.apply(_frames([1.0, 1.01, 0.99, 9.0]))
+    assert list(reasons) == [0, 0, 0, REJECT_CLIPPED]
+    assert ff._n == 3
+    assert ff._sum == pytest.approx(means[:3].sum())
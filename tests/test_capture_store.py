@@ -0,0 +1,54 @@
+import numpy as np
+from conftest import FakeInst
+from capture_store import CaptureStore
+from proteus_acquisition import HEADER_DTYPE, HEADER_SIZE
+
+
+class ReadInst(FakeInst):
+    """FakeInst whose reads fill the buffer from a queue of byte blocks."""
+    def __init__(self, blocks, replies=None):
+        super().__init__(replies)
+        self.blocks = list(blocks)
+
+    def read_binary_data(self, prefix, out_array, num_bytes):
+        super().read_binary_data(prefix, out_array, num_bytes)
+        block = self.blocks.pop(0)
+        assert len(block) == num_bytes
+        memoryview(out_array).cast('B')[:num_bytes] = block
+        return 0
+
+
+def test_read_frames_into_run_and_reopen(tmp_path, make_proteus):
+    numframes = 3
+    frames = np.arange(numframes * 96 * 4, dtype=np.uint16)
+    headers = np.zeros(numframes, dtype=HEADER_DTYPE)
+    headers['TimeStamp'] = [100, 200, 300]
+    headers['TriggerPos'] = [5, 6, 7]
+    inst = ReadInst([frames.tobytes(), headers.tobytes()], {'DATA:SIZE': str(frames.nbytes)})
+    proteus = make_proteus(inst)
+
+    store = CaptureStore(str(tmp_path))
+    run = store.new_run({'readLen': 96})
+    out = proteus.read_frames(numframes, run = run, ddr = 2)
+    assert isinstance(out, np.memmap)
+    run.close()
+
+    assert store.runs() == [run.meta['name']]
+    reopened = store.open(store.runs()[0])
+    assert reopened.settings == {'readLen': 96}
+    assert reopened.meta['numframes'] == numframes and reopened.meta['ddr'] == 2
+    assert np.array_equal(reopened['frames'], frames)
+    assert reopened['headers'].nbytes == numframes * HEADER_SIZE
+    hdr = reopened.headers()
+    assert list(hdr['TimeStamp']) == [100, 200, 300]
+    assert list(hdr['TriggerPos']) == [5, 6, 7]
+
+
+def test_reopened_run_is_read_only(tmp_path):
+    store = CaptureStore(str(tmp_path))
+    run = store.new_run({}, name = 'r1')
+    run.allocate('frames', 8, np.uint16)[:] = 7
+    run.close()
+    reopened = store.open('r1')
+    assert reopened['frames'].mode == 'r'
+    assert (reopened['frames'] == 7).all()
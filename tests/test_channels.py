@@ -0,0 +1,60 @@
+from TaborProteus import TaborProteus
+
+
+def _pulse(length=1.2345e-6):
+    return {'length': length, 'spacing': 1e-7, 'phase': 0, 'amp': 0.5, 'mod': 0}
+
+
+def _program(*pulses):
+    block = {'pulse_l': list(pulses), 'reps': [1] * len(pulses), 'trigs': [0] * len(pulses),
+             'markers': [1] * len(pulses)}
+    return ([block], [1])
+
+
+def _binary(fake_inst):
+    return [entry for entry in fake_inst.log if entry[0] == 'bin']
+
+
+def test_identical_segments_share_a_number(fake_inst):
+    proteus = TaborProteus(sampleRateDAC = 9e9, inst = fake_inst)
+    compiled = proteus.compile_channels({1: _program(_pulse(), _pulse(), _pulse(2e-6))})
+    # hold, pulse, same pulse, other pulse, hold
+    assert compiled[1]['segs'] == [1, 2, 2, 3, 1]
+    assert [load[0] for load in compiled[1]['loads']] == [1, 2, 3]
+    compiled = proteus.compile_channels({1: _program(_pulse(), _pulse())}, dedupe = False)
+    assert compiled[1]['segs'] == [1, 2, 3, 4]
+
+
+def test_bank_downloads_shared_segments_once(fake_inst):
+    proteus = TaborProteus(sampleRateDAC = 9e9, inst = fake_inst)
+    programs = {1: _program(_pulse()), 2: _program(_pulse()), 3: _program(_pulse())}
+    compiled = proteus.compile_channels(programs, segment_banks = ((1, 2), (3, 4)))
+    assert compiled[2]['segs'] == compiled[1]['segs']
+    assert compiled[2]['loads'] == []
+    # another bank has its own memory
+    assert len(compiled[3]['loads']) == len(compiled[1]['loads'])
+
+
+def test_compile_leaves_pulses_alone_until_programmed(fake_inst):
+    proteus = TaborProteus(sampleRateDAC = 9e9, inst = fake_inst)
+    pulse = _pulse()
+    proteus.compile_channels({1: _program(pulse)})
+    assert pulse['length'] == 1.2345e-6
+    proteus.program_channels({1: _program(pulse)}, update_pulses = False)
+    assert pulse['length'] == 1.2345e-6
+    proteus.program_channels({1: _program(pulse)})
+    assert pulse['length'] == int(9e9 * 1.2345e-6) // 64 * 64 / 9e9
+
+
+def test_program_channels_renders_shared_iq_once(fake_inst):
+    proteus = TaborProteus(sampleRateDAC = 9e9, inst = fake_inst)
+    programs = {1: _program(_pulse()), 3: _program(_pulse())}
+    proteus.program_channels(programs)
+    commands = ';'.join(fake_inst.commands())
+    assert commands.count(':TASK:COMP:WRITE') == 2
+    first = _binary(fake_inst)
+    # hold and pulse IQ plus their markers on each channel
+    assert len(first) == 8
+    # resident segments are not downloaded again
+    proteus.program_channels(programs)
+    assert _binary(fake_inst) == first
@@ -0,0 +1,70 @@
+import threading
+import pytest
+from conftest import FakeInst
+from TaborProteus import TaborProteus
+from proteus_cluster import TaborProteusCluster
+from proteus_inventory import capabilities
+
+
+def _member(model='P9484M'):
+    inst = FakeInst()
+    inst.slot_info = capabilities({'slot_id': 1, 'idn': f'Tabor Electronics,{model},0001,1.0', 'installed_memory': 16})
+    return TaborProteus(sampleRateDAC = 9e9, inst = inst)
+
+
+def _block(length):
+    pulse = {'length': length, 'spacing': 1e-7, 'phase': 0, 'amp': 0.5, 'mod': 0}
+    return {'pulse_l': [pulse], 'reps': [1], 'trigs': [0], 'markers': [1]}
+
+
+@pytest.fixture
+def cluster():
+    cluster = TaborProteusCluster([_member('P9484M'), _member('P9482M'), _member()])
+    yield cluster
+    cluster.close()
+
+
+def test_channels_from_inventory(cluster):
+    assert cluster.channels == [4, 2, 4]
+    assert cluster.num_channels == 10
+    assert cluster.locate(4) == (0, 4)
+    assert cluster.locate(5) == (1, 1)
+    assert cluster.locate(7) == (2, 1)
+    with pytest.raises(AssertionError):
+        cluster.locate(11)
+
+
+def test_partition(cluster):
+    parts = cluster.partition([(1, 'a'), (6, 'b'), (10, 'c'), (2, 'd')])
+    assert parts == {0: [(1, 'a'), (2, 'd')], 1: [(2, 'b')], 2: [(4, 'c')]}
+
+
+def test_unknown_model_uses_default():
+    member = _member()
+    member.slot_info = None
+    cluster = TaborProteusCluster([member], channels_per_slot = 2)
+    try:
+        assert cluster.num_channels == 2
+    finally:
+        cluster.close()
+
+
+def test_shared_pulses_are_rounded_once(cluster):
+    block = _block(1.2345e-6)
+    cluster.make_blocks({1: ([block], [1]), 5: ([block], [1]), 7: ([block], [1])})
+    pulse = block['pulse_l'][0]
+    lengthPt = int(9e9 * 1.2345e-6) // 64 * 64
+    assert pulse['length'] == lengthPt / 9e9
+    # every module played the same segment length
+    sizes = {entry[1] for member in cluster.members for entry in member.inst.inst.log
+             if entry[0] == 'cmd' and ':TRAC:DEF 2,' in entry[1]}
+    assert len({cmd.split(':TRAC:DEF 2,')[1].split(';')[0].strip() for cmd in sizes}) == 1
+
+
+def test_rounding_is_idempotent():
+    member = _member()
+    for k in range(1, 2000):
+        pulse = {'length': k * 64 / 9e9 + 1e-12, 'spacing': 0}
+        lengthPt, _ = member._round_pulse(pulse)
+        pulse['length'] = lengthPt / 9e9
+        assert member._round_pulse(pulse)[0] == lengthPt == k * 64
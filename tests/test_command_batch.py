@@ -0,0 +1,55 @@
+from TaborProteus import CommandBatch
+
+
+def test_short_batch_is_one_message(proteus, fake_inst):
+    with proteus.batch() as batch:
+        batch.add(':INST:CHAN 1')
+        batch.add('VOLT 0.5')
+    assert fake_inst.log == [('cmd', ':INST:CHAN 1; :VOLT 0.5', None)]
+
+
+def test_messages_split_at_max_len(proteus):
+    batch = proteus.batch()
+    for seg in range(1, 41):
+        batch.add(f':TRAC:DEF {seg},1024')
+    messages = batch.messages()
+    assert len(messages) > 1
+    limit = CommandBatch.MAX_MSG_LEN - len('; *OPC?')
+    assert all(len(msg) <= limit for msg in messages)
+    # no command is lost, split or reordered
+    cmds = [cmd for msg in messages for cmd in msg.split('; ')]
+    assert cmds == [f':TRAC:DEF {seg},1024' for seg in range(1, 41)]
+
+
+def test_only_last_message_waits(proteus, fake_inst):
+    batch = proteus.batch(max_len=64)
+    for seg in range(1, 11):
+        batch.add(f':TRAC:DEF {seg},1024')
+    assert batch.flush() == 0
+    levels = [entry[2] for entry in fake_inst.log]
+    assert len(levels) > 1
+    assert levels[:-1] == [0] * (len(levels) - 1) and levels[-1] is None
+    assert all(len(entry[1]) <= 64 - len('; *OPC?') for entry in fake_inst.log)
+    assert len(batch) == 0
+
+
+def test_redundant_settings_are_dropped(proteus, fake_inst):
+    proteus.send_scpi_cmd(':INST:CHAN 1')
+    with proteus.batch() as batch:
+        batch.add(':INST:CHAN 1')
+        batch.add(':VOLT 0.5')
+        batch.add(':VOLT 0.5')
+    assert fake_inst.commands() == [':INST:CHAN 1', ':VOLT 0.5']
+
+
+def test_failed_block_discards_pending(proteus, fake_inst):
+    try:
+        with proteus.batch() as batch:
+            batch.add(':VOLT 0.5')
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert fake_inst.log == []
+    # the discarded setting must not be taken as sent
+    proteus.send_scpi_cmd(':VOLT 0.5')
+    assert fake_inst.commands() == [':VOLT 0.5']
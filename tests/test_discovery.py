@@ -0,0 +1,91 @@
+import time
+import pytest
+from proteus_discovery import LocalResponder, decode_frames, discover, FRMHEADERLEN, FLASHLINELEN, FIELDS
+
+UNITS = [{'serial': '1001', 'address': '127.0.0.1'},
+         {'serial': '1002', 'address': '10.0.0.2', 'model': 'P2584M', 'port': '5026'}]
+
+
+@pytest.fixture
+def responder():
+    responder = LocalResponder(UNITS, port=0)
+    yield responder
+    responder.close()
+
+
+def _discover(responder, **kw):
+    return discover(broadcast='127.0.0.1', port=responder.port, bind_port=0, cache=False, **kw)
+
+
+def test_decode_frames():
+    units = decode_frames([LocalResponder.frame(unit) for unit in UNITS])
+    assert [unit['serial'] for unit in units] == ['1001', '1002']
+    assert units[0]['model'] == 'P9484M'
+    assert units[1]['resource'] == 'TCPIP::10.0.0.2::5026::SOCKET'
+    assert units[1]['idn'] == 'Tabor Electronics,P2584M,1002,10.0.0.2,5026'
+
+
+def test_decode_frames_missing_and_repeated_lines():
+    frame = bytearray(LocalResponder.frame({'serial': '1', 'address': '1.2.3.4'}))
+    # a later line with the same opcode wins
+    line = bytearray(FLASHLINELEN)
+    line[0] = FIELDS['serial']
+    line[1:3] = b'42'
+    frame += line
+    short = LocalResponder.frame({})[:FRMHEADERLEN + FLASHLINELEN]
+    units = decode_frames([bytes(frame), short])
+    assert units[0]['serial'] == '42'
+    assert units[1]['manufacturer'] == 'Tabor Electronics' and units[1]['serial'] == ''
+    assert decode_frames([]) == []
+
+
+def test_decode_frames_drops_truncated_line():
+    full = LocalResponder.frame({'serial': '1001', 'address': '10.0.0.1'})
+    # cut inside the last line ('port'), and a frame that ends mid-header
+    truncated = full[:len(full) - FLASHLINELEN + 5]
+    units = decode_frames([full, truncated, full[:10]])
+    assert units[0]['port'] == '5025'
+    assert units[1]['port'] == '' and units[1]['address'] == '10.0.0.1'
+    assert units[2]['serial'] == ''
+
+
+def test_expected_returns_early(responder):
+    t0 = time.perf_counter()
+    units = _discover(responder, expected=2, timeout=5.0)
+    assert time.perf_counter() - t0 < 1.0
+    assert sorted(unit['serial'] for unit in units) == ['1001', '1002']
+
+
+def test_serial_returns_early(responder):
+    units = _discover(responder, serial='1001', timeout=5.0)
+    assert '1001' in [unit['serial'] for unit in units]
+
+
+def test_retries_after_dropped_queries():
+    responder = LocalResponder(UNITS[:1], port=0, drop=2)
+    try:
+        units = _discover(responder, expected=1, timeout=3.0, backoff=0.05)
+    finally:
+        responder.close()
+    assert [unit['serial'] for unit in units] == ['1001']
+    assert responder.queries == 3
+
+
+def test_open_ended_waits_for_late_answers():
+    responder = LocalResponder(UNITS[:1], port=0, delay=0.3)
+    try:
+        t0 = time.perf_counter()
+        units = _discover(responder, timeout=0.8, backoff=0.05, retries=1)
+    finally:
+        responder.close()
+    assert time.perf_counter() - t0 >= 0.8
+    assert [unit['serial'] for unit in units] == ['1001']
+
+
+def test_cache(responder, tmp_path):
+    path = str(tmp_path / 'units.json')
+    units = discover(expected=2, broadcast='127.0.0.1', port=responder.port, bind_port=0, path=path)
+    queries = responder.queries
+    cached = discover(expected=2, broadcast='127.0.0.1', port=responder.port, bind_port=0, path=path)
+    assert responder.queries == queries
+    assert cached == units
@@ -0,0 +1,178 @@
+import threading
+from concurrent.futures import CancelledError
+import numpy as np
+import pytest
+from conftest import FakeInst
+from proteus_executor import InstrumentExecutor
+
+
+class BlockingInst(FakeInst):
+    """
+    FakeInst whose first binary write (or the command 'HOLD') blocks the I/O
+    thread until released, so the test can queue work behind it.
+    """
+    def __init__(self):
+        super().__init__({'FRAM:STAT': '1,1,0,100'})
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def _hold(self):
+        if not self.started.is_set():
+            self.started.set()
+            assert self.release.wait(5)
+
+    def send_scpi_cmd(self, cmd, paranoia_level=None):
+        if cmd == 'HOLD':
+            self._hold()
+        return super().send_scpi_cmd(cmd, paranoia_level)
+
+    def write_binary_data(self, prefix, data):
+        self._hold()
+        return super().write_binary_data(prefix, data)
+
+
+@pytest.fixture
+def blocking_inst():
+    return BlockingInst()
+
+
+def _in_thread(fn, *args):
+    result = {}
+
+    def run():
+        try:
+            result['value'] = fn(*args)
+        except BaseException as ex:  # pylint: disable=broad-except
+            result['error'] = ex
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, result
+
+
+def test_aborts_before_polls_before_commands(blocking_inst):
+    executor = InstrumentExecutor(blocking_inst)
+    try:
+        busy = executor.submit(lambda transport: transport.send_scpi_cmd('HOLD'))
+        assert blocking_inst.started.wait(5)
+        normal = executor.submit(lambda transport: transport.send_scpi_cmd(':OUTP ON'))
+        poll = executor.poll(':DIG:ACQ:FRAM:STAT?')
+        abort = executor.abort(':DIG:INIT OFF')
+        blocking_inst.release.set()
+        assert poll.result(5) == '1,1,0,100'
+        assert abort.result(5) == 0 and normal.result(5) == 0 and busy.result(5) == 0
+    finally:
+        executor.close_instrument()
+    order = [entry[1] for entry in blocking_inst.log if entry[0] in ('cmd', 'query')]
+    assert order == ['HOLD', ':DIG:INIT OFF', ':DIG:ACQ:FRAM:STAT?', ':OUTP ON']
+
+
+def test_whole_block_without_bulk_chunk(fake_inst):
+    executor = InstrumentExecutor(fake_inst)
+    data = np.arange(4096, dtype=np.uint16)
+    try:
+        assert executor.write_binary_data(':TRAC:DATA', data) == 0
+    finally:
+        executor.close_instrument()
+    assert [entry[:2] for entry in fake_inst.log[:-1]] == [('bin', ':TRAC:DATA')]
+    assert fake_inst.log[-1] == ('close',)
+
+
+def test_polls_run_between_pieces(blocking_inst):
+    executor = InstrumentExecutor(blocking_inst, bulk_chunk=1024)
+    data = np.arange(2048, dtype=np.uint16)
+    try:
+        thread, result = _in_thread(executor.write_binary_data, ':TRAC:DATA', data)
+        assert blocking_inst.started.wait(5)
+        poll = executor.poll(':DIG:ACQ:FRAM:STAT?')
+        blocking_inst.release.set()
+        thread.join(5)
+        assert poll.result(5) == '1,1,0,100'
+    finally:
+        executor.close_instrument()
+    assert result == {'value': 0}
+    log = blocking_inst.log[:-1]
+    assert [entry[:2] for entry in log] == [
+        ('bin', ':TRAC:DATA 0,'), ('query', ':DIG:ACQ:FRAM:STAT?'), ('bin', ':TRAC:DATA 512,'),
+        ('bin', ':TRAC:DATA 1024,'), ('bin', ':TRAC:DATA 1536,')]
+    assert b''.join(entry[2] for entry in log if entry[0] == 'bin') == data.tobytes()
+
+
+def test_abort_stops_bulk_transfer(blocking_inst):
+    executor = InstrumentExecutor(blocking_inst, bulk_chunk=1024)
+    data = np.arange(2048, dtype=np.uint16)
+    try:
+        thread, result = _in_thread(executor.write_binary_data, ':TRAC:DATA', data)
+        assert blocking_inst.started.wait(5)
+        abort = executor.abort(':DIG:INIT OFF')
+        blocking_inst.release.set()
+        thread.join(5)
+        assert abort.result(5) == 0
+        # the executor goes on with the next operation
+        assert executor.send_scpi_cmd(':OUTP OFF') == 0
+    finally:
+        executor.close_instrument()
+    assert isinstance(result['error'], CancelledError)
+    assert [entry[:2] for entry in blocking_inst.log[:-1]] == [
+        ('bin', ':TRAC:DATA 0,'), ('cmd', ':DIG:INIT OFF'), ('cmd', ':OUTP OFF')]
+
+
+def test_exclusive_keeps_other_threads_out(fake_inst):
+    executor = InstrumentExecutor(fake_inst)
+    try:
+        with executor.exclusive():
+            executor.send_scpi_cmd(':TRAC:SEL 1')
+            thread, _ = _in_thread(executor.send_scpi_cmd, ':TRAC:SEL 2')
+            thread.join(0.2)
+            assert thread.is_alive()
+            executor.send_scpi_cmd(':TRAC:DATA')
+        thread.join(5)
+    finally:
+        executor.close_instrument()
+    assert fake_inst.commands() == [':TRAC:SEL 1', ':TRAC:DATA', ':TRAC:SEL 2']
+
+
+def test_proteus_status_query_overtakes_download(blocking_inst):
+    from TaborProteus import TaborProteus
+    executor = InstrumentExecutor(blocking_inst, bulk_chunk=1024)
+    proteus = TaborProteus(inst = executor)
+    data = np.arange(2048, dtype=np.uint16)
+    try:
+        thread, result = _in_thread(proteus.download_waveform, 1, 2, data)
+        assert blocking_inst.started.wait(5)
+        # the downloading thread holds the instrument (exclusive())
+        monitor, frames = _in_thread(proteus.wait_for_frames, 100)
+        threading.Event().wait(0.1)
+        blocking_inst.release.set()
+        monitor.join(5)
+        thread.join(5)
+    finally:
+        executor.close_instrument()
+    assert frames == {'value': 100} and 'error' not in result
+    kinds = [entry[1] if entry[0] == 'query' else entry[0] for entry in blocking_inst.log
+             if entry[0] in ('bin', 'query')]
+    assert kinds[:2] == ['bin', ':DIG:ACQuire:FRAM:STATus?']
+
+
+def test_proteus_interrupt_stops_download(blocking_inst):
+    from TaborProteus import TaborProteus
+    executor = InstrumentExecutor(blocking_inst, bulk_chunk=1024)
+    proteus = TaborProteus(inst = executor)
+    try:
+        thread, result = _in_thread(proteus.download_waveform, 1, 2, np.arange(2048, dtype=np.uint16))
+        assert blocking_inst.started.wait(5)
+        interrupt = _in_thread(proteus.interrupt, ':DIG:INIT OFF')[0]
+        threading.Event().wait(0.1)
+        blocking_inst.release.set()
+        interrupt.join(5)
+        thread.join(5)
+    finally:
+        executor.close_instrument()
+    assert isinstance(result['error'], CancelledError)
+    assert [entry[0] for entry in blocking_inst.log if entry[0] == 'bin'] == ['bin']
+    assert ('cmd', ':DIG:INIT OFF', None) in blocking_inst.log
+
+
+def test_poll_query_without_executor(proteus, fake_inst):
+    fake_inst.replies['FRAM:STAT'] = '1,1,0,7'
+    assert proteus.wait_for_frames(7) == 7
+    assert fake_inst.log == [('query', ':DIG:ACQuire:FRAM:STATus?')]
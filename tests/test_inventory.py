@@ -0,0 +1,65 @@
+import json
+import pytest
+from proteus_inventory import Inventory, capabilities
+
+
+def _slot(slot_number, model, memory=16, in_use=False, fpga=100):
+    return {'slot_id': 100 + slot_number, 'slot_number': slot_number, 'chassis_index': 0,
+            'is_dummy': False, 'is_in_use': in_use, 'parent_instr_id': 0,
+            'fpga_version': fpga, 'fpga_svn_rev': 0, 'fpga_build_date': '',
+            'idn': f'Tabor Electronics,{model},0001,1.0', 'fw_options': 0, 'hw_options': 0,
+            'installed_memory': memory}
+
+
+class FakeAdmin:
+    def __init__(self, slots):
+        self.slots = slots
+        self.reads = 0
+
+    def get_slots_info(self):
+        self.reads += 1
+        return [dict(slot) for slot in self.slots]
+
+
+def test_capabilities_derive_model_fields():
+    slot = capabilities(_slot(3, 'P9484M', memory = 8))
+    assert slot['model'] == 'P9484M'
+    assert slot['has_digitizer'] and slot['memory_bytes'] == 8 * 2**30
+    assert not capabilities(_slot(4, 'P2582'))['has_digitizer']
+
+
+def test_snapshot_is_cached_until_ttl(tmp_path, monkeypatch):
+    path = str(tmp_path / 'inventory.json')
+    admin = FakeAdmin([_slot(2, 'P9484M')])
+    inventory = Inventory(path, ttl = 60)
+    assert inventory.slots(admin)[0]['model'] == 'P9484M'
+    inventory.slots(admin)
+    # a new process reads the file instead of the slots
+    assert Inventory(path, ttl = 60).slots(admin)[0]['slot_id'] == 102
+    assert admin.reads == 1
+
+    with open(path) as f:
+        stamp = json.load(f)['time']
+    monkeypatch.setattr('proteus_inventory.time.time', lambda: stamp + 61)
+    inventory.slots(admin)
+    assert admin.reads == 2
+
+
+def test_find_filters_and_orders_slots(tmp_path):
+    admin = FakeAdmin([_slot(5, 'P9484M', memory = 16), _slot(2, 'P9482M', memory = 8),
+                       _slot(3, 'P2584', memory = 16), _slot(4, 'P9484M', in_use = True)])
+    inventory = Inventory(str(tmp_path / 'inventory.json'))
+    assert [s['slot_number'] for s in inventory.find(admin, digitizer = True)] == [2, 5]
+    assert [s['slot_number'] for s in inventory.find(admin, digitizer = True, min_memory = 16)] == [5]
+    assert [s['slot_number'] for s in inventory.find(admin, model = 'P2584')] == [3]
+    assert [s['slot_number'] for s in inventory.find(admin, free = False, model = 'P9484')] == [4, 5]
+
+
+def test_select_rereads_stale_in_use_flags(tmp_path):
+    admin = FakeAdmin([_slot(2, 'P9484M', in_use = True)])
+    inventory = Inventory(str(tmp_path / 'inventory.json'))
+    with pytest.raises(ValueError):
+        inventory.select(admin, digitizer = True)
+    # the slot was released since the snapshot
+    admin.slots[0]['is_in_use'] = False
+    assert inventory.select(admin, digitizer = True)['slot_number'] == 2
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from proteus_utils import pack_markers, pack_marker_runs
+
+
+def _runs_to_array(segLen, runs):
+    mark = np.zeros(segLen, dtype=np.uint8)
+    for start, stop in runs:
+        mark[start:stop] = 1
+    return mark
+
+
+def test_pack_markers_nibbles():
+    # sample 0: mark1, sample 1: mark2 -> low nibble 1, high nibble 2
+    packed = pack_markers(np.array([1, 0, 1, 1]), np.array([0, 1, 1, 1]))
+    assert packed.tolist() == [0x21, 0x33]
+
+
+@pytest.mark.parametrize('runs1, runs2', [
+    ([], []),
+    ([(0, 1280)], [(0, 1280)]),
+    ([(1, 7)], [(3, 3)]),
+    ([(0, 64), (32, 100)], [(99, 128)]),
+    ([(5, 6), (6, 9), (127, 128)], [(0, 1), (1, 2)]),
+])
+def test_runs_match_arrays(runs1, runs2):
+    segLen = max([1280] + [stop for start, stop in runs1 + runs2])
+    expected = pack_markers(_runs_to_array(segLen, runs1), _runs_to_array(segLen, runs2))
+    assert np.array_equal(pack_marker_runs(segLen, runs1, runs2), expected)
+
+
+def test_random_runs_match_arrays():
+    rng = np.random.default_rng(0)
+    segLen = 640
+    for _ in range(200):
+        runs = [np.sort(rng.integers(0, segLen + 1, size=(rng.integers(0, 5), 2)), axis=1).tolist() for _ in range(2)]
+        expected = pack_markers(_runs_to_array(segLen, runs[0]), _runs_to_array(segLen, runs[1]))
+        assert np.array_equal(pack_marker_runs(segLen, *runs), expected)
+
+
+def test_runs_into_out():
+    out = np.full(32, 0xff, dtype=np.uint8)
+    assert pack_marker_runs(64, [(2, 10)], [], out=out) is out
+    assert np.array_equal(out, pack_markers(_runs_to_array(64, [(2, 10)]), np.zeros(64, dtype=np.uint8)))
+
+
+def test_runs_outside_segment():
+    with pytest.raises(AssertionError):
+        pack_marker_runs(64, [(0, 65)], [])
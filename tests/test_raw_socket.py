@@ -0,0 +1,112 @@
+import socket
+import threading
+import numpy as np
+import pytest
+from tevisainst import TEVisaInst
+
+IDN = b'Tabor Electronics,P9484M,0001,1.0'
+
+
+class ScpiServer:
+    """
+    Local TCP responder speaking the instrument's line/IEEE-block protocol:
+    records commands and received blocks, answers *IDN?, *OPC? and
+    :DIG:DATA:READ? (with `block`).
+    """
+    def __init__(self, block=b''):
+        self.block = block
+        self.received = []
+        self._sock = socket.socket()
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(1)
+        self.port = self._sock.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        conn, _ = self._sock.accept()
+        buf = bytearray()
+
+        def need(n):
+            while len(buf) < n:
+                data = conn.recv(1 << 20)
+                if not data:
+                    raise EOFError
+                buf.extend(data)
+
+        try:
+            while True:
+                need(1)
+                while b'\n' not in buf and b'#' not in buf:
+                    need(len(buf) + 1)
+                nl, hs = buf.find(b'\n'), buf.find(b'#')
+                if hs >= 0 and (nl < 0 or hs < nl):
+                    need(hs + 2)
+                    digits = int(buf[hs + 1:hs + 2])
+                    need(hs + 2 + digits)
+                    start = hs + 2 + digits
+                    nbytes = int(buf[hs + 2:start])
+                    need(start + nbytes + 1)
+                    self.received.append((buf[:hs].decode(), bytes(buf[start:start + nbytes])))
+                    del buf[:start + nbytes + 1]
+                    continue
+                line = buf[:nl].decode()
+                del buf[:nl + 1]
+                self.received.append(line)
+                if line == '*IDN?':
+                    conn.sendall(IDN + b'\n')
+                elif line.endswith('*OPC?'):
+                    conn.sendall(b'1\n')
+                elif 'READ?' in line:
+                    size = str(len(self.block)).encode()
+                    conn.sendall(b'#' + str(len(size)).encode() + size + self.block + b'\n')
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def close(self):
+        self._sock.close()
+        self._thread.join(5)
+
+
+@pytest.fixture
+def server():
+    server = ScpiServer(np.arange(300000, dtype=np.uint16).tobytes())
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def raw_inst(server):
+    inst = TEVisaInst('127.0.0.1', server.port, raw_socket=True)
+    yield inst
+    inst.close_instrument()
+
+
+def test_raw_socket_needs_a_socket_resource():
+    with pytest.raises(ValueError):
+        TEVisaInst('TCPIP::127.0.0.1::INSTR', raw_socket=True)
+
+
+def test_raw_socket_query_and_command(server, raw_inst):
+    assert raw_inst.send_scpi_query('*IDN?') == IDN.decode()
+    assert raw_inst.send_scpi_cmd(':INST:CHAN 1', paranoia_level=1) == 0
+    raw_inst.send_scpi_cmd(':OUTP ON', paranoia_level=0)
+    assert raw_inst.send_scpi_query('*IDN?') == IDN.decode()
+    assert server.received == ['*IDN?', ':INST:CHAN 1; *OPC?', ':OUTP ON', '*IDN?']
+
+
+def test_raw_socket_reads_block_into_buffer(server, raw_inst):
+    out = np.zeros(300000, dtype=np.uint16)
+    assert raw_inst.read_binary_data(':DIG:DATA:READ?', out, out.nbytes) == 0
+    assert out.tobytes() == server.block
+    # the connection is still in step afterwards
+    assert raw_inst.send_scpi_query('*IDN?') == IDN.decode()
+
+
+def test_raw_socket_writes_block(server, raw_inst):
+    data = np.arange(100000, dtype=np.uint16)
+    assert raw_inst.write_binary_data(':TRAC:DATA 0,', data, paranoia_level=0) == 0
+    assert raw_inst.send_scpi_query('*IDN?') == IDN.decode()
+    assert server.received[0] == (':TRAC:DATA 0,', data.tobytes())
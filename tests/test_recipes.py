@@ -0,0 +1,58 @@
+import numpy as np
+import proteus_recipes
+from conftest import FakeInst
+from proteus_recipes import RecipeBook
+
+
+def _setup(proteus, volt):
+    proteus.send_scpi_cmd(':INST:CHAN 1')
+    proteus.send_scpi_cmd(f':VOLT {volt}')
+    proteus.write_binary_data(':TRAC:DATA 0,', np.arange(64, dtype=np.uint16))
+    proteus.send_scpi_cmd(':OUTP ON')
+    proteus.sampleRateDAC = 2.5e9
+    return {'readLen': 1024}
+
+
+def test_record_then_replay_sends_the_same_stream(tmp_path, fake_inst, proteus, make_proteus):
+    book = RecipeBook(proteus, str(tmp_path))
+    params = {'volt': 0.5}
+    assert book.run('pulses', params, lambda: _setup(proteus, **params)) == {'readLen': 1024}
+    assert book.has('pulses', params)
+    recorded = [entry for entry in fake_inst.log if entry[0] == 'bin']
+
+    inst = FakeInst()
+    other = make_proteus(inst)
+    replay = RecipeBook(other, str(tmp_path))
+    ran = []
+    assert replay.run('pulses', params, lambda: ran.append(1)) == {'readLen': 1024}
+    assert ran == []
+    assert [entry for entry in inst.log if entry[0] == 'bin'] == recorded
+    sent = ';'.join(inst.commands())
+    for cmd in (':INST:CHAN 1', ':VOLT 0.5', ':OUTP ON'):
+        assert cmd in sent
+    assert other.sampleRateDAC == 2.5e9
+
+
+def test_key_depends_on_params_version_and_sources(tmp_path, proteus, monkeypatch):
+    book = RecipeBook(proteus, str(tmp_path))
+    key = book.key('pulses', {'volt': 0.5})
+    assert book.key('pulses', {'volt': 0.6}) != key
+
+    source = tmp_path / 'setup_module.py'
+    source.write_text('VOLT = 0.5\n')
+    before = RecipeBook(proteus, str(tmp_path), sources = [str(source)]).key('pulses', {'volt': 0.5})
+    source.write_text('VOLT = 0.6\n')
+    after = RecipeBook(proteus, str(tmp_path), sources = [str(source)]).key('pulses', {'volt': 0.5})
+    assert before != after
+
+    monkeypatch.setattr(proteus_recipes, 'RECIPE_VERSION', proteus_recipes.RECIPE_VERSION + 1)
+    assert book.key('pulses', {'volt': 0.5}) != key
+
+
+def test_recipe_keeps_settings_the_cache_elides(tmp_path, fake_inst, proteus):
+    # a setting already in effect must still end up in the recipe
+    proteus.send_scpi_cmd(':VOLT 0.5')
+    book = RecipeBook(proteus, str(tmp_path))
+    book.record('volt', {}, lambda: proteus.send_scpi_cmd(':VOLT 0.5'))
+    recipe = book.load(book.key('volt', {}))
+    assert ['cmd', ':VOLT 0.5'] in recipe['ops']
@@ -0,0 +1,72 @@
+import os
+import multiprocessing
+import numpy as np
+import pytest
+from result_store import ResultStore
+
+
+@pytest.fixture
+def results(tmp_path):
+    results = ResultStore(str(tmp_path))
+    results.append({'cfr': 100e6, 'tag': 'a', 'opt': None, 'pulse': {'amp': 0.5}}, I = np.zeros(4))
+    results.append({'cfr': 101e6, 'tag': 'b', 'opt': 5, 'pulse': {'amp': 0.7}}, I = np.ones(4))
+    results.append({'cfr': 102e6, 'tag': 'c', 'opt': 7, 'mixed': 'x'}, I = np.ones(3))
+    results.append({'cfr': 103e6, 'tag': 'c', 'mixed': 3}, I = np.ones(4))
+    return results
+
+
+def test_numeric_ranges(results):
+    assert results.query(cfr=(100.5e6, 102e6)).tolist() == [1, 2]
+    assert results.query(cfr=(None, 100e6)).tolist() == [0]
+    assert results.query(cfr=(101e6, None), tag='c').tolist() == [2, 3]
+
+
+def test_missing_values_never_match(results):
+    assert results.query(opt=(None, None)).tolist() == [1, 2]
+    assert results.query(opt=(6, None)).tolist() == [2]
+
+
+def test_string_ranges_compare_lexically(results):
+    assert results.query(tag=('b', 'c')).tolist() == [1, 2, 3]
+    assert results.query(tag='a').tolist() == [0]
+
+
+def test_mixed_range_is_rejected(results):
+    with pytest.raises(ValueError, match="mixed"):
+        results.query(mixed=(0, 5))
+    with pytest.raises(ValueError, match="tag"):
+        results.query(tag=(0, 5))
+
+
+def test_flattened_and_unknown_columns(results):
+    assert results.query(**{'pulse.amp': (0.6, None)}).tolist() == [1]
+    assert results.query(nonexistent=1).tolist() == []
+
+
+def test_index_is_shared_between_stores(results, tmp_path):
+    reader = ResultStore(str(tmp_path))
+    assert len(reader) == 4
+    results.append({'cfr': 104e6}, I = np.ones(4))
+    assert reader.query(cfr=(104e6, None)).tolist() == [4]
+    assert reader.stack('I', [1, 3]).shape == (2, 4)
+    assert isinstance(reader.stack('I', [1, 2]), list)
+
+
+def _append_runs(root, count):
+    results = ResultStore(root)
+    for _ in range(count):
+        results.append({'pid': os.getpid()}, I = np.zeros(2))
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_concurrent_appends_get_distinct_ids(tmp_path):
+    root = str(tmp_path)
+    procs = [multiprocessing.get_context('fork').Process(target=_append_runs, args=(root, 20)) for _ in range(4)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join(30)
+    results = ResultStore(root)
+    assert len(results) == 80
+    assert results.index()['run_id'].tolist() == list(range(80))
+    assert results.meta(79)['run_id'] == 79
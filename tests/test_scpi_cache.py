@@ -0,0 +1,86 @@
+from scpi_cache import SCPIStateCache, parse_scpi
+
+
+def test_parse_normalizes_short_and_long_forms():
+    assert parse_scpi(':SOUR:FREQ:RAST 9E9') == parse_scpi(':FREQuency:RASTer 9000000000')
+    assert parse_scpi('*OPC') == (None, None)
+    assert parse_scpi(':DIG:FREQ?') == (None, None)
+
+
+def test_repeated_setting_is_redundant():
+    cache = SCPIStateCache()
+    assert not cache.is_redundant(':VOLT 0.5')
+    cache.update(':VOLT 0.5')
+    assert cache.is_redundant(':VOLT 0.5')
+    assert cache.is_redundant(':VOLTage 5E-1')
+    assert not cache.is_redundant(':VOLT 0.6')
+    assert cache.saved == 2
+
+
+def test_actions_are_never_redundant():
+    cache = SCPIStateCache()
+    cache.update(':TRAC:DEF 1,1024')
+    assert not cache.is_redundant(':TRAC:DEF 1,1024')
+    cache.update(':DIG:INIT ON')
+    assert not cache.is_redundant(':DIG:INIT ON')
+
+
+def test_settings_are_keyed_by_selected_channel():
+    cache = SCPIStateCache()
+    cache.update(':INST:CHAN 1')
+    cache.update(':VOLT 0.5')
+    cache.update(':INST:CHAN 2')
+    assert not cache.is_redundant(':VOLT 0.5')
+    cache.update(':VOLT 0.5')
+    cache.update(':INST:CHAN 1')
+    assert cache.is_redundant(':VOLT 0.5')
+
+
+def test_trigger_settings_are_keyed_by_selected_trigger(proteus, fake_inst):
+    sequence = [':TRIG:ACTIVE:SEL TRG1', ':TRIG:LEV 0.5', ':TRIG:ACTIVE:STAT ON',
+                ':TRIG:ACTIVE:SEL TRG2', ':TRIG:LEV 0.5', ':TRIG:ACTIVE:STAT ON']
+    for cmd in sequence:
+        proteus.send_scpi_cmd(cmd)
+    assert fake_inst.commands() == sequence
+    proteus.send_scpi_cmd(':TRIG:ACTIVE:SEL TRG1')
+    proteus.send_scpi_cmd(':TRIG:LEV 0.5')
+    assert fake_inst.commands()[len(sequence):] == [':TRIG:ACTIVE:SEL TRG1']
+
+
+def test_dependent_paths_are_forgotten():
+    cache = SCPIStateCache()
+    cache.update(':FREQ:RAST 9E9')
+    cache.update(':INT X8')
+    assert not cache.is_redundant(':FREQ:RAST 9E9')
+
+
+def test_failed_command_is_not_cached():
+    cache = SCPIStateCache()
+    cache.update(':VOLT 0.5', ret_code=-1)
+    assert not cache.is_redundant(':VOLT 0.5')
+
+
+def test_invalidation():
+    cache = SCPIStateCache()
+    cache.update(':VOLT 0.5')
+    cache.invalidate()
+    assert not cache.is_redundant(':VOLT 0.5')
+    cache.update(':VOLT 0.5')
+    cache.update('*RST')
+    assert not cache.is_redundant(':VOLT 0.5')
+
+
+def test_disabled_cache_sends_everything():
+    cache = SCPIStateCache(enabled=False)
+    cache.update(':VOLT 0.5')
+    assert not cache.is_redundant(':VOLT 0.5')
+
+
+def test_proteus_drops_redundant_commands(proteus, fake_inst):
+    proteus.send_scpi_cmd(':INST:CHAN 1')
+    proteus.send_scpi_cmd(':VOLT 0.5')
+    proteus.send_scpi_cmd(':VOLT 0.5')
+    assert fake_inst.commands() == [':INST:CHAN 1', ':VOLT 0.5']
+    proteus.send_scpi_cmd('*RST')
+    proteus.send_scpi_cmd(':VOLT 0.5')
+    assert fake_inst.commands()[-2:] == ['*RST', ':VOLT 0.5']
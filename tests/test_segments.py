@@ -0,0 +1,62 @@
+import numpy as np
+
+
+def _block(amp=0.5, marker=1):
+    pulse = {'length': 1e-6, 'spacing': 1e-6, 'phase': 0, 'amp': amp, 'mod': 0}
+    return {'pulse_l': [pulse], 'reps': [1], 'trigs': [0], 'markers': [marker]}
+
+
+def _binary(fake_inst, start=0):
+    # (kind of binary block, channel selected when it was sent) of the
+    # blocks logged from entry `start` on
+    writes, ch = [], None
+    for idx, entry in enumerate(fake_inst.log):
+        if entry[0] == 'cmd':
+            for cmd in entry[1].split(';'):
+                if cmd.strip().startswith(':INST:CHAN'):
+                    ch = int(cmd.split()[-1])
+        elif entry[0] == 'bin' and idx >= start:
+            writes.append(('iq' if 'TRAC:DATA' in entry[1] else 'marker', ch))
+    return writes
+
+
+def test_unchanged_segments_are_not_downloaded_again(proteus, fake_inst):
+    proteus.makeBlocks([_block()], 1, [1])
+    first = _binary(fake_inst)
+    assert ('iq', 1) in first and ('marker', 1) in first
+    start = len(fake_inst.log)
+    proteus.makeBlocks([_block()], 1, [1])
+    assert _binary(fake_inst, start) == []
+
+
+def test_marker_change_rewrites_markers_only(proteus, fake_inst):
+    proteus.makeBlocks([_block(marker=1)], 1, [1])
+    start = len(fake_inst.log)
+    proteus.makeBlocks([_block(marker=0)], 1, [1])
+    assert _binary(fake_inst, start) == [('marker', 1)]
+
+
+def test_channel_of_the_same_bank_overwrites_segments(proteus, fake_inst):
+    # channels 1 and 2 share segment memory: ch2's segments replace ch1's
+    proteus.makeBlocks([_block(amp=0.5)], 1, [1])
+    proteus.makeBlocks([_block(amp=0.7)], 2, [1])
+    start = len(fake_inst.log)
+    proteus.makeBlocks([_block(amp=0.5)], 1, [1])
+    writes = _binary(fake_inst, start)
+    assert writes.count(('iq', 1)) == writes.count(('marker', 1)) == 3
+
+
+def test_other_bank_keeps_segments(proteus, fake_inst):
+    proteus.makeBlocks([_block(amp=0.5)], 1, [1])
+    proteus.makeBlocks([_block(amp=0.7)], 3, [1])
+    start = len(fake_inst.log)
+    proteus.makeBlocks([_block(amp=0.5)], 1, [1])
+    assert _binary(fake_inst, start) == []
+
+
+def test_reset_forgets_segments(proteus, fake_inst):
+    proteus.makeBlocks([_block()], 1, [1])
+    proteus.send_scpi_cmd('*RST')
+    start = len(fake_inst.log)
+    proteus.makeBlocks([_block()], 1, [1])
+    assert ('iq', 1) in _binary(fake_inst, start)
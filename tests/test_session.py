@@ -0,0 +1,103 @@
+import os
+import stat
+import socket
+import threading
+import numpy as np
+import pytest
+from conftest import FakeInst
+from proteus_session import SessionDaemon, SessionClient, attach, default_address
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='needs Unix sockets')
+
+
+class ReadInst(FakeInst):
+    def read_binary_data(self, prefix, out_array, num_bytes):
+        super().read_binary_data(prefix, out_array, num_bytes)
+        out_array[:num_bytes] = np.arange(num_bytes) % 251
+        return 0
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    daemon = SessionDaemon(ReadInst(), address = str(tmp_path / 'proteus.sock'), description = 'fake')
+    thread = threading.Thread(target=daemon.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield daemon
+    daemon.shutdown()
+    daemon.server_close()
+    thread.join(5)
+
+
+def test_socket_is_private(daemon):
+    assert stat.S_IMODE(os.stat(daemon.address).st_mode) == 0o600
+
+
+def test_round_trip(daemon):
+    with SessionClient(daemon.address) as client:
+        assert client.description == 'fake'
+        assert client.send_scpi_cmd(':INST:CHAN 2', 0) == 0
+        assert client.send_scpi_query(':SYST:ERR?') == '0, no error'
+        data = np.arange(1000, dtype=np.uint16)
+        assert client.write_binary_data(':TRAC:DATA', data) == 0
+        out = np.zeros(300, dtype=np.uint8)
+        assert client.read_binary_data(':DIG:DATA:READ?', out, 256) == 0
+        assert np.array_equal(out[:256], np.arange(256) % 251) and not out[256:].any()
+    log = daemon.inst.log
+    assert log[0] == ('cmd', ':INST:CHAN 2', 0)
+    assert log[2] == ('bin', ':TRAC:DATA', data.tobytes())
+    assert log[3] == ('read', ':DIG:DATA:READ?', 256)
+
+
+def test_exclusive_keeps_other_clients_out(daemon):
+    with SessionClient(daemon.address) as first, SessionClient(daemon.address) as second:
+        with first.exclusive():
+            first.send_scpi_cmd(':TRAC:SEL 1')
+            thread = threading.Thread(target=second.send_scpi_cmd, args=(':TRAC:SEL 2',))
+            thread.start()
+            thread.join(0.2)
+            assert thread.is_alive()
+            first.send_scpi_cmd(':TRAC:DATA')
+        thread.join(5)
+    assert daemon.inst.commands() == [':TRAC:SEL 1', ':TRAC:DATA', ':TRAC:SEL 2']
+
+
+def test_client_exit_releases_lock(daemon):
+    first = SessionClient(daemon.address)
+    first._request(7)   # OP_LOCK, never unlocked
+    first.close_instrument()
+    with SessionClient(daemon.address, timeout = 5) as second:
+        assert second.send_scpi_cmd('*CLS') == 0
+
+
+def test_errors_are_reported(daemon):
+    daemon.inst.send_scpi_query = None
+    with SessionClient(daemon.address) as client:
+        with pytest.raises(RuntimeError, match='session daemon'):
+            client.send_scpi_query('*IDN?')
+        assert client.send_scpi_cmd('*CLS') == 0
+
+
+def test_default_address_is_per_user(monkeypatch, tmp_path):
+    monkeypatch.delenv('PROTEUS_SESSION', raising=False)
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path))
+    assert default_address() == str(tmp_path / 'proteus_session.sock')
+    monkeypatch.delenv('XDG_RUNTIME_DIR')
+    assert default_address().endswith(f'proteus_session-{os.getuid()}.sock')
+    monkeypatch.setenv('PROTEUS_SESSION', 'localhost:6000')
+    assert default_address() == ('localhost', 6000)
+
+
+def test_attach_without_daemon(tmp_path):
+    assert attach(str(tmp_path / 'missing.sock')) is None
+
+
+def test_proteus_on_a_session_does_not_cache(daemon):
+    from TaborProteus import TaborProteus
+    proteus = TaborProteus(inst = attach(daemon.address))
+    try:
+        assert proteus.shared_session
+        proteus.send_scpi_cmd(':VOLT 0.5')
+        proteus.send_scpi_cmd(':VOLT 0.5')
+    finally:
+        proteus.inst.close_instrument()
+    assert daemon.inst.commands() == [':VOLT 0.5', ':VOLT 0.5']
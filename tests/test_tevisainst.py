@@ -0,0 +1,72 @@
+import ctypes
+import types
+import numpy as np
+import pytest
+import tevisainst
+from tevisainst import TEVisaInst
+
+
+class FakeVisaLib:
+    def __init__(self, log):
+        self.log = log
+
+    def viWrite(self, session, ptr, count, ret_count):
+        self.log.append(('write', ctypes.string_at(ptr, count)))
+        ret_count._obj.value = count
+        return 0
+
+
+class FakeVisaSession:
+    """
+    pyvisa resource stand-in recording writes and the END attribute.
+    """
+    session = 1
+
+    def __init__(self):
+        self.log = []
+        self.visalib = FakeVisaLib(self.log)
+        self.timeout = 1000
+        self.send_end = True
+
+    def set_visa_attribute(self, attr, value):
+        if attr == 'SEND_END_EN':
+            self.send_end = value
+            self.log.append(('send_end', value))
+
+    def read(self):
+        return '1'
+
+
+@pytest.fixture
+def visa_inst(monkeypatch):
+    monkeypatch.setattr(tevisainst, 'vc', types.SimpleNamespace(VI_ATTR_SEND_END_EN='SEND_END_EN',
+                                                               VI_TRUE=True, VI_FALSE=False))
+    inst = TEVisaInst()
+    inst._vi = FakeVisaSession()
+    return inst
+
+
+def test_block_is_one_message(visa_inst):
+    data = np.arange(1000, dtype=np.uint16)
+    assert visa_inst.write_binary_data(':TRAC:DATA', data, paranoia_level=0, chunk_size=512) == 0
+    log = visa_inst._vi.log
+    writes = [entry[1] for entry in log if entry[0] == 'write']
+    assert writes[0] == b':TRAC:DATA#42000'
+    assert b''.join(writes[1:-1]) == data.tobytes() and len(writes) == 6
+    assert writes[-1] == b'\n'
+    # END only with the final new-line
+    end = True
+    for entry in log:
+        if entry[0] == 'send_end':
+            end = entry[1]
+        elif entry[1] != b'\n':
+            assert not end
+        else:
+            assert end
+    assert visa_inst._vi.send_end
+
+
+def test_end_is_restored_after_a_failed_block(visa_inst):
+    with pytest.raises(ValueError):
+        visa_inst.write_binary_stream(':TRAC:DATA', [b'ab'], 4, paranoia_level=0)
+    assert visa_inst._vi.send_end
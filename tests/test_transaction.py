@@ -0,0 +1,92 @@
+import pytest
+from conftest import FakeInst
+
+
+class ErrorQueueInst(FakeInst):
+    """FakeInst whose :SYST:ERR? pops from an error queue."""
+    def __init__(self, errors=()):
+        super().__init__()
+        self.errors = list(errors)
+
+    def send_scpi_query(self, cmd, max_resp_len=256):
+        if 'SYST:ERR' in cmd:
+            self.log.append(('query', cmd))
+            return self.errors.pop(0) if self.errors else '0, no error'
+        return super().send_scpi_query(cmd, max_resp_len)
+
+
+def _err_queries(inst):
+    return [entry for entry in inst.log if entry[0] == 'query' and 'SYST:ERR' in entry[1]]
+
+
+def test_transaction_defers_error_checks_to_commit(make_proteus):
+    inst = ErrorQueueInst()
+    proteus = make_proteus(inst)
+    with proteus.transaction():
+        proteus.send_scpi_cmd(':INST:CHAN 1')
+        proteus.check_errors('select')
+        proteus.send_scpi_cmd(':VOLT 0.5')
+        proteus.check_errors('volt')
+    # commands go out bare and the queue is drained once
+    assert all(entry[2] == 0 for entry in inst.log if entry[0] == 'cmd')
+    assert len(_err_queries(inst)) == 1
+
+
+def test_nested_transaction_drains_only_at_outer_commit(make_proteus):
+    inst = ErrorQueueInst()
+    proteus = make_proteus(inst)
+    with proteus.transaction():
+        with proteus.transaction():
+            proteus.send_scpi_cmd(':VOLT 0.5')
+        assert _err_queries(inst) == []
+    assert len(_err_queries(inst)) == 1
+
+
+def test_commit_raises_with_the_checked_groups(make_proteus):
+    inst = ErrorQueueInst(['-222, Data out of range'])
+    proteus = make_proteus(inst)
+    with pytest.raises(AssertionError) as err:
+        with proteus.transaction():
+            proteus.send_scpi_cmd(':INST:CHAN 1')
+            proteus.check_errors('select')
+            proteus.send_scpi_cmd(':VOLT 9')
+            proteus.check_errors('volt')
+    msg = str(err.value)
+    assert '-222' in msg and 'select' in msg and 'volt' in msg
+    # the failed command may not have taken effect
+    assert not proteus.state_cache.is_redundant(':VOLT 9')
+
+
+def test_attributed_transaction_names_the_failing_group(make_proteus):
+    inst = ErrorQueueInst()
+    proteus = make_proteus(inst)
+    with pytest.raises(AssertionError) as err:
+        with proteus.transaction(attribute = True):
+            proteus.send_scpi_cmd(':INST:CHAN 1')
+            proteus.check_errors('select')
+            inst.errors.append('-222, Data out of range')
+            proteus.send_scpi_cmd(':VOLT 9')
+            proteus.check_errors('volt')
+    msg = str(err.value)
+    assert 'volt' in msg and 'select' not in msg
+
+
+def test_non_strict_errors_are_only_reported(capsys, make_proteus):
+    inst = ErrorQueueInst(['-222, Data out of range'])
+    proteus = make_proteus(inst)
+    with proteus.transaction():
+        proteus.send_scpi_cmd(':VOLT 9')
+        proteus.check_errors('volt', strict = False)
+    assert 'volt' in capsys.readouterr().out
+
+
+def test_exception_aborts_transaction(make_proteus):
+    inst = ErrorQueueInst()
+    proteus = make_proteus(inst)
+    with pytest.raises(RuntimeError):
+        with proteus.transaction():
+            proteus.send_scpi_cmd(':VOLT 0.5')
+            raise RuntimeError('boom')
+    assert inst.commands()[-1] == '*CLS'
+    assert proteus._txn is None and proteus._txn_depth == 0
+    assert not proteus.state_cache.is_redundant(':VOLT 0.5')
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+from conftest import FakeInst
+from proteus_transport import (LanTransport, PxiTransport, SessionTransport, Transport,
+                               open_transport)
+
+
+class FakeLan(FakeInst):
+    """TEVisaInst stand-in: records the keyword arguments of binary calls."""
+    def write_binary_data(self, prefix, data, paranoia_level=None, chunk_size=None):
+        self.log.append(('bin', prefix, bytes(memoryview(data).cast('B')), paranoia_level, chunk_size))
+        return 0
+
+    def write_binary_stream(self, prefix, chunks, num_bytes, paranoia_level=None, progress=None):
+        data = b''.join(bytes(memoryview(chunk).cast('B')) for chunk in chunks)
+        assert len(data) == num_bytes
+        self.log.append(('stream', prefix, data, paranoia_level))
+        return 0
+
+    def read_binary_data(self, prefix, out_array, num_bytes=None):
+        self.log.append(('read', prefix, out_array.dtype, out_array.nbytes))
+        return 0
+
+
+class FakePxi(FakeInst):
+    def acquire_stream_intf(self):
+        pass
+
+
+class FakeSession(FakeInst):
+    def shutdown_daemon(self):
+        pass
+
+
+@pytest.mark.parametrize('inst, cls', [(FakeLan(), LanTransport), (FakeSession(), SessionTransport),
+                                       (FakePxi(), PxiTransport), (FakeInst(), Transport)])
+def test_open_transport_picks_by_capability(inst, cls):
+    transport = open_transport(inst)
+    assert type(transport) is cls
+    assert open_transport(transport) is transport
+    assert transport.inst is inst
+
+
+def test_capabilities():
+    assert open_transport(FakeLan()).capabilities['streaming']
+    assert open_transport(FakeLan()).capabilities['max_block'] > 0
+    assert open_transport(FakeSession()).capabilities == {'streaming': False, 'max_block': None,
+                                                          'zero_copy': False}
+    assert not open_transport(FakePxi()).streaming
+
+
+def test_transport_forwards_instrument_attributes():
+    inst = FakePxi()
+    inst.slot_info = {'slot_id': 3}
+    transport = open_transport(inst)
+    assert transport.slot_info == {'slot_id': 3}
+    transport.default_paranoia_level = 2
+    assert inst.default_paranoia_level == 2
+
+
+def test_gathered_stream_is_one_block(fake_inst):
+    transport = open_transport(fake_inst)
+    chunks = [np.arange(4, dtype=np.uint16), np.arange(4, 8, dtype=np.uint16)[::-1]]
+    assert transport.write_binary_stream(':TRAC:DATA', chunks, 16) == 0
+    assert fake_inst.log == [('bin', ':TRAC:DATA', np.concatenate(chunks).tobytes())]
+    with pytest.raises(AssertionError):
+        transport.write_binary_stream(':TRAC:DATA', chunks, 18)
+
+
+def test_lan_prefix_sets_paranoia_level():
+    inst = FakeLan()
+    transport = LanTransport(inst, max_block = 1024)
+    data = np.arange(8, dtype=np.uint16)
+    transport.write_binary_data('*OPC?; :TRAC:DATA', data)
+    transport.write_binary_data(':TRAC:DATA', data[::2])
+    transport.write_binary_stream(':MARK:DATA', [data], data.nbytes)
+    assert inst.log == [('bin', ':TRAC:DATA', data.tobytes(), 1, 1024),
+                        ('bin', ':TRAC:DATA', data[::2].tobytes(), 0, 1024),
+                        ('stream', ':MARK:DATA', data.tobytes(), 0)]
+
+
+def test_lan_read_fills_exactly_num_bytes():
+    inst = FakeLan()
+    out = np.zeros(100, dtype=np.uint16)
+    assert open_transport(inst).read_binary_data(':DIG:DATA:READ?', out, 150) == 0
+    assert inst.log == [('read', ':DIG:DATA:READ?', np.uint8, 150)]
+    with pytest.raises(AssertionError):
+        open_transport(inst).read_binary_data(':DIG:DATA:READ?', out, 201)
+
+
+def test_proteus_talks_through_a_transport(fake_inst, proteus):
+    assert isinstance(proteus.inst, Transport) and proteus.inst.inst is fake_inst
@@ -57,4 +57,17 @@ def get_markers(on_t, off_t, sampleRateDAC):
     mark_off1, mark_off2 = np.zeros(spacingPt), np.zeros(spacingPt)
     mark1 = np.concatenate((mark_on1, mark_off1)).astype(np.uint8)
     mark2 = np.concatenate((mark_on2, mark_off2)).astype(np.uint8)
-    return mark1, mark2
\ No newline at end of file
+    return mark1, mark2
+
+def get_marker_runs(on_t, off_t, sampleRateDAC):
+    """
+    Run-length version of get_markers (see proteus_utils.pack_marker_runs)
+    
+    Returns:
+        segLen: segment length in samples
+        runs1, runs2: (start, stop) intervals where marker 1 / marker 2 is high
+    """
+    lengthPt = int(sampleRateDAC * on_t // 64 * 64)
+    spacingPt = int(sampleRateDAC * off_t // 64 * 64)
+    runs = [(0, lengthPt)]
+    return lengthPt + spacingPt, runs, list(runs)